@@ -0,0 +1,66 @@
+"""Time how long a txt2img request body takes to serialize with 0-5 vibe transfer references.
+
+Run from the repository root: python benchmarks/bench_request_serialization.py
+"""
+import base64
+import io
+import json
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core import fast_json # noqa: E402
+from core.vibe_references import get_reference, dumps_with_fragments # noqa: E402
+
+REPEATS = 20
+
+def synthetic_reference(seed: int) -> str:
+    """A 1216x832 noisy image, base64 encoded the way presets store uploads."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(832, 1216, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+def request_with(references: list) -> dict:
+    parameters = {
+        "width": 832, "height": 1216, "n_samples": 1, "seed": 1234567890, "sampler": "k_euler_ancestral",
+        "steps": 28, "scale": 5.0, "negative_prompt": "lowres, bad anatomy, " * 20, "noise_schedule": "karras",
+    }
+    if references:
+        parameters["reference_image_multiple"] = references
+        parameters["reference_information_extracted_multiple"] = [1.0] * len(references)
+        parameters["reference_strength_multiple"] = [0.6] * len(references)
+    return {"input": "1girl, solo, masterpiece, " * 20, "model": "nai-diffusion-4-5-full", "action": "generate", "parameters": parameters}
+
+def best_ms(func) -> float:
+    return min(timeit.repeat(func, number=1, repeat=REPEATS)) * 1000
+
+def main():
+    raw_images = [synthetic_reference(seed) for seed in range(5)]
+    normalized = [get_reference(image) for image in raw_images] # Warm the cache, as after a preset's first use
+    backends = [backend for backend in ("orjson", "msgspec") if getattr(fast_json, backend) is not None] + ["json"]
+
+    print(f"{'refs':>4} {'raw body':>10} {'json.dumps raw':>15} " + " ".join(f"{backend + ' cached':>15}" for backend in backends) + f" {'body':>9}")
+    for count in range(6):
+        raw_request = request_with(raw_images[:count])
+        cached_request = request_with(normalized[:count])
+        raw_size = len(json.dumps(raw_request))
+        # What aiohttp's json= argument did for every attempt before
+        baseline = best_ms(lambda: json.dumps(raw_request).encode("utf-8"))
+
+        timings = []
+        for backend in backends:
+            fast_json.BACKEND = backend
+            timings.append(best_ms(lambda: dumps_with_fragments(cached_request)))
+        body_size = len(dumps_with_fragments(cached_request))
+
+        print(f"{count:>4} {raw_size / 1024:>8.0f}KB {baseline:>13.2f}ms " + " ".join(f"{timing:>13.2f}ms" for timing in timings) + f" {body_size / 1024:>7.0f}KB")
+
+if __name__ == "__main__":
+    main()
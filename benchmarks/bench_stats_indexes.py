@@ -0,0 +1,88 @@
+"""Time NAIStatsManager lookups on a 100k entry history, against the full scans they replaced.
+
+The stats files are written to a temporary directory, the bot's database is not touched.
+Run from the repository root: python benchmarks/bench_stats_indexes.py
+"""
+import logging
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stats_fixtures import use_temporary_stats_dir # noqa: E402
+
+ENTRIES = 100_000
+USERS = 1_000
+CALLS = 1_000
+
+def make_entry(nai_stats, i: int, start: datetime):
+    return nai_stats.NAIGenerationHistory(
+        generation_id=f"generation-{i}",
+        timestamp=(start + timedelta(seconds=30 * i)).isoformat(),
+        user_id=random.randrange(USERS),
+        generation_time=random.uniform(3, 20),
+        parameters=nai_stats.GenerationParameters(
+            positive_prompt="1girl, solo", negative_prompt="lowres", width=832, height=1216, steps=28, cfg=5.0,
+            sampler="k_euler_ancestral", noise_schedule="karras", smea="", seed=i, model="nai-diffusion-4-5-full",
+            quality_toggle=True, undesired_content="", prompt_conversion=False, upscale=False, decrisper=False,
+            variety_plus=False,
+        ),
+        result=nai_stats.GenerationResult(success=True, error_message=None, database_message_id=10**17 + i, attempts_made=1),
+    )
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    random.seed(0)
+    use_temporary_stats_dir(Path(tempfile.mkdtemp(prefix="nai-stats-bench-")))
+    from core import nai_stats
+    logging.getLogger("bot").setLevel(logging.ERROR) # add_generation logs every skipped duplicate
+
+    manager = nai_stats.stats_manager
+    manager.load_data()
+    start = datetime(2025, 1, 1)
+    build_ms = timed(lambda: [manager.add_generation(make_entry(nai_stats, i, start)) for i in range(ENTRIES)])
+    print(f"Built a {ENTRIES} entry history for {USERS} users in {build_ms:.0f}ms")
+
+    history = manager.history
+    duplicates = [make_entry(nai_stats, random.randrange(ENTRIES), start) for _ in range(CALLS)]
+    users = [random.randrange(USERS) for _ in range(CALLS)]
+
+    def scan_duplicates():
+        for entry in duplicates:
+            next((h for h in history if h.database_message_id == entry.result.database_message_id), None)
+
+    def scan_user_history():
+        for user_id in users:
+            sorted((h for h in history if h.user_id == user_id), key=lambda x: x.time_key, reverse=True)[:10]
+
+    def scan_generation_id():
+        for entry in duplicates:
+            next((h for h in history if h.generation_id == entry.generation_id), None)
+
+    rows = [
+        ("duplicate check (add_generation)", scan_duplicates, lambda: [manager.add_generation(entry) for entry in duplicates]),
+        ("get_user_history(limit=10)", scan_user_history, lambda: [manager.get_user_history(user_id) for user_id in users]),
+        ("lookup by generation_id", scan_generation_id, lambda: [manager.get_generation(entry.generation_id) for entry in duplicates]),
+    ]
+    print(f"{'operation':<34} {'full scan':>12} {'indexed':>12} {'per call':>10}")
+    for name, scan, indexed in rows:
+        scan_ms = timed(scan)
+        indexed_ms = timed(indexed)
+        print(f"{name:<34} {scan_ms:>10.0f}ms {indexed_ms:>10.1f}ms {indexed_ms * 1000 / CALLS:>8.1f}us")
+
+    overwrites = [make_entry(nai_stats, random.randrange(ENTRIES), start) for _ in range(100)]
+    overwrite_ms = timed(lambda: [manager.add_generation(entry, overwrite=True) for entry in overwrites])
+    print(f"{'overwrite (add_generation)':<34} {'':>12} {overwrite_ms:>10.1f}ms {overwrite_ms * 1000 / len(overwrites):>8.1f}us")
+    issues = manager.verify_stats_integrity()
+    print(f"Indexes and stats consistent after overwrites: {not any(issues.values())}")
+
+if __name__ == "__main__":
+    main()
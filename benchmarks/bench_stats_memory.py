@@ -0,0 +1,67 @@
+"""Measure the memory held by the generation history, as full NAIGenerationHistory dataclasses
+against the compact, interned CompactGeneration entries NAIStatsManager keeps.
+
+Entries are decoded from JSON one by one, like they are when the history log is loaded, so equal
+prompts are separate strings unless something shares them.
+Run from the repository root: python benchmarks/bench_stats_memory.py [--full-1m]
+The full representation takes a few GB at 1M entries, it is extrapolated from 100k unless --full-1m is given.
+"""
+import argparse
+import gc
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stats_fixtures import SyntheticHistory, use_temporary_stats_dir # noqa: E402
+
+use_temporary_stats_dir(Path(tempfile.mkdtemp(prefix="nai-stats-bench-")))
+from core import fast_json # noqa: E402
+from core.nai_stats import CompactGeneration, NAIGenerationHistory # noqa: E402
+
+SIZES = [100_000, 1_000_000]
+
+def measure(count: int, compact: bool) -> tuple[int, float]:
+    """(bytes held by `count` entries, seconds to build them)"""
+    synthetic = SyntheticHistory(count)
+    entries = (fast_json.dumps(synthetic.entry_dict(i)) for i in range(count))
+    gc.collect()
+    tracemalloc.start()
+    began = time.perf_counter()
+    pool = {}
+    if compact:
+        history = [CompactGeneration.from_history(NAIGenerationHistory.from_dict(fast_json.loads(entry)), pool) for entry in entries]
+    else:
+        history = [NAIGenerationHistory.from_dict(fast_json.loads(entry)) for entry in entries]
+    elapsed = time.perf_counter() - began
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del history, pool
+    return used, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full-1m", action="store_true", help="Measure the full representation at 1M entries instead of extrapolating")
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} {'full':>12} {'compact':>12} {'per entry':>16} {'saved':>7}")
+    full_per_entry = None
+    for count in SIZES:
+        if full_per_entry is None or args.full_1m:
+            full, _ = measure(count, compact=False)
+            full_per_entry = full / count
+            full_label = f"{full / 2**20:>10.0f}MB"
+        else:
+            full = full_per_entry * count
+            full_label = f"~{full / 2**20:>9.0f}MB"
+        compact, elapsed = measure(count, compact=True)
+        per_entry = f"{full / count:.0f}B -> {compact / count:.0f}B"
+        print(f"{count:>10} {full_label:>12} {compact / 2**20:>10.0f}MB {per_entry:>16} {1 - compact / full:>6.0%}")
+        print(f"{'':>10} built {count} compact entries in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Time the main NAIStatsManager operations on synthetic histories of 10k and 100k entries (1M with --sizes),
+and keep the results to compare runs over time.
+
+Every run is appended to benchmarks/results/stats_suite.jsonl with the commit it ran on, and each result is
+printed next to the previous run's of the same backend, size and case. The stats files are written to a
+temporary directory, the bot's database is not touched.
+Run from the repository root: python benchmarks/bench_stats_suite.py [--sizes 10000 100000 1000000] [--backend sqlite]
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import settings # noqa: E402
+from stats_fixtures import SyntheticHistory, use_temporary_stats_dir # noqa: E402
+
+RESULTS_FILE = Path(__file__).resolve().parent / "results" / "stats_suite.jsonl"
+OVERWRITES = 1_000
+QUERIES = 1_000
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def repeated(func, repeat: int) -> float:
+    """Median seconds of `repeat` runs."""
+    return statistics.median(timed(func) for _ in range(repeat))
+
+def current_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_size(nai_stats, manager_class, size: int, repeat: int) -> list[tuple[str, float, int]]:
+    """(case, seconds, operations) for one history size."""
+    use_temporary_stats_dir(Path(tempfile.mkdtemp(prefix=f"nai-stats-suite-{size}-")))
+    settings.STATS_BACKEND = "sqlite" if manager_class is nai_stats.SQLiteStatsManager else "log"
+    synthetic = SyntheticHistory(size)
+    entries = list(synthetic.entries())
+    rng = random.Random(1)
+    results = []
+
+    manager = manager_class(settings.STATS_DIR)
+    manager.load_data()
+    results.append(("add_generation", timed(lambda: [manager.add_generation(entry) for entry in entries]), size))
+    results.append(("save_data (full snapshot)", timed(lambda: manager.save_data(snapshot=True)), 1))
+
+    # Rewrites of existing entries, as the backfill commands do
+    overwrites = []
+    for entry in rng.sample([entry for entry in entries if entry.result.database_message_id is not None], OVERWRITES):
+        replacement = nai_stats.NAIGenerationHistory.from_dict(synthetic.entry_dict(size))
+        replacement.result.database_message_id = entry.result.database_message_id
+        overwrites.append(replacement)
+    results.append(("add_generation(overwrite=True)", timed(lambda: [manager.add_generation(entry, overwrite=True) for entry in overwrites]), OVERWRITES))
+    results.append(("save_data (incremental)", timed(manager.save_data), 1))
+    manager.save_data(snapshot=True)
+
+    def load():
+        loaded = manager_class(settings.STATS_DIR)
+        loaded.load_data()
+        if manager_class is nai_stats.SQLiteStatsManager:
+            loaded.store.close()
+    results.append(("load_data", repeated(load, repeat), 1))
+    results.append(("_recalculate_stats", repeated(manager._recalculate_stats, repeat), 1))
+
+    users = [synthetic.user_id() for _ in range(QUERIES)]
+    results.append(("get_user_history(limit=10)", repeated(lambda: [manager.get_user_history(user_id) for user_id in users], repeat), QUERIES))
+    results.append(("verify_stats_integrity", repeated(manager.verify_stats_integrity, repeat), 1))
+    if manager_class is nai_stats.SQLiteStatsManager:
+        manager.store.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000], help="History sizes to run")
+    parser.add_argument("--backend", choices=["log", "sqlite"], default="log")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of the repeatable cases, the median is kept")
+    parser.add_argument("--no-save", action="store_true", help=f"Do not append the results to {RESULTS_FILE.name}")
+    args = parser.parse_args()
+
+    use_temporary_stats_dir(Path(tempfile.mkdtemp(prefix="nai-stats-suite-")))
+    from core import nai_stats
+    logging.getLogger("bot").setLevel(logging.ERROR) # Overwrites and duplicates are logged one by one
+    manager_class = nai_stats.SQLiteStatsManager if args.backend == "sqlite" else nai_stats.NAIStatsManager
+
+    previous = {}
+    if RESULTS_FILE.exists():
+        for line in RESULTS_FILE.read_text().splitlines():
+            record = json.loads(line)
+            previous[(record["backend"], record["size"], record["case"])] = record
+
+    run = {"date": datetime.now().isoformat(timespec="seconds"), "commit": current_commit(), "python": platform.python_version()}
+    records = []
+    print(f"{'size':>9} {'case':<32} {'total':>10} {'per op':>12} {'previous':>12} {'change':>8}")
+    for size in args.sizes:
+        for case, seconds, operations in run_size(nai_stats, manager_class, size, args.repeat):
+            per_op_us = seconds / operations * 1e6
+            record = {**run, "backend": args.backend, "size": size, "case": case, "seconds": seconds, "per_op_us": per_op_us}
+            records.append(record)
+            before = previous.get((args.backend, size, case))
+            compared = ""
+            if before:
+                compared = f"{before['per_op_us']:>10.1f}us {per_op_us / before['per_op_us'] - 1:>+7.0%}"
+            print(f"{size:>9} {case:<32} {seconds * 1000:>8.0f}ms {per_op_us:>10.1f}us {compared}")
+
+    if not args.no_save:
+        RESULTS_FILE.parent.mkdir(exist_ok=True)
+        with open(RESULTS_FILE, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        print(f"Results appended to {RESULTS_FILE}")
+
+if __name__ == "__main__":
+    main()
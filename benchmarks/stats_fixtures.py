@@ -0,0 +1,122 @@
+"""Synthetic generation history for the stats benchmarks, and a temporary stats directory to run them in.
+
+core.nai_stats must only be imported after use_temporary_stats_dir, its singleton reads the settings on import.
+"""
+import itertools
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import settings
+
+# (value, weight), roughly what the bot sees
+MODELS = [
+    ("nai-diffusion-4-5-full", 55), ("nai-diffusion-4-5-curated", 20), ("nai-diffusion-4-full", 12),
+    ("nai-diffusion-3", 9), ("nai-diffusion-furry-3", 4),
+]
+SAMPLERS = [
+    ("k_euler_ancestral", 50), ("k_euler", 15), ("k_dpmpp_2s_ancestral", 15), ("k_dpmpp_2m_sde", 10),
+    ("k_dpmpp_2m", 5), ("ddim_v3", 5),
+]
+SIZES = [((832, 1216), 50), ((1216, 832), 20), ((1024, 1024), 20), ((512, 768), 10)]
+UC_PRESETS = [("heavy", 60), ("light", 25), ("human_focus", 10), ("none", 5)]
+NEGATIVE_PROMPTS = [
+    ("lowres, {bad}, error, fewer, extra, missing, worst quality, jpeg artifacts, bad quality, watermark, unfinished, displeasing", 60),
+    ("lowres, jpeg artifacts, worst quality, watermark, blurry, very displeasing", 25),
+    ("", 15),
+]
+ERRORS = ["NovelAI API Error: Too many requests", "NovelAI API Error: Internal server error", "Generation timed out"]
+# Share of the day's generations per hour, evenings are busiest
+HOURLY_ACTIVITY = [3, 2, 2, 1, 1, 1, 1, 2, 3, 3, 4, 4, 5, 5, 5, 5, 6, 6, 7, 8, 8, 7, 6, 4]
+TAGS = [
+    "1girl", "1boy", "solo", "long hair", "short hair", "looking at viewer", "smile", "blue eyes", "red eyes",
+    "outdoors", "indoors", "sky", "cherry blossoms", "school uniform", "masterpiece", "best quality",
+    "very aesthetic", "absurdres", "night", "city lights", "from above", "from below", "upper body",
+    "full body", "holding sword", "fantasy", "dress", "hat", "rain", "sunset", "portrait", "landscape",
+]
+
+def use_temporary_stats_dir(directory: Path):
+    settings.STATS_DIR = directory
+    settings.USER_STATS_DIR = directory / "user_stats"
+    settings.GLOBAL_STATS_DIR = directory / "global_stats"
+    settings.STATS_LOG_DIR = directory / "history_log"
+    settings.STATS_SNAPSHOT_FILE = directory / "nai_stats_snapshot.json"
+    settings.STATS_DB_FILE = directory / "nai_stats.sqlite3"
+    settings.STATS_BACKEND = "log"
+
+def _weighted(pairs: list) -> tuple[list, list]:
+    values, weights = zip(*pairs)
+    return list(values), list(itertools.accumulate(weights))
+
+class SyntheticHistory:
+    """A reproducible generation history. Users follow a Zipf-like distribution, a few heavy users
+    make most generations. Prompts repeat, popular ones much more often. Timestamps advance with the
+    entry number over `days` days, following a daily cycle."""
+
+    def __init__(self, count: int, seed: int = 0, users: int = 2_000, prompts: int = 20_000, guilds: int = 40,
+                 days: int = 180, start: datetime = datetime(2025, 1, 1)):
+        self.count = count
+        self.rng = random.Random(seed)
+        self.start = start
+        self.days = days
+        self.user_ids = [10**17 + 7919 * rank for rank in range(users)]
+        self.user_weights = list(itertools.accumulate(1 / (rank + 1) ** 1.1 for rank in range(users)))
+        self.prompts = [", ".join(self.rng.choices(TAGS, k=self.rng.randint(6, 30))) for _ in range(prompts)]
+        self.prompt_weights = list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(prompts)))
+        self.guild_ids = [None] + [10**18 + 104729 * rank for rank in range(guilds)]
+        self.guild_weights = list(itertools.accumulate([10] + [1 / (rank + 1) for rank in range(guilds)]))
+        self.hours = list(itertools.accumulate(HOURLY_ACTIVITY))
+        self.models, self.model_weights = _weighted(MODELS)
+        self.samplers, self.sampler_weights = _weighted(SAMPLERS)
+        self.sizes, self.size_weights = _weighted(SIZES)
+        self.presets, self.preset_weights = _weighted(UC_PRESETS)
+        self.negative_prompts, self.negative_weights = _weighted(NEGATIVE_PROMPTS)
+
+    def pick(self, values: list, cum_weights: list):
+        return self.rng.choices(values, cum_weights=cum_weights)[0]
+
+    def user_id(self) -> int:
+        return self.pick(self.user_ids, self.user_weights)
+
+    def timestamp(self, i: int) -> str:
+        day = self.start + timedelta(days=i * self.days // self.count)
+        hour = self.pick(range(24), self.hours)
+        return (day + timedelta(hours=hour, seconds=self.rng.randrange(3600))).isoformat()
+
+    def entry_dict(self, i: int) -> dict:
+        """Entry number i, in NAIGenerationHistory.to_dict() form."""
+        rng = self.rng
+        success = rng.random() < 0.97
+        width, height = self.pick(self.sizes, self.size_weights)
+        return {
+            "generation_id": f"{rng.getrandbits(128):032x}",
+            "timestamp": self.timestamp(i),
+            "user_id": self.user_id(),
+            "generation_time": rng.lognormvariate(1.8, 0.4) if success else 0.0,
+            "parameters": {
+                "positive_prompt": self.pick(self.prompts, self.prompt_weights),
+                "negative_prompt": self.pick(self.negative_prompts, self.negative_weights),
+                "width": width, "height": height,
+                "steps": rng.choice([23, 28, 28, 28]), "cfg": rng.choice([5.0, 5.0, 5.5, 6.0]),
+                "sampler": self.pick(self.samplers, self.sampler_weights),
+                "noise_schedule": rng.choice(["karras", "karras", "native", "exponential"]), "smea": "",
+                "seed": rng.randrange(10**10), "model": self.pick(self.models, self.model_weights),
+                "quality_toggle": rng.random() < 0.8, "undesired_content": "", "prompt_conversion": rng.random() < 0.05,
+                "upscale": rng.random() < 0.05, "decrisper": rng.random() < 0.03, "variety_plus": rng.random() < 0.15,
+                "vibe_transfer_used": rng.random() < 0.08, "undesired_content_preset": self.pick(self.presets, self.preset_weights),
+            },
+            "result": {
+                "success": success,
+                "error_message": None if success else rng.choice(ERRORS),
+                "database_message_id": 10**18 + i if success else None, # Failed jobs are never uploaded
+                "attempts_made": 1 if rng.random() < 0.95 else 2,
+                "anlas_cost": 0 if rng.random() < 0.8 else rng.choice([17, 20, 24]),
+            },
+            "guild_id": self.pick(self.guild_ids, self.guild_weights),
+        }
+
+    def entries(self):
+        """NAIGenerationHistory objects for entries 0 to count - 1."""
+        from core.nai_stats import NAIGenerationHistory
+        for i in range(self.count):
+            yield NAIGenerationHistory.from_dict(self.entry_dict(i))
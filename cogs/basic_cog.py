@@ -2,6 +2,7 @@ import discord
 import settings
 import asyncio
 import aiohttp
+import io
 import subprocess
 import sys
 import os
@@ -12,6 +13,9 @@ from core.shutdown_utils import shutdown_tasks
 from discord.ext import commands
 import json
 from core.viewhandler import Globals
+import core.queuehandler as queuehandler
+from core.cost_model import anlas_budget
+from core.nai_stats import stats_manager
 import settings
 
 # Build a list of discord.Object instances
@@ -223,7 +227,18 @@ class BASIC(commands.Cog):
         app_info = await self.bot.application_info()
         status["installed_users"] = app_info.approximate_user_install_count
         status["installed_guilds"] = app_info.approximate_guild_count
-        await interaction.response.send_message(f"Bot Status:\n```json\n{json.dumps(status, indent=4)}\n```", ephemeral=True)
+        if queuehandler.nai_queue:
+            status["queue"] = queuehandler.nai_queue.status_summary()
+        status["anlas"] = anlas_budget.status_summary()
+        if stats_manager.aggregates_loaded.is_set():
+            status["latency"] = stats_manager.get_global_stats().latency.status_summary(settings.STATUS_LATENCY_MODELS)
+        content = f"Bot Status:\n```json\n{json.dumps(status, indent=4)}\n```"
+        if len(content) > 2000:
+            # Past Discord's message limit, send it as a file instead
+            status_file = discord.File(io.BytesIO(json.dumps(status, indent=4).encode()), filename="status.json")
+            await interaction.response.send_message("Bot Status:", file=status_file, ephemeral=True)
+            return
+        await interaction.response.send_message(content, ephemeral=True)
 
     @app_commands.command(name="logs", description="Get the bot's logs")
     @app_commands.guilds(*_allowed_guilds)
@@ -16,16 +16,17 @@ from core.queuehandler import nai_queue
 import random
 import json
 import uuid
-from core.viewhandler import VibeTransferView
+from core.viewhandler import VibeTransferView, HistoryView
 from core.checking_params import check_params
 import core.dict_annotation as da
 from core.nai_vars import Nai_vars
 from core.nai_stats import stats_manager
-import matplotlib
-matplotlib.use('Agg')  # Use Agg backend to avoid needing GUI
-import matplotlib.pyplot as plt
+from core.leaderboard import LeaderboardOptIns
+from core.charts import chart_renderer
+from core.latency_sketch import format_quantiles
+from core.vibe_references import normalize_reference_bytes
 import io
-from datetime import datetime, timezone # Import datetime and timezone here
+from datetime import datetime, timedelta, timezone # Import datetime and timezone here
 
 # Import utility functions
 from core.nai_utils import prompt_to_nai, calculate_resolution
@@ -35,6 +36,9 @@ BLUE = discord.Color.blue()
 GREEN = discord.Color.green()
 GOLD = discord.Color.gold()
 
+# /nai-leaderboard periods, "all" is the lifetime leaderboard, the others are the stats manager's windowed ones
+LEADERBOARD_PERIODS = {"all": "All Time", "week": "This Week", "month": "This Month", "30d": "Last 30 Days"}
+
 class NAI(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
@@ -44,7 +48,7 @@ class NAI(commands.Cog):
             raise RuntimeError("Please ensure that NAI_ACCESS_TOKEN is set in your .env file.")
         
         self.output_dir = "nai_output"
-        self.leaderboard_opt_file = Path("database/leaderboard_opt_status.json")
+        self.leaderboard_opt_ins = LeaderboardOptIns(Path("database/leaderboard_opt_status.json"))
 
         # Run vibe transfer data migration on cog load
         asyncio.create_task(self.migrate_vibe_transfer_data())
@@ -450,6 +454,30 @@ class NAI(commands.Cog):
         return results[:25]
 
 
+    @app_commands.command(name="nai-cancel", description="Cancel your queued or running NAI requests")
+    @app_commands.describe(
+        all_requests="Cancel every request you have in the queue instead of only the most recent one"
+    )
+    async def nai_cancel(self, interaction: discord.Interaction, all_requests: bool = False):
+        """Cancel the user's most recent request, or all of them"""
+        logger.info(f"COMMAND 'NAI-CANCEL' USED BY: {interaction.user} ({interaction.user.id})")
+
+        await interaction.response.defer(ephemeral=True)
+
+        request_ids = nai_queue.user_requests(interaction.user.id)
+        if not request_ids:
+            await interaction.followup.send("You have no queued or running requests.", ephemeral=True)
+            return
+
+        # The most recent request is the last one queued
+        if not all_requests:
+            request_ids = request_ids[-1:]
+
+        results = [await nai_queue.cancel_request(request_id) for request_id in request_ids]
+        cancelled = sum(1 for result in results if result is not None)
+        await interaction.followup.send(f"Cancelled `{cancelled}` request(s).", ephemeral=True)
+
+
     @app_commands.command(name="save_nai_preset", description="Save your custom NAI generation settings as a preset")
     @app_commands.choices(
         sampler=Nai_vars.samplers_choices,
@@ -661,10 +689,52 @@ class NAI(commands.Cog):
                              prompt: str = ""
                              ):
         logger.info(f"COMMAND 'DIRECTOR_TOOLS' USED BY: {interaction.user} ({interaction.user.id})")
+        await self.queue_director_tools(interaction, image, [req_type.value], emotion, defry, prompt, "DIRECTOR_TOOLS")
+
+    @app_commands.command(name="director_tools_batch", description="Run several director tools on one image (for image up to 1024x1024)")
+    @app_commands.allowed_installs(guilds=True, users=True)
+    @app_commands.choices(
+        emotion=Nai_vars.director_tools.emotions_choice,
+        defry=Nai_vars.director_tools.defry_choice
+    )
+    @app_commands.describe(
+        emotion="Emotion, runs the 'emotion' request type when set",
+        defry="Defry (only applicable to 'colorize' and 'emotion', default: 0)",
+        prompt="Optional prompt (only applicable to 'colorize' and 'emotion')"
+    )
+    async def director_tools_batch(self,
+                                   interaction: discord.Interaction,
+                                   image: discord.Attachment,
+                                   lineart: bool = False,
+                                   sketch: bool = False,
+                                   colorize: bool = False,
+                                   emotion: app_commands.Choice[str] = None,
+                                   declutter: bool = False,
+                                   bg_removal: bool = False,
+                                   defry: app_commands.Choice[str] = None,
+                                   prompt: str = ""
+                                   ):
+        logger.info(f"COMMAND 'DIRECTOR_TOOLS_BATCH' USED BY: {interaction.user} ({interaction.user.id})")
+        selected = {
+            "lineart": lineart,
+            "sketch": sketch,
+            "colorize": colorize,
+            "emotion": emotion is not None,
+            "declutter": declutter,
+            "bg-removal": bg_removal,
+        }
+        req_types = [req_type for req_type, enabled in selected.items() if enabled]
+        await self.queue_director_tools(interaction, image, req_types, emotion, defry, prompt, "DIRECTOR_TOOLS_BATCH")
+
+    async def queue_director_tools(self, interaction: discord.Interaction, image: discord.Attachment, req_types: list[str],
+                                   emotion: app_commands.Choice[str], defry: app_commands.Choice[str], prompt: str, command_name: str):
+        """Check the upload and queue one job running every requested augmentation on it"""
         await interaction.response.defer()
         try:
             # Check if the attachment is an image
             await interaction.followup.send("Checking parameters...")
+            if not req_types:
+                raise ValueError("Select at least one request type.")
             if not image.filename.lower().endswith((".png", ".jpg", ".jpeg", "webp")):
                 raise ValueError("Only `PNG`, `JPG`, `JPEG`, and `WebP` files are suppored.")
             
@@ -674,7 +744,7 @@ class NAI(commands.Cog):
             
             message = await interaction.edit_original_response(content="Adding your request to the queue...")
             
-            # Create a bundle_data that contains the image and the request type
+            # Create a bundle_data that contains the image and the request types
             bundle_data: da.BundleData = da.create_with_defaults(
                 da.BundleData,
                 type = "director_tools",
@@ -685,7 +755,7 @@ class NAI(commands.Cog):
                     "width": image.width,
                     "height": image.height,
                     "image": image,
-                    "req_type": req_type.value,
+                    "req_types": req_types,
                     "prompt": prompt,
                     "defry": int(defry.value) if defry else 0,
                     "emotion": emotion.value if emotion else None
@@ -699,7 +769,7 @@ class NAI(commands.Cog):
                 return
             
         except Exception as e:
-            logger.error(f"Error processing 'DIRECTOR_TOOLS' command: {str(e)}")
+            logger.error(f"Error processing '{command_name}' command: {str(e)}")
             message = await interaction.edit_original_response(content=f"Error: {str(e)}",)
             await message.delete(delay=10)
 
@@ -814,6 +884,7 @@ class NAI(commands.Cog):
             for image, info, strength in zip(images, infos, strengths):
                 if image is not None:
                     image_bytes = await image.read()
+                    image_bytes = await asyncio.to_thread(normalize_reference_bytes, image_bytes)
                     image_string = base64.b64encode(image_bytes).decode("utf-8")
                     preset_image_data.append({
                         "image": image_string,
@@ -939,6 +1010,7 @@ class NAI(commands.Cog):
         target_user = user or interaction.user
         
         await interaction.response.defer(ephemeral=ephemeral)
+        await stats_manager.wait_for_aggregates()
         
         # Get user stats
         user_stats = stats_manager.get_user_stats(target_user.id)
@@ -1052,244 +1124,139 @@ class NAI(commands.Cog):
             inline=True
         )
 
-        # Create monthly activity graph
+        # Bot-wide activity of the last 7 days, from the daily usage rollups
+        week_start = (datetime.now() - timedelta(days=6)).strftime("%Y-%m-%d")
+        week_generations, week_errors, week_time = stats_manager.rollups.total("day", start=week_start)
+        if week_generations:
+            week_models = stats_manager.rollups.breakdown("day", "model", start=week_start)
+            top_week_model = max(week_models.items(), key=lambda item: item[1][0])[0] if week_models else "N/A"
+            embed.add_field(
+                name="Bot Activity (7 Days)",
+                value=f"Generations: `{week_generations}`\n"
+                      f"Error Rate: `{week_errors / week_generations * 100:.1f}%`\n"
+                      f"Average Time: `{week_time / week_generations:.1f}s`\n"
+                      f"Top Model: `{top_week_model}`",
+                inline=True
+            )
+
+        # Bot-wide latency quantiles, from the streaming sketches of the global stats
+        latency = stats_manager.get_global_stats().latency
+        generation_latency = latency.merged("generation")
+        if generation_latency.count:
+            value = (f"Generation: `{format_quantiles(generation_latency)}`\n"
+                     f"End-to-end: `{format_quantiles(latency.merged('end_to_end'))}`")
+            # The user's most used model, if it has its own numbers
+            if models and latency.merged("generation", model=models[0][0]).count:
+                value += f"\n{models[0][0]}: `{format_quantiles(latency.merged('generation', model=models[0][0]))}`"
+            embed.add_field(name="Bot Latency (p50 / p90 / p99)", value=value, inline=True)
+
+        # Create monthly activity graph, drawn off the event loop and cached until the user generates again
         if user_stats.monthly_usage:
-            plt.figure(figsize=(10, 4))
-            # Get months and sort them chronologically
-            sorted_months_ym = sorted(user_stats.monthly_usage.keys())
-            # Select the last 6 months
-            months_to_plot_ym = sorted_months_ym[-6:]
-            # Get counts for the selected months
-            counts = [user_stats.monthly_usage[m] for m in months_to_plot_ym]
-            
-            # Format month strings to "Month Year"
-            formatted_months = [datetime.strptime(m, "%Y-%m").strftime("%b %Y") for m in months_to_plot_ym]
-
-            plt.bar(range(len(months_to_plot_ym)), counts)
-            plt.xticks(range(len(months_to_plot_ym)), formatted_months, rotation=45, ha='right') # Rotate labels for readability
-            plt.title("Monthly Activity")
-            plt.xlabel("Month")
-            plt.ylabel("Generations")
-            plt.tight_layout() # Adjust layout to prevent labels overlapping
-
-            # Save plot to bytes
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png')
-            buf.seek(0)
-            plt.close()
-            
+            png = await chart_renderer.render("monthly_activity", user_stats.user_id, user_stats.last_generation, dict(user_stats.monthly_usage))
+
             # Create file from bytes
-            file = discord.File(buf, filename="activity.png")
+            file = discord.File(io.BytesIO(png), filename="activity.png")
             embed.set_image(url="attachment://activity.png")
             
             await interaction.followup.send(embed=embed, file=file, ephemeral=ephemeral)
         else:
             await interaction.followup.send(embed=embed, ephemeral=ephemeral)
 
-    @app_commands.command(name="nai-history", description="View your recent NAI generations (Still in testing)")
+    @app_commands.command(name="nai-history", description="Browse your NAI generation history")
     @app_commands.describe(
         user="The user whose history you want to view (Owner only)",
-        ephemeral="Whether the reply should be ephemeral (default: False)"
+        ephemeral="Whether the reply should be ephemeral (default: True)"
     )
-    async def nai_history(self, interaction: discord.Interaction, user: discord.User = None, ephemeral: bool = False):
-        """View recent generation history for a user"""
+    async def nai_history(self, interaction: discord.Interaction, user: discord.User = None, ephemeral: bool = True):
+        """Browse the generation history of a user, a page at a time"""
         logger.info(f"COMMAND 'NAI-HISTORY' USED BY: {interaction.user} ({interaction.user.id})")
 
-        if interaction.user.id != settings.BOT_OWNER_ID:
-            await interaction.response.send_message("This command is currently in testing and only available to the bot owner.", ephemeral=True)
+        if user is not None and user.id != interaction.user.id and interaction.user.id != settings.BOT_OWNER_ID:
+            await interaction.response.send_message("Only the bot owner can view the history of other users.", ephemeral=True)
             return
 
         target_user = user or interaction.user
 
         await interaction.response.defer(ephemeral=ephemeral)
-
-        # Get user history
-        history = stats_manager.get_user_history(target_user.id, limit=3)  # Last 3 generations
-        if not history:
+        await stats_manager.wait_until_loaded()
+
+        # History entries do not record which images were classified as NSFW, so public
+        # replies outside NSFW channels (and DMs) show no images at all
+        show_images = ephemeral or interaction.guild is None or getattr(interaction.channel, "is_nsfw", lambda: False)()
+        view = HistoryView(self.bot, interaction.user.id, target_user, show_images)
+        page = await view.load_page()
+        if page is None:
             await interaction.followup.send(f"No generation history found for {target_user.mention}!", ephemeral=ephemeral)
             return
-
-        embed = discord.Embed(
-            title=f"🎨 Recent Generations for {target_user.name}",
-            color=BLUE
-        )
-        
-        for i, gen in enumerate(history):
-            status = "✅" if gen.result.success else "❌"
-            params = gen.parameters
-            
-            # Construct the /nai command string
-            command_str = f"/nai positive: \"{params.positive_prompt}\""
-            if params.negative_prompt:
-                command_str += f" negative: \"{params.negative_prompt}\""
-            command_str += f" width: {params.width} height: {params.height} steps: {params.steps} cfg: {params.cfg}"
-            command_str += f" sampler: {params.sampler} noise_schedule: {params.noise_schedule}"
-            # Only include smea if it's a specific mode (not None)
-            if params.smea in ["SMEA", "SMEA+DYN"]:
-                 command_str += f" smea: {params.smea}"
-            command_str += f" seed: {params.seed}"
-            command_str += f" model: {params.model}"
-            # Only include optional parameters if they are not their default values or are explicitly set
-            if getattr(params, 'quality_toggle', True) is not True: # Safely access quality_toggle
-                 command_str += f" quality_toggle: {getattr(params, 'quality_toggle', True)}"
-            if getattr(params, 'undesired_content_preset', 'heavy') != 'heavy': # Safely access undesired_content_preset
-                 command_str += f" undesired_content_presets: {getattr(params, 'undesired_content_preset', 'heavy')}"
-            if getattr(params, 'prompt_conversion', False) is not False: # Safely access prompt_conversion
-                 command_str += f" prompt_conversion_toggle: {getattr(params, 'prompt_conversion', False)}"
-            if getattr(params, 'upscale', False) is not False: # Safely access upscale
-                 command_str += f" upscale: {getattr(params, 'upscale', False)}"
-            if getattr(params, 'decrisper', False) is not False: # Safely access decrisper (Dynamic Thresholding)
-                 command_str += f" decrisper: {getattr(params, 'decrisper', False)}"
-            if getattr(params, 'variety_plus', False) is not False: # Safely access variety_plus (Skip CFG Above Sigma)
-                 command_str += f" variety_plus: {getattr(params, 'variety_plus', False)}"
-            if getattr(params, 'vibe_transfer_preset', None): # Safely access vibe_transfer_preset
-                 command_str += f" vibe_transfer_preset: \"{getattr(params, 'vibe_transfer_preset', None)}\""
-
-
-            # Truncate prompts if too long for embed field value
-            display_positive = params.positive_prompt # Use positive_prompt from GenerationParameters
-            display_negative = params.negative_prompt or "N/A"
-            max_prompt_length = 200 # Arbitrary limit to keep embed readable
-            if len(display_positive) > max_prompt_length:
-                display_positive = display_positive[:max_prompt_length] + "..."
-            if len(display_negative) > max_prompt_length:
-                display_negative = display_negative[:max_prompt_length] + "..."
-
-            value = (
-                f"Status: {status}\n"
-                f"Time: `{gen.generation_time:.1f}s`\n"
-                f"Prompt: ```{display_positive}```\n"
-                f"Negative Prompt: ```{display_negative}```\n"
-                f"Model: `{params.model}`\n"
-                f"Size: `{params.width}x{params.height}`\n"
-                f"Seed: `{params.seed}`\n"
-                f"Sampler: `{params.sampler}`\n"
-                f"Steps: `{params.steps}`\n"
-                f"CFG: `{params.cfg}`\n"
-                f"UC Preset: `{params.undesired_content_preset or 'N/A'}`\n" # Use undesired_content_preset from GenerationParameters
-                f"Decrisper: `{getattr(params, 'decrisper', False)}`\n" # Safely access decrisper
-                f"Variety Plus: `{getattr(params, 'variety_plus', False)}`" # Safely access variety_plus
-            )
-            
-            # Add Vibe Transfer Preset if used
-            vibe_transfer_preset_name = getattr(params, 'vibe_transfer_preset', None)
-            if vibe_transfer_preset_name:
-                 value += f"\nVibe Transfer Preset: `{vibe_transfer_preset_name}`"
-
-
-            if gen.result.error_message:
-                value += f"\nError: `{gen.result.error_message}`"
-
-            # Truncate value if it exceeds Discord's embed field value limit (1024 characters)
-            if len(value) > 1024:
-                value = value[:1021] + "..."
-
-            embed.add_field(
-                name=f"Generation {len(history) - i} ({gen.timestamp[:19]})",  # Show up to seconds, number from most recent
-                value=value,
-                inline=False
-            )
-        
-        await interaction.followup.send(embed=embed)
-
-        # Send separate messages for the full command strings
-        for i, gen in enumerate(history):
-            params = gen.parameters
-            
-            # Construct the full /nai command string
-            command_str = f"/nai positive: \"{params.positive_prompt}\""
-            if params.negative_prompt:
-                command_str += f" negative: \"{params.negative_prompt}\""
-            command_str += f" width: {params.width} height: {params.height} steps: {params.steps} cfg: {params.cfg}"
-            command_str += f" sampler: {params.sampler} noise_schedule: {params.noise_schedule}"
-            if params.smea and params.smea != "None":
-                 command_str += f" smea: {params.smea}"
-            command_str += f" seed: {params.seed}"
-            command_str += f" model: {params.model}"
-            # Only include optional parameters if they are not their default values or are explicitly set
-            if getattr(params, 'quality_toggle', True) is not True: # Safely access quality_toggle
-                 command_str += f" quality_toggle: {getattr(params, 'quality_toggle', True)}"
-            if getattr(params, 'undesired_content_preset', 'heavy') != 'heavy': # Safely access undesired_content_preset
-                 command_str += f" undesired_content_presets: {getattr(params, 'undesired_content_preset', 'heavy')}"
-            if getattr(params, 'prompt_conversion', False) is not False: # Safely access prompt_conversion
-                 command_str += f" prompt_conversion_toggle: {getattr(params, 'prompt_conversion', False)}"
-            if getattr(params, 'upscale', False) is not False: # Safely access upscale
-                 command_str += f" upscale: {getattr(params, 'upscale', False)}"
-            if getattr(params, 'decrisper', False) is not False: # Safely access decrisper
-                 command_str += f" decrisper: {getattr(params, 'decrisper', False)}"
-            if getattr(params, 'variety_plus', False) is not False: # Safely access variety_plus
-                 command_str += f" variety_plus: {getattr(params, 'variety_plus', False)}"
-            if getattr(params, 'vibe_transfer_preset', None): # Include preset name if used
-                 command_str += f" vibe_transfer_preset: \"{getattr(params, 'vibe_transfer_preset', None)}\""
-
-
-            await interaction.followup.send(f"Command for Generation {len(history) - i}:\n```{command_str}```", ephemeral=ephemeral)
+        embed, file = page
+        view.message = await interaction.followup.send(embed=embed, file=file, view=view, ephemeral=ephemeral)
+
+    def leaderboard_display(self, interaction: discord.Interaction, user_id: int, ephemeral: bool) -> str:
+        """Mention of a leaderboard user if they opted in, "Anonymous User" otherwise.
+        The invoking user is always shown to themselves in ephemeral replies."""
+        if user_id == interaction.user.id:
+            if ephemeral or self.leaderboard_opt_ins.is_opted_in(user_id):
+                return interaction.user.mention
+            return "Anonymous User"
+        if self.leaderboard_opt_ins.is_opted_in(user_id): # Default is opted out
+            user_obj = self.bot.get_user(user_id)
+            return user_obj.mention if user_obj else f"<@{user_id}>"
+        return "Anonymous User"
 
     @app_commands.command(name="nai-leaderboard", description="View global NAI generation leaderboard")
     @app_commands.describe(
-        ephemeral="Whether the reply should be ephemeral (default: False)"
+        ephemeral="Whether the reply should be ephemeral (default: False)",
+        period="Period to count generations over (default: All Time, or Last 30 Days with a model)",
+        model="Only count generations made with this model"
+    )
+    @app_commands.choices(
+        period=[app_commands.Choice(name=name, value=value) for value, name in LEADERBOARD_PERIODS.items()],
+        model=Nai_vars.models_choices
     )
-    async def nai_leaderboard(self, interaction: discord.Interaction, ephemeral: bool = False):
+    async def nai_leaderboard(self, interaction: discord.Interaction, ephemeral: bool = False,
+                              period: app_commands.Choice[str] = None, model: app_commands.Choice[str] = None):
         """View global generation leaderboard"""
         logger.info(f"COMMAND 'NAI-LEADERBOARD' USED BY: {interaction.user} ({interaction.user.id})")
 
         await interaction.response.defer(ephemeral=ephemeral)
+        period_value = period.value if period else ("30d" if model else "all")
+        model_value = model.value if model else None
 
-        # Get all user stats and sort by total generations
-        all_user_stats = list(stats_manager.user_stats.values())
-        sorted_users = sorted(all_user_stats, key=lambda x: x.total_generations, reverse=True)
-
-        if not sorted_users:
-            await interaction.followup.send("No user statistics available yet!", ephemeral=ephemeral)
+        # Users ordered by generations, maintained by the stats manager
+        if period_value == "all":
+            if model_value:
+                await interaction.followup.send("Model leaderboards are available for This Week, This Month and Last 30 Days.", ephemeral=ephemeral)
+                return
+            await stats_manager.wait_for_aggregates()
+            rank_index = stats_manager.rank_index
+        else:
+            # The windowed leaderboards are rebuilt from history when the snapshot predates them
+            await stats_manager.wait_until_loaded()
+            rank_index = stats_manager.window_leaderboards.get(period_value, model_value)
+        if not len(rank_index):
+            message = "No user statistics available yet!" if period_value == "all" else "No generations in this period yet!"
+            await interaction.followup.send(message, ephemeral=ephemeral)
             return
 
-        # Find the invoking user's rank and stats
+        # Find the invoking user's rank and generations
         invoking_user_id = interaction.user.id
-        invoking_user_stats = None
-        invoking_user_rank = -1 # -1 means not found
-
-        for i, user_stats in enumerate(sorted_users):
-            if user_stats.user_id == invoking_user_id:
-                invoking_user_stats = user_stats
-                invoking_user_rank = i + 1
-                break
-
-        # Read opt-in status
-        opt_status = {}
-        if self.leaderboard_opt_file.exists():
-            try:
-                with open(self.leaderboard_opt_file, "r") as f:
-                    opt_status = json.load(f)
-            except json.JSONDecodeError:
-                logger.error(f"Error decoding JSON from {self.leaderboard_opt_file}. Proceeding with default (opt-out) for all.")
-                opt_status = {}
+        invoking_user_rank = rank_index.rank(invoking_user_id) # None means not found
+        invoking_user_generations = rank_index.totals.get(invoking_user_id, 0)
 
         # Create main embed
+        title = "🏆 NAI Generation Leaderboard"
+        if period_value != "all":
+            title += f" ({LEADERBOARD_PERIODS[period_value]}{f', {model_value}' if model_value else ''})"
         embed = discord.Embed(
-            title="🏆 NAI Generation Leaderboard",
+            title=title,
             color=GOLD
         )
 
         # --- Top 10 Section ---
-        top_users = sorted_users[:10]
         leaderboard_value = ""
-        if top_users:
-            for i, user_stats in enumerate(top_users):
-                user_id_str = str(user_stats.user_id)
-                # Determine user display based on if it's the invoking user, or opt-in status
-                user_display = "Anonymous User" # Default display for opted-out users
-                if user_stats.user_id == invoking_user_id and not ephemeral and not opt_status.get(str(invoking_user_id), False):
-                    user_display = "Anonymous User"
-                elif user_stats.user_id == invoking_user_id:
-                     user_display = interaction.user.mention
-                elif opt_status.get(user_id_str, False): # Check if user opted in (default is False)
-                     user_obj = self.bot.get_user(user_stats.user_id)
-                     user_display = user_obj.mention if user_obj else f"<@{user_stats.user_id}>"
-
-
-                leaderboard_value += f"**{i+1}. {user_display}** `{user_stats.total_generations}` generations\n"
-        else:
-            leaderboard_value = "No users in the leaderboard yet."
+        for i, (user_id, total_generations) in enumerate(rank_index.top(10)):
+            user_display = self.leaderboard_display(interaction, user_id, ephemeral)
+            leaderboard_value += f"**{i+1}. {user_display}** `{total_generations}` generations\n"
 
         embed.add_field(
             name="Top 10 Generators",
@@ -1300,27 +1267,16 @@ class NAI(commands.Cog):
         # --- Invoking User's Section ---
         user_section_value = ""
         # Only show "Your Stats" if ephemeral is True OR the invoking user is opted in OR is the bot owner
-        invoking_user_id_str = str(invoking_user_id)
-        if ephemeral or opt_status.get(invoking_user_id_str, False) or invoking_user_id == self.bot.owner_id:
-            if invoking_user_stats:
+        if ephemeral or self.leaderboard_opt_ins.is_opted_in(invoking_user_id) or invoking_user_id == self.bot.owner_id:
+            if invoking_user_rank is not None:
                 user_section_value += f"Your Rank: **#{invoking_user_rank}**\n"
-                user_section_value += f"Your Generations: `{invoking_user_stats.total_generations}`\n"
+                user_section_value += f"Your Generations: `{invoking_user_generations}`\n"
 
                 # Calculate generations needed for next rank
                 if invoking_user_rank > 1:
-                    next_rank_user_stats = sorted_users[invoking_user_rank - 2] # Rank is 1-based, index is 0-based
-                    next_rank_user_id_str = str(next_rank_user_stats.user_id)
-                    next_rank_user_display = "Anonymous User"
-                    if next_rank_user_stats.user_id == invoking_user_id and not ephemeral and not opt_status.get(str(invoking_user_id), False):
-                         next_rank_user_display = "Anonymous User"
-                    elif next_rank_user_stats.user_id == invoking_user_id:
-                         next_rank_user_display = interaction.user.mention
-                    elif opt_status.get(next_rank_user_id_str, False): # Check if user opted in (default is False)
-                         user_above_obj = self.bot.get_user(next_rank_user_stats.user_id)
-                         next_rank_user_display = user_above_obj.mention if user_above_obj else f"<@{next_rank_user_stats.user_id}>"
-
-
-                    gens_needed = next_rank_user_stats.total_generations - invoking_user_stats.total_generations
+                    next_rank_user_id, next_rank_total = rank_index.at(invoking_user_rank - 1)
+                    next_rank_user_display = self.leaderboard_display(interaction, next_rank_user_id, ephemeral)
+                    gens_needed = next_rank_total - invoking_user_generations
                     user_section_value += f"Generations needed for next rank (to surpass {next_rank_user_display}): `{gens_needed}`\n"
                 else:
                     user_section_value += "You are currently Rank #1!\n"
@@ -1328,44 +1284,14 @@ class NAI(commands.Cog):
                 # Include users above and below if not in top 10
                 if invoking_user_rank > 10:
                     user_section_value += "\nNearby Ranks:\n"
-                    # User above (if exists)
-                    if invoking_user_rank > 1:
-                        user_above_stats = sorted_users[invoking_user_rank - 2]
-                        user_above_id_str = str(user_above_stats.user_id)
-                        user_above_display = "Anonymous User"
-                        if user_above_stats.user_id == invoking_user_id and not ephemeral and not opt_status.get(str(invoking_user_id), False):
-                             user_above_display = "Anonymous User"
-                        elif user_above_stats.user_id == invoking_user_id:
-                             user_above_display = interaction.user.mention
-                        elif opt_status.get(user_above_id_str, False): # Check if user opted in (default is False)
-                             user_above_obj = self.bot.get_user(user_above_stats.user_id)
-                             user_above_display = user_above_obj.mention if user_above_obj else f"<@{user_above_stats.user_id}>"
-
-                    user_section_value += f"**#{invoking_user_rank - 1}. {user_above_display}** `{invoking_user_stats.total_generations}` generations\n"
-
-                    # Invoking user
-                    invoking_user_display_nearby = interaction.user.mention
-                    if not ephemeral and not opt_status.get(str(invoking_user_id), False):
-                         invoking_user_display_nearby = "Anonymous User"
-                    user_section_value += f"**#{invoking_user_rank}. {invoking_user_display_nearby}** `{invoking_user_stats.total_generations}` generations\n"
-
-                    # User below (if exists)
-                    if invoking_user_rank < len(sorted_users):
-                        user_below_stats = sorted_users[invoking_user_rank]
-                        user_below_id_str = str(user_below_stats.user_id)
-                        user_below_display = "Anonymous User"
-                        if user_below_stats.user_id == invoking_user_id and not ephemeral and not opt_status.get(str(invoking_user_id), False):
-                             user_below_display = "Anonymous User"
-                        elif user_below_stats.user_id == invoking_user_id:
-                             user_below_display = interaction.user.mention
-                        elif opt_status.get(user_below_id_str, False): # Check if user opted in (default is False)
-                             user_below_obj = self.bot.get_user(user_below_stats.user_id)
-                             user_below_display = user_below_obj.mention if user_below_obj else f"<@{user_below_stats.user_id}>"
-
-                        user_section_value += f"**#{invoking_user_rank + 1}. {user_below_display}** `{user_below_stats.total_generations}` generations\n"
+                    for rank, user_id, total_generations in rank_index.around(invoking_user_rank):
+                        user_display = self.leaderboard_display(interaction, user_id, ephemeral)
+                        user_section_value += f"**#{rank}. {user_display}** `{total_generations}` generations\n"
 
             else:
                 user_section_value = "You have not generated any images yet to be on the leaderboard."
+                if period_value != "all":
+                    user_section_value = "You have not generated any images in this period yet."
 
             embed.add_field(
                 name=f"Your Stats ({interaction.user.name})",
@@ -1398,28 +1324,9 @@ class NAI(commands.Cog):
 
         await interaction.response.defer(ephemeral=True)
 
-        user_id_str = str(interaction.user.id)
-        opt_status = {}
-
-        # Read existing status
-        if self.leaderboard_opt_file.exists():
-            try:
-                with open(self.leaderboard_opt_file, "r") as f:
-                    opt_status = json.load(f)
-            except json.JSONDecodeError:
-                logger.error(f"Error decoding JSON from {self.leaderboard_opt_file}. Starting with empty status.")
-                opt_status = {}
-
-        # Update user's status
-        opt_status[user_id_str] = opt_in
-
-        # Ensure directory exists
-        self.leaderboard_opt_file.parent.mkdir(parents=True, exist_ok=True)
-
-        # Write updated status
+        # Update the cached status, written through to the opt status file
         try:
-            with open(self.leaderboard_opt_file, "w") as f:
-                json.dump(opt_status, f, indent=4)
+            self.leaderboard_opt_ins.set(interaction.user.id, opt_in)
             status_message = "opted in to" if opt_in else "opted out of"
             await interaction.followup.send(f"You have successfully {status_message} the global leaderboard.", ephemeral=True)
         except Exception as e:
@@ -1521,13 +1428,18 @@ class NAI(commands.Cog):
 
             # Stats Manager State
             debug_info.append("\n=== Stats Manager State ===")
-            debug_info.append(f"History entries: {len(stats_manager.history)}")
+            debug_info.append(f"Backend: {settings.STATS_BACKEND}")
+            debug_info.append(f"History entries: {stats_manager.history_count()}")
             debug_info.append(f"User stats entries: {len(stats_manager.user_stats)}")
             debug_info.append(f"Global total generations: {stats_manager.global_stats.total_generations}")
+            debug_info.append(f"Loaded: aggregates {'yes' if stats_manager.aggregates_loaded.is_set() else 'no'}, history {'yes' if stats_manager.history_loaded.is_set() else 'no'}")
+            for phase, milliseconds in stats_manager.startup_timings.items():
+                debug_info.append(f"Startup {phase}: {milliseconds:.0f}ms")
             
             # Data Integrity Check (Global)
             debug_info.append("\n=== Data Integrity Check (Global) ===")
             try:
+                await stats_manager.wait_until_loaded()
                 issues = stats_manager.verify_stats_integrity()
                 any_issues = False
                 for category, category_issues in issues.items():
@@ -224,6 +224,12 @@ async def read_attachment_raw_metadata(attachment: discord.Attachment) -> Option
     return None # No metadata found by any method
 
 
+def parse_guild_id(content: str) -> Optional[int]:
+    """The guild a generation was made in, from the channel link of its database message. None for DMs."""
+    guild_match = re.search(r"Channel: https://discord\.com/channels/(\d+)/", content)
+    return int(guild_match.group(1)) if guild_match else None
+
+
 def parse_metadata_to_params(raw_metadata: str) -> Optional[nai_stats_core.GenerationParameters]:
     """
     Parses raw metadata string into GenerationParameters dataclass.
@@ -421,7 +427,8 @@ async def process_attachment_task(semaphore: asyncio.Semaphore, attachment: disc
                                 error_message=None,
                                 database_message_id=message.id,
                                 attempts_made=1 # Set attempts_made to 1 for historical entries
-                            )
+                            ),
+                            guild_id=parse_guild_id(message.content)
                         )
 
                         try:
@@ -466,6 +473,7 @@ class StatsV2Cog(commands.Cog):
     async def process_history_v2(self, interaction: discord.Interaction, channel_id: str):
         """Processes image attachments in a channel's history to update NAI stats."""
         await interaction.response.send_message(f"Starting to process history for channel ID: {channel_id}...", ephemeral=True)
+        await nai_stats_core.stats_manager.wait_until_loaded() # Duplicates are only detected against the loaded history
 
         try:
             channel = await self.bot.fetch_channel(int(channel_id))
@@ -501,12 +509,7 @@ class StatsV2Cog(commands.Cog):
                             error_count += e
                             skipped_duplicates_count += s # Accumulate skipped count
 
-                        # Periodically save data
-                        try:
-                            nai_stats_core.stats_manager.save_data()
-                            logger.info(f"Periodically saved stats data after processing {message_count} messages.")
-                        except Exception as save_e:
-                            logger.error(f"Error during periodic save: {save_e}")
+                        # Stats are written behind by the stats flusher, no periodic save needed
 
 
                 if not message.author.bot:
@@ -554,7 +557,7 @@ class StatsV2Cog(commands.Cog):
 
             # Final save after processing all messages
             try:
-                nai_stats_core.stats_manager.save_data()
+                await nai_stats_core.stats_manager.flush()
                 logger.info("Final save of stats data after history processing.")
             except Exception as save_e:
                 logger.error(f"Error during final save: {save_e}")
@@ -576,6 +579,7 @@ class StatsV2Cog(commands.Cog):
     async def process_specific_messages(self, interaction: discord.Interaction, channel_id: str, message_ids_str: str):
         """Processes specific message IDs to update NAI stats, overwriting existing entries."""
         await interaction.response.send_message(f"Starting to process specific message IDs in channel ID: {channel_id}...", ephemeral=True)
+        await nai_stats_core.stats_manager.wait_until_loaded() # Duplicates are only detected against the loaded history
 
         try:
             channel = await self.bot.fetch_channel(int(channel_id))
@@ -769,7 +773,8 @@ class StatsV2Cog(commands.Cog):
                                             error_message=None,
                                             database_message_id=message.id,
                                             attempts_made=1
-                                        )
+                                        ),
+                                        guild_id=parse_guild_id(message.content)
                                     )
 
                                     # Add/Overwrite generation using the overwrite=True flag
@@ -810,7 +815,7 @@ class StatsV2Cog(commands.Cog):
 
         # Save data after processing all specified messages
         try:
-            nai_stats_core.stats_manager.save_data()
+            await nai_stats_core.stats_manager.flush()
             logger.info("Final save of stats data after processing specific messages.")
         except Exception as save_e:
             logger.error(f"Error during final save after specific message processing: {save_e}")
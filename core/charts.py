@@ -0,0 +1,70 @@
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# The object-oriented API only, pyplot keeps global figure state that is not safe to use from several threads
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import settings
+
+def monthly_activity_png(monthly_usage: dict[str, int]) -> bytes:
+    """Bar chart of the generations of the last 6 months in monthly_usage ({"YYYY-MM": count})."""
+    fig = Figure(figsize=(10, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    # Get months and sort them chronologically, then select the last 6 months
+    months_to_plot_ym = sorted(monthly_usage.keys())[-6:]
+    counts = [monthly_usage[m] for m in months_to_plot_ym]
+    # Format month strings to "Month Year"
+    formatted_months = [datetime.strptime(m, "%Y-%m").strftime("%b %Y") for m in months_to_plot_ym]
+
+    ax.bar(range(len(months_to_plot_ym)), counts)
+    ax.set_xticks(range(len(months_to_plot_ym)), formatted_months, rotation=45, ha='right') # Rotate labels for readability
+    ax.set_title("Monthly Activity")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Generations")
+    fig.tight_layout() # Adjust layout to prevent labels overlapping
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+CHARTS = {"monthly_activity": monthly_activity_png}
+
+class ChartRenderer:
+    """Renders charts on a thread pool instead of the event loop and caches the PNGs by
+    (user_id, last_generation, chart type), so charts of users who did not generate since are not redrawn.
+    The cache and the pending renders are only touched from the event loop."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=settings.CHART_RENDER_WORKERS, thread_name_prefix="chart-render")
+        self.cache: "OrderedDict[tuple, bytes]" = OrderedDict() # Least recently used first
+        self.pending: dict[tuple, asyncio.Future] = {} # Renders in progress, shared by concurrent requests
+
+    async def render(self, chart: str, user_id: int, last_generation: str | None, data) -> bytes:
+        """PNG of a chart in CHARTS drawn from `data`, which must not change while it is rendered."""
+        key = (user_id, last_generation, chart)
+        png = self.cache.get(key)
+        if png is not None:
+            self.cache.move_to_end(key)
+            return png
+
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = asyncio.wrap_future(self.executor.submit(CHARTS[chart], data))
+            pending.add_done_callback(lambda future: self._finish(key, future))
+        # Shielded, a cancelled request does not cancel the render others are waiting for
+        return await asyncio.shield(pending)
+
+    def _finish(self, key: tuple, future: asyncio.Future):
+        del self.pending[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.cache[key] = future.result()
+        while len(self.cache) > settings.CHART_CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+chart_renderer = ChartRenderer()
@@ -0,0 +1,171 @@
+import json
+import math
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import settings
+from settings import logger
+
+# NovelAI's published image pricing, fitted per pixel and per step
+ANLAS_PER_PIXEL = 2.951823174884865e-6
+ANLAS_PER_PIXEL_STEP = 5.753298233447344e-7
+OPUS_FREE_PIXELS = 1024 * 1024
+OPUS_FREE_STEPS = 28
+VIBE_ENCODE_ANLAS = 2 # Per reference image, V4 models encode vibes server-side
+# Approximate 4x upscale pricing: (max input pixels, Anlas)
+UPSCALE_ANLAS = [(512 * 512, 1), (640 * 640, 2), (768 * 768, 5), (1024 * 1024, 7)]
+BG_REMOVAL_FACTOR = 3 # Background removal is billed as several passes
+REFERENCE_WORK = 1024 * 1024 * 28 # One 1024x1024, 28 step generation is 1.0 units of work
+
+@dataclass
+class JobCost:
+    anlas: int # Estimated Anlas charged by NovelAI
+    work: float # Estimated run time relative to one 1024x1024, 28 step generation
+
+def generation_anlas(pixels: int, steps: int, sm: bool = False, sm_dyn: bool = False) -> int:
+    if settings.NAI_OPUS_SUBSCRIPTION and pixels <= OPUS_FREE_PIXELS and steps <= OPUS_FREE_STEPS:
+        return 0
+    cost = math.ceil(ANLAS_PER_PIXEL * pixels + ANLAS_PER_PIXEL_STEP * pixels * steps)
+    if sm_dyn:
+        cost = math.ceil(cost * 1.4)
+    elif sm:
+        cost = math.ceil(cost * 1.2)
+    return cost
+
+def upscale_anlas(pixels: int) -> int:
+    for max_pixels, cost in UPSCALE_ANLAS:
+        if pixels <= max_pixels:
+            return cost
+    return UPSCALE_ANLAS[-1][1]
+
+def estimate_job_cost(bundle_data) -> JobCost:
+    """Estimate what a queued job will cost in Anlas and in run time."""
+    if bundle_data["type"] == "director_tools":
+        params = bundle_data["director_tools_params"]
+        pixels = params["width"] * params["height"]
+        anlas = 0
+        for req_type in params["req_types"]:
+            cost = generation_anlas(pixels, OPUS_FREE_STEPS)
+            anlas += cost * BG_REMOVAL_FACTOR + 5 if req_type == "bg-removal" else cost
+        # Augmentations of a batch run concurrently
+        batches = math.ceil(len(params["req_types"]) / settings.DIRECTOR_TOOLS_CONCURRENCY)
+        return JobCost(anlas=anlas, work=batches * pixels * OPUS_FREE_STEPS / REFERENCE_WORK)
+
+    params = bundle_data["params"]
+    pixels = params["width"] * params["height"]
+    anlas = generation_anlas(pixels, params["steps"], params.get("sm"), params.get("sm_dyn"))
+    work = pixels * params["steps"] / REFERENCE_WORK
+    if params.get("upscale"):
+        anlas += upscale_anlas(pixels)
+        work += 1.0
+    vibe_count = len(params.get("vibe_transfer_data") or [])
+    if params["model"].startswith("nai-diffusion-4"):
+        anlas += VIBE_ENCODE_ANLAS * vibe_count
+    return JobCost(anlas=anlas, work=work)
+
+class AnlasBudget:
+    """Hourly and daily Anlas budgets per user and per guild.
+    Costs are reserved when a job is queued and charged once it succeeds."""
+    WINDOWS = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d"}
+    WINDOW_LABELS = {"hour": "hourly", "day": "daily"}
+
+    def __init__(self, usage_file: Path):
+        self.usage_file = usage_file
+        self.limits = {
+            ("user", "hour"): settings.ANLAS_USER_HOURLY_BUDGET,
+            ("user", "day"): settings.ANLAS_USER_DAILY_BUDGET,
+            ("guild", "hour"): settings.ANLAS_GUILD_HOURLY_BUDGET,
+            ("guild", "day"): settings.ANLAS_GUILD_DAILY_BUDGET,
+        }
+        # Spent Anlas: window -> {"key": current window key, "user": {id: anlas}, "guild": {id: anlas}}
+        self.spent = {window: {"key": None, "user": {}, "guild": {}} for window in self.WINDOWS}
+        self.reservations: dict[str, tuple[int, int | None, int]] = {} # request_id -> (user_id, guild_id, anlas)
+        self.load()
+
+    def load(self):
+        if not self.usage_file.exists():
+            return
+        try:
+            with open(self.usage_file, "r") as f:
+                data = json.load(f)
+            for window in self.WINDOWS:
+                if window in data:
+                    self.spent[window] = data[window]
+        except Exception as e:
+            logger.error(f"Error loading Anlas usage from {self.usage_file}: {str(e)}")
+
+    def save(self):
+        try:
+            self.usage_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.usage_file.with_suffix(".tmp")
+            with open(temp_file, "w") as f:
+                json.dump(self.spent, f, indent=2)
+            temp_file.replace(self.usage_file)
+        except Exception as e:
+            logger.error(f"Error saving Anlas usage to {self.usage_file}: {str(e)}")
+
+    def _window(self, window: str) -> dict:
+        """Return the counters of the current hour or day, starting new ones when it has rolled over."""
+        key = datetime.now(timezone.utc).strftime(self.WINDOWS[window])
+        if self.spent[window]["key"] != key:
+            self.spent[window] = {"key": key, "user": {}, "guild": {}}
+        return self.spent[window]
+
+    def _used(self, scope: str, scope_id: int, window: str) -> int:
+        """Anlas spent plus reserved by a user or guild in the current window."""
+        used = self._window(window)[scope].get(str(scope_id), 0)
+        for user_id, guild_id, anlas in self.reservations.values():
+            if (user_id if scope == "user" else guild_id) == scope_id:
+                used += anlas
+        return used
+
+    def reserve(self, request_id: str, user_id: int, guild_id: int | None, anlas: int) -> str | None:
+        """Reserve a job's cost. Returns why it does not fit the budgets, or None once it is reserved."""
+        if anlas > 0:
+            for (scope, window), limit in self.limits.items():
+                scope_id = user_id if scope == "user" else guild_id
+                if not limit or scope_id is None:
+                    continue
+                used = self._used(scope, scope_id, window)
+                if used + anlas > limit:
+                    owner = "Your" if scope == "user" else "This server's"
+                    return f"{owner} {self.WINDOW_LABELS[window]} Anlas budget would be exceeded (`{used}` + `{anlas}` of `{limit}`). Try a smaller size, fewer steps or no upscale."
+        self.reservations[request_id] = (user_id, guild_id, anlas)
+        return None
+
+    def release(self, request_id: str):
+        """Drop the reservation of a job that was cancelled or failed, NovelAI only charges for results."""
+        self.reservations.pop(request_id, None)
+
+    def commit(self, request_id: str):
+        """Charge the reserved cost of a job that succeeded."""
+        reservation = self.reservations.pop(request_id, None)
+        if reservation is None or reservation[2] == 0:
+            return
+        user_id, guild_id, anlas = reservation
+        for window in self.WINDOWS:
+            counters = self._window(window)
+            counters["user"][str(user_id)] = counters["user"].get(str(user_id), 0) + anlas
+            if guild_id is not None:
+                counters["guild"][str(guild_id)] = counters["guild"].get(str(guild_id), 0) + anlas
+        self.save()
+
+    def status_summary(self) -> dict:
+        """Budget state for /status."""
+        summary = {
+            "limits": {f"{scope}_{window}": limit for (scope, window), limit in self.limits.items()},
+            "reserved": sum(anlas for _, _, anlas in self.reservations.values()),
+        }
+        for window in self.WINDOWS:
+            counters = self._window(window)
+            top_users = sorted(counters["user"].items(), key=lambda item: item[1], reverse=True)[:5]
+            top_guilds = sorted(counters["guild"].items(), key=lambda item: item[1], reverse=True)[:5]
+            summary[f"spent_this_{window}"] = {
+                "total": sum(counters["user"].values()),
+                "top_users": dict(top_users),
+                "top_guilds": dict(top_guilds),
+            }
+        return summary
+
+anlas_budget = AnlasBudget(settings.ANLAS_USAGE_FILE)
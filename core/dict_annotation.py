@@ -1,7 +1,8 @@
-from typing import TypedDict, Union, Dict, Any
+from typing import TypedDict, Union, Dict, Any, List
 import discord
 from discord import app_commands
 from copy import deepcopy
+from core.cost_model import JobCost
 
 
 class Checking_Params(TypedDict, total=False):
@@ -45,10 +46,28 @@ class Director_Tools_Params(TypedDict, total=False):
     width: int
     height: int
     image: discord.Attachment
-    req_type: str
+    req_types: List[str] # Augmentations run on the image as one batch
     prompt: str
     defry: int
     emotion: str
+    image_bytes: bytes # Attachment prefetched by the queue
+    image_base64: str # Its base64 encoding, set before image_bytes
+
+class Checkpoints(TypedDict, total=False):
+    stage: str # Stage currently running (or the one that failed last)
+    stage_attempts: Dict[str, int] # Number of times each stage has failed
+    stage_started_at: float # Event loop time the current stage was entered
+    request_body: bytes # Serialized NovelAI request, reused by every retry
+    image_bytes: bytes # Image returned by NovelAI
+    upscaled_bytes: bytes # Image returned by the upscaler
+    timelapse_path: str # Timelapse gif of the streamed generation
+    elapsed_time: float # Generation time, measured once the image is ready
+    database_message_id: int
+    database_image_url: str
+    stats_recorded: bool
+    is_nsfw: bool
+    delivered: bool
+    remix_sent: bool
 
 class BundleData(TypedDict, total=False):
     request_id: int = None
@@ -62,6 +81,12 @@ class BundleData(TypedDict, total=False):
     director_tools_params: Director_Tools_Params = None
     number_of_tries: int = 2
     streaming: bool = False # Added for streaming generation
+    checkpoints: Checkpoints = None # Stage results kept across retries
+    queued_at: float = None # Event loop time the request entered the queue
+    low_priority: bool = False # Deferred to the low-priority lane by admission control
+    streaming_disabled: bool = False # Streaming turned off for this run by admission control
+    admission_note: str = None # Why admission control degraded the request, shown to the user
+    cost: JobCost = None # Estimated Anlas and run time, set when the request is queued
 
 def create_with_defaults(typed_dict_class: Dict[str, Any], **kwargs) -> Dict[str, Any]:
     # Initialize with None for all fields based on the TypedDict annotations
@@ -72,6 +97,7 @@ def create_with_defaults(typed_dict_class: Dict[str, Any], **kwargs) -> Dict[str
 
 
 def deep_copy_bundle_data(bundle_data: BundleData) -> BundleData:
+    # Checkpoints and the other per-run fields are not copied, add_to_queue starts them over
     return BundleData(
         request_id=deepcopy(bundle_data.get("request_id")),
         type=deepcopy(bundle_data.get("type")),
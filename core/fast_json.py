@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+import settings
+
+# Optional faster encoders, the standard library is used when neither is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+elif msgspec is not None:
+    BACKEND = "msgspec"
+else:
+    BACKEND = "json"
+
+def dumps(obj, default=None) -> bytes:
+    """Serialize `obj` to compact UTF-8 JSON with the fastest available encoder.
+    `default` is called for objects the encoder does not know, like json.dumps's."""
+    if BACKEND == "orjson":
+        return orjson.dumps(obj, default=default, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+    if BACKEND == "msgspec":
+        return msgspec.json.encode(obj, enc_hook=default)
+    return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def loads(data: bytes | str):
+    """Parse JSON with the fastest available decoder."""
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    if BACKEND == "msgspec":
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+async def dumps_async(func, obj, size_hint: int) -> bytes:
+    """Run the serializer `func(obj)`, in a worker thread when the output is expected to be large."""
+    if size_hint >= settings.JSON_OFFLOOP_THRESHOLD:
+        return await asyncio.to_thread(func, obj)
+    return func(obj)
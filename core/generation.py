@@ -10,6 +10,7 @@ import uuid
 from typing import AsyncGenerator
 from PIL import Image as PILImage # Import Pillow Image
 from enum import Enum
+from dataclasses import dataclass
 
 from settings import logger, NAI_API_TOKEN, random, STATS_DIR
 from pathlib import Path
@@ -19,6 +20,8 @@ from discord.ext import commands
 import core.dict_annotation as da
 from core.viewhandler import RemixView
 from core.wd_tagger import predict
+from core.vibe_references import get_reference, dumps_with_fragments
+from core import fast_json
 from core.nai_stats import (
     stats_manager, # Import the existing stats_manager instance
     NAIGenerationHistory,
@@ -53,15 +56,38 @@ class SSEEvent:
         return f"SSEEvent(event_type={self.event_type.value}, step={self.step})"
 
 
+class StageTimeoutError(Exception):
+    """Raised when a NovelAI or Discord call runs past its deadline budget."""
+
+def nai_client_timeout() -> aiohttp.ClientTimeout:
+    """Timeouts for sessions talking to NovelAI, replacing aiohttp's 5 minute default."""
+    return aiohttp.ClientTimeout(
+        total=settings.NAI_TOTAL_TIMEOUT,
+        sock_connect=settings.NAI_CONNECT_TIMEOUT,
+        sock_read=settings.NAI_FIRST_BYTE_TIMEOUT,
+    )
+
+async def with_deadline(awaitable, seconds: float, what: str):
+    """Await `awaitable`, raising StageTimeoutError if it takes longer than `seconds`."""
+    try:
+        async with asyncio.timeout(seconds):
+            return await awaitable
+    except TimeoutError:
+        raise StageTimeoutError(f"{what} timed out after {seconds:g}s")
+
 class NovelAIAPI:
     BASE_URL = "https://image.novelai.net"
     OTHER_URL = "https://api.novelai.net"
 
     @staticmethod
-    async def generate_image(session, access_token, prompt, model, action, parameters):
-        data = {"input": prompt, "model": model, "action": action, "parameters": parameters}
-        headers = {"Authorization": f"Bearer {access_token}"}
-        async with session.post(f"{NovelAIAPI.BASE_URL}/ai/generate-image", json=data, headers=headers) as response:
+    def generation_request(prompt, model, action, parameters) -> dict:
+        return {"input": prompt, "model": model, "action": action, "parameters": parameters}
+
+    @staticmethod
+    async def generate_image(session, access_token, body: bytes):
+        """Send a serialized generation_request to the generate endpoint."""
+        headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+        async with session.post(f"{NovelAIAPI.BASE_URL}/ai/generate-image", data=body, headers=headers) as response:
             try:
                 response.raise_for_status()
                 return await response.read(), response.status
@@ -74,20 +100,27 @@ class NovelAIAPI:
                     return None, e.status
 
     @staticmethod
-    async def generate_image_stream(session, access_token, prompt, model, action, parameters, total_steps) -> AsyncGenerator[SSEEvent, None]:
+    async def generate_image_stream(session, access_token, body: bytes, total_steps) -> AsyncGenerator[SSEEvent, None]:
         """
-        Connects to the NovelAI image generation streaming endpoint and yields SSEEvents.
+        Sends a serialized generation_request to the NovelAI image generation streaming endpoint and yields SSEEvents.
         This version manually processes the stream to avoid buffer overflows with large image data.
         """
-        data = {"input": prompt, "model": model, "action": action, "parameters": parameters}
-        headers = {"Authorization": f"Bearer {access_token}", "Accept": "text/event-stream"}
+        headers = {"Authorization": f"Bearer {access_token}", "Accept": "text/event-stream", "Content-Type": "application/json"}
         
-        async with session.post(f"{NovelAIAPI.BASE_URL}/ai/generate-image-stream", json=data, headers=headers) as response:
+        async with session.post(f"{NovelAIAPI.BASE_URL}/ai/generate-image-stream", data=body, headers=headers) as response:
             response.raise_for_status()
             
             buffer = b""
             event_type = None
-            async for chunk in response.content.iter_chunked(1024):
+            chunks = response.content.iter_chunked(1024)
+            # The first event may take a while to arrive, after that the stream must keep moving
+            read_timeout, waiting_for = settings.NAI_FIRST_BYTE_TIMEOUT, "first event"
+            while True:
+                try:
+                    chunk = await with_deadline(chunks.__anext__(), read_timeout, f"NovelAI stream ({waiting_for})")
+                except StopAsyncIteration:
+                    break
+                read_timeout, waiting_for = settings.NAI_STREAM_IDLE_TIMEOUT, "idle"
                 buffer += chunk
                 
                 while b"\n\n" in buffer:
@@ -119,187 +152,297 @@ class NovelAIAPI:
             "req_type": req_type,
             "defry": defry
         }
-        headers = {"Authorization": f"Bearer {access_token}"}
-        async with session.post(f"{NovelAIAPI.BASE_URL}/ai/augment-image", json=data, headers=headers) as response:
+        headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+        async with session.post(f"{NovelAIAPI.BASE_URL}/ai/augment-image", data=fast_json.dumps(data), headers=headers) as response:
             response.raise_for_status()
             return await response.read()
 
     @staticmethod
     async def upscale(session, access_token, image_base64: str, width: int, height: int, scale: int):
         data = {"image": image_base64, "width": width, "height": height, "scale": scale}
-        headers = {"Authorization": f"Bearer {access_token}"}
-        async with session.post(f"{NovelAIAPI.OTHER_URL}/ai/upscale", json=data, headers=headers) as response:
+        headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+        async with session.post(f"{NovelAIAPI.OTHER_URL}/ai/upscale", data=fast_json.dumps(data), headers=headers) as response:
             response.raise_for_status()
             return await response.read()
 
+@dataclass
+class StageRetryPolicy:
+    """How many times a stage of a job may fail, how long to wait before retrying it,
+    and how long a single run of it may take before the watchdog cancels the job."""
+    attempts: int
+    delay: float
+    deadline: float
+
+# Retry policy for each stage of process_txt2img, in the order they run.
+# The generate stage is limited by the job's number_of_tries instead of its attempts.
+TXT2IMG_STAGE_POLICIES = {
+    "generate": StageRetryPolicy(attempts=2, delay=10, deadline=settings.NAI_TOTAL_TIMEOUT + 30),
+    "upscale": StageRetryPolicy(attempts=2, delay=10, deadline=settings.NAI_TOTAL_TIMEOUT + 30),
+    "database": StageRetryPolicy(attempts=3, delay=5, deadline=settings.DISCORD_CALL_TIMEOUT + 30),
+    "classify": StageRetryPolicy(attempts=2, delay=5, deadline=settings.DISCORD_CALL_TIMEOUT * 2 + 30),
+    "deliver": StageRetryPolicy(attempts=3, delay=5, deadline=settings.DISCORD_CALL_TIMEOUT * 3 + 30),
+    "remix": StageRetryPolicy(attempts=2, delay=5, deadline=settings.DISCORD_CALL_TIMEOUT * 2 + 30),
+}
+
+def drop_checkpoint_payloads(checkpoints: da.Checkpoints):
+    """Drop the request body and images kept for retries once the job is over. Finished jobs stay
+    referenced by their remix buttons for a while, without this each would hold several MB."""
+    for key in ('request_body', 'image_bytes', 'upscaled_bytes'):
+        checkpoints.pop(key, None)
+
+def enter_stage(checkpoints: da.Checkpoints, stage: str):
+    """Mark `stage` as running, so the watchdog can measure it against its deadline."""
+    checkpoints['stage'] = stage
+    checkpoints['stage_started_at'] = asyncio.get_running_loop().time()
+
+NAI_STATUS_MESSAGES = {
+    400: "Bad request - The request was invalid or cannot be otherwise served",
+    401: "Unauthorized - Invalid API token",
+    402: "Payment Required - Payment is required to access this resource",
+    403: "Forbidden - Access to the resource is forbidden",
+    404: "Not Found - The requested resource was not found",
+    429: "Rate Limit Exceeded - Please try again later",
+    500: "Internal Server Error - NovelAI service issue",
+    502: "Bad Gateway - NovelAI service temporarily down",
+    503: "Service Unavailable - NovelAI is currently unavailable",
+    504: "Gateway Timeout - NovelAI service timed out",
+}
+
+def build_txt2img_parameters(bundle_data: da.BundleData) -> dict:
+    """Build the NovelAI `parameters` payload for a txt2img job."""
+    nai_params = {
+        "width": bundle_data['params']['width'],
+        "height": bundle_data['params']['height'],
+        "n_samples": 1,
+        "seed": bundle_data['params']['seed'],
+        "sampler": bundle_data['params']['sampler'],
+        "steps": bundle_data['params']['steps'],
+        "scale": bundle_data['params']['cfg'],
+        "uncond_scale": 1.0,
+        "negative_prompt": bundle_data['params']['negative'],
+        "sm": bundle_data['params']['sm'],
+        "sm_dyn": bundle_data['params']['sm_dyn'],
+        "cfg_rescale": 0,
+        "noise_schedule": bundle_data['params']['noise_schedule'],
+        "legacy": False,
+        "dynamic_thresholding": bundle_data['params']['dynamic_thresholding'],
+        "skip_cfg_above_sigma": bundle_data['params']['skip_cfg_above_sigma'] if bundle_data['params']['skip_cfg_above_sigma'] else None,
+    }
+
+    if bundle_data['params']['model'] in ["nai-diffusion-4-full", "nai-diffusion-4-5-curated", "nai-diffusion-4-5-full"]:
+        nai_params["v4_prompt"] = {
+            "caption": {
+                "base_caption": bundle_data['params']['positive'],
+                "char_captions": [],
+            },
+            "use_coords": False,
+            "use_order": False,
+        }
+        nai_params["v4_negative_prompt"] = {
+            "caption": {
+                "base_caption": bundle_data['params']['negative'],
+                "char_captions": [],
+            },
+            "use_coords": False,
+            "use_order": False,
+        }
+        nai_params["legacy_v3_extend"] = False
+        if bundle_data['params']['noise_schedule'] == "native":
+            nai_params["noise_schedule"] = "karras"
+
+    vibe_transfer_data = bundle_data['params'].get('vibe_transfer_data')
+    if vibe_transfer_data:
+        nai_params['reference_image_multiple'] = []
+        nai_params['reference_information_extracted_multiple'] = []
+        nai_params['reference_strength_multiple'] = []
+
+        for entry in vibe_transfer_data:
+            nai_params['reference_image_multiple'].append(entry['image'])
+            nai_params['reference_information_extracted_multiple'].append(entry['info_extracted'])
+            nai_params['reference_strength_multiple'].append(entry['ref_strength'])
+
+    return nai_params
+
+def build_generation_parameters(bundle_data: da.BundleData) -> GenerationParameters:
+    """Build the stats record of the parameters used by a txt2img job."""
+    return GenerationParameters(
+        positive_prompt=bundle_data['params']['positive'],
+        negative_prompt=bundle_data['params']['negative'],
+        width=bundle_data['params']['width'],
+        height=bundle_data['params']['height'],
+        steps=bundle_data['params']['steps'],
+        cfg=bundle_data['params']['cfg'],
+        sampler=bundle_data['params']['sampler'],
+        noise_schedule=bundle_data['params']['noise_schedule'],
+        smea=bundle_data['params']['sm'] or bundle_data['params']['sm_dyn'],
+        seed=bundle_data['params']['seed'],
+        model=bundle_data['params']['model'],
+        quality_toggle=bundle_data['checking_params']['quality_toggle'],
+        undesired_content=bundle_data['params']['negative'],
+        prompt_conversion=bundle_data['checking_params']['prompt_conversion_toggle'],
+        upscale=bundle_data['params']['upscale'],
+        decrisper=bundle_data['params']['dynamic_thresholding'],
+        variety_plus=bundle_data['params']['skip_cfg_above_sigma'],
+        vibe_transfer_used=bool(bundle_data['params'].get('vibe_transfer_data')),
+        undesired_content_preset=bundle_data['checking_params']['undesired_content_presets'],
+        streaming=uses_streaming(bundle_data)
+    )
+
+def uses_streaming(bundle_data: da.BundleData) -> bool:
+    """Whether this run of a job streams, admission control turns streaming off under load."""
+    return bool(bundle_data.get('streaming')) and not bundle_data.get('streaming_disabled')
+
+async def build_txt2img_request(bundle_data: da.BundleData) -> bytes:
+    """Build and serialize the NovelAI request body for a txt2img job."""
+    nai_params = build_txt2img_parameters(bundle_data)
+    size_hint = 0
+    if nai_params.get('reference_image_multiple'):
+        # Normalizing a reference is CPU work, do it off the event loop (cached after the first use)
+        images = nai_params['reference_image_multiple']
+        references = await asyncio.to_thread(lambda: [get_reference(image) for image in images])
+        nai_params['reference_image_multiple'] = references
+        size_hint = sum(len(reference.json_fragment) for reference in references)
+    request = NovelAIAPI.generation_request(bundle_data['params']['positive'], bundle_data['params']['model'], "generate", nai_params)
+    return await fast_json.dumps_async(dumps_with_fragments, request, size_hint)
+
+async def generate_txt2img_image(session: aiohttp.ClientSession, bundle_data: da.BundleData, message: Message) -> tuple[bytes, list]:
+    """Run the NovelAI generation for a txt2img job. Returns the image bytes and any timelapse frames."""
+    # The request is serialized once per job and reused by every retry
+    checkpoints: da.Checkpoints = bundle_data['checkpoints']
+    if checkpoints.get('request_body') is None:
+        checkpoints['request_body'] = await build_txt2img_request(bundle_data)
+    body = checkpoints['request_body']
+    final_image_bytes = None
+    timelapse_frames = []
+
+    if uses_streaming(bundle_data):
+        message = await message.edit(content=f"<a:evilrv1:1269168240102215731> Generating image (Streaming) <a:evilrv1:1269168240102215731>\nModel: `{bundle_data['params']['model']}`")
+
+        last_update_time = asyncio.get_event_loop().time()
+
+        async for event in NovelAIAPI.generate_image_stream(
+            session,
+            NAI_API_TOKEN,
+            body,
+            total_steps=bundle_data['params']['steps']
+        ):
+            if event.event_type == SSEEventType.INTERMEDIATE and event.image:
+                timelapse_frames.append(event.image)
+                current_time = asyncio.get_event_loop().time()
+                if event.step is not None and (current_time - last_update_time) > 1.0:
+                    try:
+                        img_byte_arr = io.BytesIO()
+                        event.image.save(img_byte_arr, format="PNG")
+                        img_byte_arr.seek(0)
+                        file = File(img_byte_arr, filename="preview.png")
+                        await message.edit(
+                            content=f"<a:evilrv1:1269168240102215731> Generating image (Streaming) <a:evilrv1:1269168240102215731>\nModel: `{bundle_data['params']['model']}`\nStep: {event.step}/{event.total_steps or '?'}",
+                            attachments=[file]
+                        )
+                        last_update_time = current_time
+                    except Exception as e:
+                        logger.error(f"Failed to update message with intermediate step: {e}")
+
+            elif event.event_type == SSEEventType.FINAL and event.image:
+                timelapse_frames.append(event.image)
+                img_byte_arr = io.BytesIO()
+                event.image.save(img_byte_arr, format="PNG")
+                final_image_bytes = img_byte_arr.getvalue()
+                break
+
+            elif event.event_type == SSEEventType.ERROR:
+                error_msg = event.data.get("message", "Unknown streaming error")
+                logger.error(f"NovelAI streaming error: {error_msg}")
+                raise Exception(f"NovelAI Streaming Error: {error_msg}")
+
+        if final_image_bytes is None:
+            raise Exception("Streaming finished without providing a final image.")
+
+    else:
+        zipped_bytes, status = await NovelAIAPI.generate_image(session, NAI_API_TOKEN, body)
+        if status != 200:
+            error_msg = NAI_STATUS_MESSAGES.get(status, f"NovelAI API status code: {status}")
+            logger.error(f"NovelAI API returned status code {error_msg}")
+            raise Exception(f"NovelAI API Error: {error_msg}")
+
+        zipped = zipfile.ZipFile(io.BytesIO(zipped_bytes))
+        final_image_bytes = zipped.read(zipped.infolist()[0])
+
+    return final_image_bytes, timelapse_frames
+
+def record_txt2img_generation(bundle_data: da.BundleData, success: bool, error_message: str | None = None):
+    """Add a history entry for a txt2img job to the stats, the stats flusher writes it behind."""
+    checkpoints = bundle_data['checkpoints']
+    end_to_end_time = None
+    if success and bundle_data.get('queued_at') is not None:
+        # Until the result is recorded, just before the reply is sent
+        end_to_end_time = round(asyncio.get_running_loop().time() - bundle_data['queued_at'], 2)
+    generation_result = GenerationResult(
+        success=success,
+        error_message=error_message,
+        database_message_id=checkpoints.get('database_message_id') if success else None,
+        attempts_made=checkpoints['stage_attempts'].get('generate', 0) + (1 if success else 0),
+        anlas_cost=bundle_data['cost'].anlas if success and bundle_data.get('cost') else 0
+    )
+    generation_history = NAIGenerationHistory(
+        generation_id=bundle_data['request_id'],
+        timestamp=datetime.now().isoformat(),
+        user_id=bundle_data['interaction'].user.id,
+        generation_time=checkpoints.get('elapsed_time', 0.0) if success else 0.0,
+        parameters=build_generation_parameters(bundle_data),
+        result=generation_result,
+        guild_id=bundle_data['interaction'].guild_id,
+        end_to_end_time=end_to_end_time
+    )
+    stats_manager.add_generation(generation_history)
+
 async def process_txt2img(bot: commands.Bot, bundle_data: da.BundleData):
-    while bundle_data['number_of_tries'] >= 1:
+    # Stage results are kept in the job's checkpoints, so a retry resumes from the
+    # stage that failed instead of asking NovelAI for the image again.
+    if not bundle_data.get('checkpoints'):
+        bundle_data['checkpoints'] = {"stage_attempts": {}}
+    checkpoints: da.Checkpoints = bundle_data['checkpoints']
+
+    request_id = bundle_data['request_id']
+    interaction: Interaction = bundle_data['interaction']
+    output_dir = Path("nai_output")
+    output_dir.mkdir(exist_ok=True)
+    file_path_full = str(output_dir / f"nai_generated_{interaction.user.id}.png")
+
+    while True:
+        message: Message = bundle_data['message']
         try:
-            bundle_data['number_of_tries'] -= 1
-            async with aiohttp.ClientSession() as session:
-
-                request_id = bundle_data['request_id']
-                interaction: Interaction = bundle_data['interaction']
-                message: Message = bundle_data['message']
-                
-                nai_params = {
-                    "width": bundle_data['params']['width'],
-                    "height": bundle_data['params']['height'],
-                    "n_samples": 1,
-                    "seed": bundle_data['params']['seed'],
-                    "sampler": bundle_data['params']['sampler'],
-                    "steps": bundle_data['params']['steps'],
-                    "scale": bundle_data['params']['cfg'],
-                    "uncond_scale": 1.0,
-                    "negative_prompt": bundle_data['params']['negative'],
-                    "sm": bundle_data['params']['sm'],
-                    "sm_dyn": bundle_data['params']['sm_dyn'],
-                    "cfg_rescale": 0,
-                    "noise_schedule": bundle_data['params']['noise_schedule'],
-                    "legacy": False,
-                    "dynamic_thresholding": bundle_data['params']['dynamic_thresholding'],
-                    "skip_cfg_above_sigma": bundle_data['params']['skip_cfg_above_sigma'] if bundle_data['params']['skip_cfg_above_sigma'] else None,
-                }
-
-                if bundle_data['params']['model'] in ["nai-diffusion-4-full", "nai-diffusion-4-5-curated", "nai-diffusion-4-5-full"]:
-                    nai_params["v4_prompt"] = {
-                        "caption": {
-                            "base_caption": bundle_data['params']['positive'],
-                            "char_captions": [],
-                        },
-                        "use_coords": False,
-                        "use_order": False,
-                    }
-                    nai_params["v4_negative_prompt"] = {
-                        "caption": {
-                            "base_caption": bundle_data['params']['negative'],
-                            "char_captions": [],
-                        },
-                        "use_coords": False,
-                        "use_order": False,
-                    }
-                    nai_params["legacy_v3_extend"] = False
-                    if bundle_data['params']['noise_schedule'] == "native":
-                        nai_params["noise_schedule"] = "karras"
-
-                vibe_transfer_data = bundle_data['params'].get('vibe_transfer_data')
-                if vibe_transfer_data:
-                    nai_params['reference_image_multiple'] = []
-                    nai_params['reference_information_extracted_multiple'] = []
-                    nai_params['reference_strength_multiple'] = []
-
-                    for entry in vibe_transfer_data:
-                        nai_params['reference_image_multiple'].append(entry['image'])
-                        nai_params['reference_information_extracted_multiple'].append(entry['info_extracted'])
-                        nai_params['reference_strength_multiple'].append(entry['ref_strength'])
-                
-                message = await message.edit(content=f"<a:evilrv1:1269168240102215731> Generating image <a:evilrv1:1269168240102215731>\nModel: `{bundle_data['params']['model']}`")
-
+            ### Generate the image
+            if checkpoints.get('image_bytes') is None:
+                enter_stage(checkpoints, "generate")
+                bundle_data['number_of_tries'] -= 1
+                message = await with_deadline(message.edit(content=f"<a:evilrv1:1269168240102215731> Generating image <a:evilrv1:1269168240102215731>\nModel: `{bundle_data['params']['model']}`"), settings.DISCORD_CALL_TIMEOUT, "Discord message edit")
                 start_time = datetime.now()
 
-                generation_params = GenerationParameters(
-                    positive_prompt=bundle_data['params']['positive'],
-                    negative_prompt=bundle_data['params']['negative'],
-                    width=bundle_data['params']['width'],
-                    height=bundle_data['params']['height'],
-                    steps=bundle_data['params']['steps'],
-                    cfg=bundle_data['params']['cfg'],
-                    sampler=bundle_data['params']['sampler'],
-                    noise_schedule=bundle_data['params']['noise_schedule'],
-                    smea=bundle_data['params']['sm'] or bundle_data['params']['sm_dyn'],
-                    seed=bundle_data['params']['seed'],
-                    model=bundle_data['params']['model'],
-                    quality_toggle=bundle_data['checking_params']['quality_toggle'],
-                    undesired_content=bundle_data['params']['negative'],
-                    prompt_conversion=bundle_data['checking_params']['prompt_conversion_toggle'],
-                    upscale=bundle_data['params']['upscale'],
-                    decrisper=bundle_data['params']['dynamic_thresholding'],
-                    variety_plus=bundle_data['params']['skip_cfg_above_sigma'],
-                    vibe_transfer_used=bool(vibe_transfer_data),
-                    undesired_content_preset=bundle_data['checking_params']['undesired_content_presets']
-                )
-
-                final_image_bytes = None
-                timelapse_frames = []
+                async with aiohttp.ClientSession(timeout=nai_client_timeout()) as session:
+                    image_bytes, timelapse_frames = await generate_txt2img_image(session, bundle_data, message)
 
-                if bundle_data.get('streaming', False):
-                    message = await message.edit(content=f"<a:evilrv1:1269168240102215731> Generating image (Streaming) <a:evilrv1:1269168240102215731>\nModel: `{bundle_data['params']['model']}`")
-                    
-                    last_update_time = asyncio.get_event_loop().time()
+                if timelapse_frames:
+                    timelapse_path = output_dir / f"timelapse_{interaction.user.id}.gif"
+                    timelapse_frames[0].save(
+                        timelapse_path,
+                        save_all=True,
+                        append_images=timelapse_frames[1:],
+                        optimize=False,
+                        duration=100,
+                        loop=0
+                    )
+                    checkpoints['timelapse_path'] = str(timelapse_path)
 
-                    async for event in NovelAIAPI.generate_image_stream(
-                        session,
-                        NAI_API_TOKEN,
-                        bundle_data['params']['positive'],
-                        bundle_data['params']['model'],
-                        "generate",
-                        parameters=nai_params,
-                        total_steps=bundle_data['params']['steps']
-                    ):
-                        if event.event_type == SSEEventType.INTERMEDIATE and event.image:
-                            timelapse_frames.append(event.image)
-                            current_time = asyncio.get_event_loop().time()
-                            if event.step is not None and (current_time - last_update_time) > 1.0:
-                                try:
-                                    img_byte_arr = io.BytesIO()
-                                    event.image.save(img_byte_arr, format="PNG")
-                                    img_byte_arr.seek(0)
-                                    file = File(img_byte_arr, filename="preview.png")
-                                    await message.edit(
-                                        content=f"<a:evilrv1:1269168240102215731> Generating image (Streaming) <a:evilrv1:1269168240102215731>\nModel: `{bundle_data['params']['model']}`\nStep: {event.step}/{event.total_steps or '?'}",
-                                        attachments=[file]
-                                    )
-                                    last_update_time = current_time
-                                except Exception as e:
-                                    logger.error(f"Failed to update message with intermediate step: {e}")
-
-                        elif event.event_type == SSEEventType.FINAL and event.image:
-                            timelapse_frames.append(event.image)
-                            img_byte_arr = io.BytesIO()
-                            event.image.save(img_byte_arr, format="PNG")
-                            final_image_bytes = img_byte_arr.getvalue()
-                            break
-
-                        elif event.event_type == SSEEventType.ERROR:
-                            error_msg = event.data.get("message", "Unknown streaming error")
-                            logger.error(f"NovelAI streaming error: {error_msg}")
-                            raise Exception(f"NovelAI Streaming Error: {error_msg}")
-
-                    if final_image_bytes is None:
-                         raise Exception("Streaming finished without providing a final image.")
+                checkpoints['image_bytes'] = image_bytes
+                checkpoints['elapsed_time'] = round((datetime.now() - start_time).total_seconds(), 2)
 
-                else:
-                    zipped_bytes, status = await NovelAIAPI.generate_image(
-                        session,
-                        NAI_API_TOKEN,
-                        bundle_data['params']['positive'],
-                        bundle_data['params']['model'],
-                        "generate",
-                        parameters=nai_params
-                    )
-                    if status != 200:
-                        error_messages = {
-                            400: "Bad request - The request was invalid or cannot be otherwise served",
-                            401: "Unauthorized - Invalid API token",
-                            402: "Payment Required - Payment is required to access this resource",
-                            403: "Forbidden - Access to the resource is forbidden",
-                            404: "Not Found - The requested resource was not found",
-                            429: "Rate Limit Exceeded - Please try again later",
-                            500: "Internal Server Error - NovelAI service issue",
-                            502: "Bad Gateway - NovelAI service temporarily down",
-                            503: "Service Unavailable - NovelAI is currently unavailable",
-                            504: "Gateway Timeout - NovelAI service timed out",
-                        }
-                        error_msg = error_messages.get(status, f"NovelAI API status code: {status}")
-                        logger.error(f"NovelAI API returned status code {error_msg}")
-                        raise Exception(f"NovelAI API Error: {error_msg}")
-
-                    zipped = zipfile.ZipFile(io.BytesIO(zipped_bytes))
-                    final_image_bytes = zipped.read(zipped.infolist()[0])
-
-                image_base64 = base64.b64encode(final_image_bytes).decode("utf-8")
-
-                if bundle_data['params']['upscale']:
+            ### Upscale the image
+            if bundle_data['params']['upscale'] and checkpoints.get('upscaled_bytes') is None:
+                enter_stage(checkpoints, "upscale")
+                start_time = datetime.now()
+                image_base64 = base64.b64encode(checkpoints['image_bytes']).decode("utf-8")
+                async with aiohttp.ClientSession(timeout=nai_client_timeout()) as session:
                     upscaled_bytes = await NovelAIAPI.upscale(
                         session,
                         NAI_API_TOKEN,
@@ -308,277 +451,259 @@ async def process_txt2img(bot: commands.Bot, bundle_data: da.BundleData):
                         bundle_data['params']['height'],
                         4,
                     )
-                    zipped_upscale = zipfile.ZipFile(io.BytesIO(upscaled_bytes))
-                    final_image_bytes = zipped_upscale.read(zipped_upscale.infolist()[0])
-                    
-                file_path = f"nai_generated_{interaction.user.id}.png"
-                output_dir = Path("nai_output")
-                output_dir.mkdir(exist_ok=True)
-                (output_dir / file_path).write_bytes(final_image_bytes)
+                zipped_upscale = zipfile.ZipFile(io.BytesIO(upscaled_bytes))
+                checkpoints['upscaled_bytes'] = zipped_upscale.read(zipped_upscale.infolist()[0])
+                checkpoints['elapsed_time'] = round(checkpoints['elapsed_time'] + (datetime.now() - start_time).total_seconds(), 2)
 
-                end_time = datetime.now()
-                elapsed_time = round((end_time - start_time).total_seconds(), 2)
+            final_image_bytes = checkpoints.get('upscaled_bytes') or checkpoints['image_bytes']
+            # Rewritten on every attempt, another job of the same user may have reused the path
+            Path(file_path_full).write_bytes(final_image_bytes)
 
-                reply_content = f"Seed: `{bundle_data['params']['seed']}` | Elapsed time: `{elapsed_time}s`"
-                reply_content += f"\nBy: {interaction.user.mention}"
+            reply_content = f"Seed: `{bundle_data['params']['seed']}` | Elapsed time: `{checkpoints['elapsed_time']}s`"
+            reply_content += f"\nBy: {interaction.user.mention}"
 
-                files = []
-                file_path_full = str(output_dir / file_path)
-                file = File(file_path_full)
-                files.append(file)
-
-                if timelapse_frames:
-                    timelapse_path = output_dir / f"timelapse_{interaction.user.id}.gif"
-                    timelapse_frames[0].save(
-                        timelapse_path,
-                        save_all=True,
-                        append_images=timelapse_frames[1:],
-                        optimize=False,
-                        duration=100,
-                        loop=0
-                    )
-                    
+            ### Upload to the database channel
+            if checkpoints.get('database_message_id') is None:
+                enter_stage(checkpoints, "database")
                 database_channel = bot.get_channel(settings.DATABASE_CHANNEL_ID)
                 reply_content_db = reply_content
-                
-                # Update stats using the stats_manager
-                generation_result = GenerationResult(
-                    success=True,
-                    error_message=None,
-                    database_message_id=database_message.id if 'database_message' in locals() else None,
-                    attempts_made=2 - bundle_data['number_of_tries']
-                )
-
-                generation_history = NAIGenerationHistory(
-                    generation_id=request_id,
-                    timestamp=datetime.now().isoformat(),
-                    user_id=interaction.user.id,
-                    generation_time=elapsed_time,
-                    parameters=generation_params,
-                    result=generation_result
-                )
-                if stats_manager.add_generation(generation_history):
-                    stats_manager.save_data()
-
                 if interaction.guild is None:
                     reply_content_db += f"\nChannel: {interaction.user.mention}'s DM"
                 else:
                     interaction_channel_link = f"https://discord.com/channels/{interaction.guild.id}/{interaction.channel.id}"
                     reply_content_db += f"\nChannel: {interaction_channel_link}"
-                
-                # Re-open file for database send
+
                 db_files = [File(file_path_full)]
                 if settings.TO_DATABASE:
-                    database_message = await database_channel.send(content=reply_content_db, files=db_files, allowed_mentions=AllowedMentions.none())
+                    database_message = await with_deadline(database_channel.send(content=reply_content_db, files=db_files, allowed_mentions=AllowedMentions.none()), settings.DISCORD_CALL_TIMEOUT, "Database upload")
                 else:
-                    database_message = await database_channel.send(content=reply_content_db, files=db_files, allowed_mentions=AllowedMentions.none(), delete_after=20)
-                
-                attachment = database_message.attachments[0]
-                image_url = attachment.url if attachment else None
+                    database_message = await with_deadline(database_channel.send(content=reply_content_db, files=db_files, allowed_mentions=AllowedMentions.none(), delete_after=20), settings.DISCORD_CALL_TIMEOUT, "Database upload")
 
-                # Re-open file for final reply
-                final_files = [File(file_path_full)]
-                if timelapse_frames:
-                    final_files.append(File(str(timelapse_path)))
+                attachment = database_message.attachments[0] if database_message.attachments else None
+                checkpoints['database_image_url'] = attachment.url if attachment else None
+                checkpoints['database_message_id'] = database_message.id
 
+            # Update stats using the stats_manager, once the database message ID is known
+            if not checkpoints.get('stats_recorded'):
+                record_txt2img_generation(bundle_data, success=True)
+                checkpoints['stats_recorded'] = True
+
+            final_files = [File(file_path_full)]
+            if checkpoints.get('timelapse_path'):
+                final_files.append(File(checkpoints['timelapse_path']))
+
+            ### Classify the image and deliver it
+            if not checkpoints.get('delivered'):
                 if interaction.guild_id == settings.ANIMEAI_SERVER and interaction.channel_id == settings.SFW_IMAGE_GEN_BOT_CHANNEL:
-                    warning_message = f"<a:neuroKuru:1279864980795035783> Classifying image...\n-# If image is classified as NSFW, it will be forwarded to the NSFW channel.\n-# Want to skip classification? Use bot in {bot.get_channel(settings.IMAGE_GEN_BOT_CHANNEL).mention}"
-                    message = await message.edit(content=warning_message, attachments=[])
-                    
-                    if image_url:
-                        confidence_levels, highest_confidence_level, is_nsfw = predict(image_url)
-                        if is_nsfw:
+                    if checkpoints.get('is_nsfw') is None:
+                        enter_stage(checkpoints, "classify")
+                        warning_message = f"<a:neuroKuru:1279864980795035783> Classifying image...\n-# If image is classified as NSFW, it will be forwarded to the NSFW channel.\n-# Want to skip classification? Use bot in {bot.get_channel(settings.IMAGE_GEN_BOT_CHANNEL).mention}"
+                        message = await with_deadline(message.edit(content=warning_message, attachments=[]), settings.DISCORD_CALL_TIMEOUT, "Discord message edit")
+
+                        if checkpoints.get('database_image_url'):
+                            # The tagger client is blocking, keep it off the event loop
+                            confidence_levels, highest_confidence_level, is_nsfw = await with_deadline(asyncio.to_thread(predict, checkpoints['database_image_url']), settings.DISCORD_CALL_TIMEOUT, "Image classification")
+                            checkpoints['is_nsfw'] = is_nsfw
+                        else:
+                            await message.edit(content="Error: Could not retrieve image URL for classification.", attachments=[])
+                            checkpoints['delivered'] = True
+
+                    if not checkpoints.get('delivered'):
+                        enter_stage(checkpoints, "deliver")
+                        if checkpoints['is_nsfw']:
                             nsfw_channel = bot.get_channel(settings.IMAGE_GEN_BOT_CHANNEL)
-                            forward_message = await nsfw_channel.send(content=f"{reply_content}\n[View Request]({message.jump_url})", files=final_files)
+                            forward_message = await with_deadline(nsfw_channel.send(content=f"{reply_content}\n[View Request]({message.jump_url})", files=final_files), settings.DISCORD_CALL_TIMEOUT, "NSFW forward")
+                            checkpoints['delivered'] = True
                             await forward_message.add_reaction("🗑️")
-                            
+
                             reply_content += f"\nForwarded to {nsfw_channel.mention} due to `NSFW` content.\n[View Forwarded Message]({forward_message.jump_url})"
-                            await message.edit(content=reply_content, attachments=[])
+                            await message.edit(content=reply_content, attachments=[], view=None)
                             bundle_data['message'] = forward_message
                         else:
-                            message = await message.edit(content=reply_content, attachments=final_files)
+                            message = await with_deadline(message.edit(content=reply_content, attachments=final_files, view=None), settings.DISCORD_CALL_TIMEOUT, "Delivery")
+                            checkpoints['delivered'] = True
                             await message.add_reaction("🗑️")
                             await message.add_reaction("🔎")
-                    else:
-                        await message.edit(content="Error: Could not retrieve image URL for classification.", attachments=[])
                 else:
-                    message = await message.edit(content=reply_content, attachments=final_files)
+                    enter_stage(checkpoints, "deliver")
+                    message = await with_deadline(message.edit(content=reply_content, attachments=final_files, view=None), settings.DISCORD_CALL_TIMEOUT, "Delivery")
+                    checkpoints['delivered'] = True
                     await message.add_reaction("🗑️")
                     await message.add_reaction("🔎")
-                
+
+            ### Attach the remix buttons
+            if not checkpoints.get('remix_sent'):
+                enter_stage(checkpoints, "remix")
                 forward_channel = bot.get_channel(settings.IMAGE_GEN_BOT_CHANNEL)
                 settings.Globals.remix_views[request_id] = RemixView(bundle_data, forward_channel)
-                await settings.Globals.remix_views[request_id].send()
+                await with_deadline(settings.Globals.remix_views[request_id].send(), settings.DISCORD_CALL_TIMEOUT, "Remix buttons")
+                checkpoints['remix_sent'] = True
 
-                if interaction.channel.id == 1157817614245052446:
-                    await message.add_reaction("🔎")
-                    await message.add_reaction("🗑️")
-                
-                generation_result = GenerationResult(
-                    success=True,
-                    error_message=None,
-                    database_message_id=database_message.id if 'database_message' in locals() else None,
-                    attempts_made=2 - bundle_data['number_of_tries']
-                )
-                
-                generation_history = NAIGenerationHistory(
-                    generation_id=request_id,
-                    timestamp=datetime.now().isoformat(),
-                    user_id=interaction.user.id,
-                    generation_time=elapsed_time,
-                    parameters=generation_params,
-                    result=generation_result
-                )
-                if stats_manager.add_generation(generation_history):
-                    stats_manager.save_data()
-                
-                return True
+            if interaction.channel.id == 1157817614245052446:
+                await message.add_reaction("🔎")
+                await message.add_reaction("🗑️")
 
-        except Exception as e:
-            logger.error(f"Error processing request: {str(e)}")
-
-            if 'request_id' in locals() and 'generation_params' in locals() and 'interaction' in locals():
-                generation_result = GenerationResult(
-                    success=False,
-                    error_message=str(e),
-                    database_message_id=None,
-                    attempts_made=2 - bundle_data.get('number_of_tries', 1)
-                )
+            return True
 
-                generation_history = NAIGenerationHistory(
-                    generation_id=request_id,
-                    timestamp=datetime.now().isoformat(),
-                    user_id=interaction.user.id,
-                    generation_time=0.0,
-                    parameters=generation_params,
-                    result=generation_result
-                )
-                stats_manager.add_generation(generation_history)
-                stats_manager.save_data()
+        except Exception as e:
+            stage = checkpoints.get('stage', "generate")
+            checkpoints['stage_attempts'][stage] = checkpoints['stage_attempts'].get(stage, 0) + 1
+            policy = TXT2IMG_STAGE_POLICIES[stage]
+            if stage == "generate":
+                tries_left = bundle_data.get('number_of_tries', 0)
+            else:
+                tries_left = policy.attempts - checkpoints['stage_attempts'][stage]
+            logger.error(f"Error processing request {request_id} at stage '{stage}': {str(e)}")
+
+            # Failed NovelAI calls are recorded, failures after the image exists are not
+            if stage in ("generate", "upscale"):
+                record_txt2img_generation(bundle_data, success=False, error_message=str(e))
+
+            if checkpoints.get('delivered'):
+                # The user's message already holds the image, leave it alone and only retry what is left
+                if tries_left > 0:
+                    # The backoff does not count toward the stage deadline
+                    checkpoints['stage_started_at'] = asyncio.get_running_loop().time() + policy.delay
+                    await asyncio.sleep(policy.delay)
+                    continue
+                logger.warning(f"Request {request_id} was delivered, giving up on stage '{stage}'")
+                return True
 
-            if bundle_data.get('number_of_tries', 0) > 0:
-                reply_content = f"⚠️`{str(e)}`. Retrying in `10` seconds. (`{bundle_data['number_of_tries']}` tries left)"
-                await message.edit(content=reply_content, attachments=[])
-                await asyncio.sleep(10)
+            if tries_left > 0:
+                reply_content = f"⚠️`{str(e)}`. Retrying in `{policy.delay}` seconds. (`{tries_left}` tries left)"
+                try:
+                    await message.edit(content=reply_content, attachments=[])
+                except Exception as edit_e:
+                    logger.error(f"Failed to report retry for request {request_id}: {edit_e}")
+                # The backoff does not count toward the stage deadline
+                checkpoints['stage_started_at'] = asyncio.get_running_loop().time() + policy.delay
+                await asyncio.sleep(policy.delay)
             else:
                 reply_content = f"❌`{str(e)}`. Please try again later."
-                await message.edit(content=reply_content, attachments=[])
+                try:
+                    await message.edit(content=reply_content, attachments=[], view=None)
+                except Exception as edit_e:
+                    logger.error(f"Failed to report failure for request {request_id}: {edit_e}")
                 return False
 
-# The process_director_tools function remains unchanged. Please include it in your final file.
-# NOTE: The provided snippet for process_director_tools is correct and does not need changes.
+async def run_director_tool(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, params: da.Director_Tools_Params, image_string: str, req_type: str) -> bytes:
+    """Run one augmentation on the already encoded image and return the resulting image."""
+    prompt = params['prompt']
+    if req_type == "emotion":
+        prompt = f"{params['emotion'] or 'neutral;;'}{prompt}" # The emotion choice already ends with ';;'
+    async with semaphore:
+        zipped_bytes = await NovelAIAPI.director_tools(
+            session,
+            NAI_API_TOKEN,
+            width=params['width'],
+            height=params['height'],
+            image=image_string,
+            req_type=req_type,
+            prompt=prompt,
+            defry=params['defry'],
+        )
+    zipped = zipfile.ZipFile(io.BytesIO(zipped_bytes))
+    return zipped.read(zipped.infolist()[0])
+
 async def process_director_tools(bot: commands.Bot, bundle_data: da.BundleData):
+    params: da.Director_Tools_Params = bundle_data['director_tools_params']
+    request_id = bundle_data['request_id']
+    interaction: Interaction = bundle_data['interaction']
+    req_types = params['req_types']
+    output_dir = Path("nai_output")
+    output_dir.mkdir(exist_ok=True)
+
+    # One download and one base64 encoding are shared by every augmentation in the batch,
+    # and augmentations that already succeeded are not run again on a retry
+    original_image = None
+    original_image_string = None
+    results: dict[str, bytes] = {}
+    start_time = datetime.now()
+
     while bundle_data['number_of_tries'] >= 1:
+        message: Message = bundle_data['message']
         try:
             bundle_data['number_of_tries'] -= 1
-            async with aiohttp.ClientSession() as session:
-                if bundle_data["director_tools_params"]["req_type"] == "emotion":
-                    bundle_data["director_tools_params"]["prompt"] = f"{bundle_data['director_tools_params']['emotion']};;{bundle_data['director_tools_params']['prompt']}"
-                request_id = bundle_data['request_id']
-                interaction: Interaction = bundle_data['interaction']
-                message: Message = bundle_data['message']
-                original_image = await bundle_data['director_tools_params']['image'].read()
+            if original_image is None and params.get('image_bytes') is not None:
+                # Prefetched by the queue while the job was waiting
+                original_image = params['image_bytes']
+                original_image_string = params['image_base64']
+            elif original_image is None:
+                original_image = await params['image'].read()
                 original_image_string = base64.b64encode(original_image).decode("utf-8")
 
-                message = await message.edit(content="<a:evilrv1:1269168240102215731> Directing image <a:evilrv1:1269168240102215731>")
-
-                # Start the timer
-                start_time = datetime.now()
+            message = await with_deadline(message.edit(content="<a:evilrv1:1269168240102215731> Directing image <a:evilrv1:1269168240102215731>"), settings.DISCORD_CALL_TIMEOUT, "Discord message edit")
 
-                generation_params = GenerationParameters(
-                    positive_prompt=bundle_data['director_tools_params']['prompt'],
-                    negative_prompt=None,
-                    width=bundle_data['director_tools_params']['width'],
-                    height=bundle_data['director_tools_params']['height'],
-                    steps=0,  # Director tools don't use these parameters
-                    cfg=0.0,
-                    sampler="",
-                    noise_schedule="",
-                    smea="",
-                    seed=0,
-                    model="director-tools",
-                    quality_toggle=False,
-                    undesired_content=bundle_data['director_tools_params']['prompt'], # Use the prompt for director tools
-                    prompt_conversion=False,
-                    upscale=False,
-                    decrisper=False,
-                    variety_plus=False,
-                    vibe_transfer=False,
-                    undesired_content_preset=None # Director tools don't have UC presets
+            # Run the remaining augmentations concurrently
+            pending = [req_type for req_type in req_types if req_type not in results]
+            semaphore = asyncio.Semaphore(settings.DIRECTOR_TOOLS_CONCURRENCY)
+            async with aiohttp.ClientSession(timeout=nai_client_timeout()) as session:
+                outputs = await asyncio.gather(
+                    *(run_director_tool(session, semaphore, params, original_image_string, req_type) for req_type in pending),
+                    return_exceptions=True
                 )
+            errors = []
+            for req_type, output in zip(pending, outputs):
+                if isinstance(output, Exception):
+                    logger.error(f"Director tool '{req_type}' failed for request {request_id}: {str(output)}")
+                    errors.append(f"{req_type}: {str(output)}")
+                else:
+                    results[req_type] = output
+            if errors:
+                raise RuntimeError("; ".join(errors))
+
+            # Save the images
+            original_file_path = output_dir / f"original_director_tools_{interaction.user.id}.png"
+            original_file_path.write_bytes(original_image)
+            result_file_paths = []
+            for req_type in req_types:
+                file_path = output_dir / f"director_tools_{req_type}_{interaction.user.id}.png"
+                file_path.write_bytes(results[req_type])
+                result_file_paths.append(file_path)
+
+            # Stop the timer
+            elapsed_time = round((datetime.now() - start_time).total_seconds(), 2)
+
+            # Some information for the user
+            reply_content = f"Request: {', '.join(f'`{req_type}`' for req_type in req_types)} | Elapsed time: `{elapsed_time}s`"
+            reply_content += f"\nBy: {interaction.user.mention}"
+
+            # Send the original and every result in one message
+            files = [File(original_file_path)] + [File(file_path) for file_path in result_file_paths]
+            await with_deadline(message.edit(content=reply_content, attachments=files, view=None), settings.DISCORD_CALL_TIMEOUT, "Delivery")
+
+            # Forward the image to database if enabled
+            if settings.TO_DATABASE:
+                # Database channel
+                database_channel = bot.get_channel(settings.DATABASE_CHANNEL_ID)
 
-                # Call director tools API
-                zipped_bytes = await NovelAIAPI.director_tools(
-                    session,
-                    NAI_API_TOKEN,
-                    width=bundle_data['director_tools_params']['width'],
-                    height=bundle_data['director_tools_params']['height'],
-                    image=original_image_string,
-                    req_type=bundle_data['director_tools_params']['req_type'],
-                    prompt=bundle_data['director_tools_params']['prompt'],
-                    defry=bundle_data['director_tools_params']['defry'],
-                )
+                # Reopen the files for forwarding
+                files = [File(original_file_path)] + [File(file_path) for file_path in result_file_paths]
 
-                # Process the response
-                zipped = zipfile.ZipFile(io.BytesIO(zipped_bytes))
-                image_bytes = zipped.read(zipped.infolist()[0])
-
-                # Save the image
-                file_path = f"director_tools_{interaction.user.id}.png"
-                original_file_path = f"original_{file_path}"
-                output_dir = Path("nai_output")
-                output_dir.mkdir(exist_ok=True)
-                (output_dir / file_path).write_bytes(image_bytes)
-                (output_dir / original_file_path).write_bytes(original_image)
-
-                # Stop the timer
-                end_time = datetime.now()
-                elapsed_time = end_time - start_time
-                elapsed_time = round(elapsed_time.total_seconds(), 2)
-
-                # Some information for the user
-                reply_content = f"Request: `{bundle_data['director_tools_params']['req_type']}` | Elapsed time: `{elapsed_time}s`"
-                reply_content += f"\nBy: {interaction.user.mention}"
-
-                # Send the image
-                files = []
-                file_path = f"{output_dir}/{file_path}"
-                original_file_path = f"{output_dir}/{original_file_path}"
-                file = File(file_path)
-                files.append(File(original_file_path))
-                files.append(file)
-                await message.edit(content=reply_content, attachments=files)
-
-                # Forward the image to database if enabled
-                if settings.TO_DATABASE:
-                    # Database channel
-                    database_channel = bot.get_channel(settings.DATABASE_CHANNEL_ID)
+                # Additional info for the database (adding channel of interaction)
+                interaction_channel_link = f"https://discord.com/channels/{interaction.guild.id}/{interaction.channel.id}"
+                reply_content += f"\nChannel: {interaction_channel_link}"
+                await with_deadline(database_channel.send(content=reply_content, files=files, allowed_mentions=AllowedMentions.none()), settings.DISCORD_CALL_TIMEOUT, "Database upload")
 
-                    # Reopen the file for forwarding
-                    files = []
-                    file = File(file_path)
-                    files.append(File(original_file_path))
-                    files.append(file)
+            # Check if channel posted on is IMAGE_GEN_BOT_CHANNEL then add reaction
+            if interaction.channel.id == settings.IMAGE_GEN_BOT_CHANNEL:
+                await message.add_reaction("🗑️")
 
-                    # Additional info for the database (adding channel of interaction)
-                    interaction_channel_link = f"https://discord.com/channels/{interaction.guild.id}/{interaction.channel.id}"
-                    reply_content += f"\nChannel: {interaction_channel_link}"
-                    await database_channel.send(content=reply_content, files=files, allowed_mentions=AllowedMentions.none())
+            return True
 
-                # Check if channel posted on is IMAGE_GEN_BOT_CHANNEL then add reaction
-                if interaction.channel.id == settings.IMAGE_GEN_BOT_CHANNEL:
-                    await message.add_reaction("🗑️")
-
-                return True
-            
         except Exception as e:
-            logger.error(f"Error processing request: {str(e)}")
+            logger.error(f"Error processing request {request_id}: {str(e)}")
             if bundle_data['number_of_tries'] > 0:
                 reply_content = f"An error occurred while processing your request. Retrying in `10` seconds. (`{bundle_data['number_of_tries']}` tries left)"
-                await message.edit(content=reply_content)
+                try:
+                    await message.edit(content=reply_content)
+                except Exception as edit_e:
+                    logger.error(f"Failed to report retry for request {request_id}: {edit_e}")
                 await asyncio.sleep(10)
-                await process_director_tools(bot, bundle_data)
             else:
                 reply_content = f"An error occurred while processing your request. Please try again later."
-                await message.edit(content=reply_content)
-                return True
+                try:
+                    await message.edit(content=reply_content, view=None)
+                except Exception as edit_e:
+                    logger.error(f"Failed to report failure for request {request_id}: {edit_e}")
+                return False
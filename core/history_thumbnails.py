@@ -0,0 +1,107 @@
+import asyncio
+import io
+from pathlib import Path
+from PIL import Image, ImageDraw
+
+import discord
+
+import settings
+from settings import logger
+
+COLUMNS = 3
+LABEL_HEIGHT = 20
+BACKGROUND = (47, 49, 54) # Discord's dark embed background
+PLACEHOLDER = (32, 34, 37)
+
+class ThumbnailCache:
+    """Small JPEG thumbnails of past generations, fetched from their database channel messages
+    and kept on disk, so a /nai-history page downloads each image at most once."""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+        self.missing: set[int] = set() # Messages without an image (deleted or never uploaded), not fetched again
+        self.file_count: int | None = None # Counted on first store
+        self.semaphore = asyncio.Semaphore(settings.HISTORY_THUMBNAIL_FETCHES)
+
+    def path(self, database_message_id: int) -> Path:
+        return self.cache_dir / f"{database_message_id}.jpg"
+
+    async def get(self, bot: discord.Client, database_message_id: int | None) -> Path | None:
+        """Path of the cached thumbnail of a database message, fetching the image first when it is not cached."""
+        if database_message_id is None or database_message_id in self.missing:
+            return None
+        path = self.path(database_message_id)
+        if path.exists():
+            return path
+        async with self.semaphore:
+            try:
+                channel = bot.get_channel(settings.DATABASE_CHANNEL_ID)
+                message = await channel.fetch_message(database_message_id)
+                if not message.attachments:
+                    self.missing.add(database_message_id)
+                    return None
+                image_bytes = await message.attachments[0].read()
+            except discord.NotFound:
+                self.missing.add(database_message_id)
+                return None
+            except Exception as e:
+                logger.warning(f"Could not fetch database message {database_message_id} for its thumbnail: {str(e)}")
+                return None
+        try:
+            await asyncio.to_thread(self._store, path, image_bytes)
+        except Exception as e:
+            logger.error(f"Error creating thumbnail of database message {database_message_id}: {str(e)}")
+            return None
+        return path
+
+    def _store(self, path: Path, image_bytes: bytes):
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image = image.convert("RGB")
+            image.thumbnail((settings.HISTORY_THUMBNAIL_SIZE, settings.HISTORY_THUMBNAIL_SIZE), Image.LANCZOS)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            temp_file = path.with_suffix(".tmp")
+            image.save(temp_file, format="JPEG", quality=85)
+        temp_file.replace(path)
+
+        if self.file_count is None:
+            self.file_count = sum(1 for _ in self.cache_dir.glob("*.jpg"))
+        else:
+            self.file_count += 1
+        if self.file_count > settings.HISTORY_THUMBNAIL_CACHE_FILES:
+            self._prune()
+
+    def _prune(self):
+        """Delete the least recently written thumbnails, down to 90% of the limit."""
+        files = sorted(self.cache_dir.glob("*.jpg"), key=lambda file: file.stat().st_mtime)
+        excess = len(files) - int(settings.HISTORY_THUMBNAIL_CACHE_FILES * 0.9)
+        for file in files[:max(excess, 0)]:
+            file.unlink(missing_ok=True)
+        self.file_count = len(files) - max(excess, 0)
+
+def compose_page(thumbnails: list[Path | None], labels: list[str], placeholder: str = "No image") -> bytes:
+    """One JPEG of a history page: the thumbnails in a grid, each captioned with its label.
+    Entries without a thumbnail get an empty tile showing `placeholder`, so the numbers still line up with the embed."""
+    size = settings.HISTORY_THUMBNAIL_SIZE
+    rows = (len(thumbnails) + COLUMNS - 1) // COLUMNS
+    columns = min(len(thumbnails), COLUMNS)
+    page = Image.new("RGB", (columns * size, rows * (size + LABEL_HEIGHT)), BACKGROUND)
+    draw = ImageDraw.Draw(page)
+    for i, (thumbnail, label) in enumerate(zip(thumbnails, labels)):
+        x, y = (i % COLUMNS) * size, (i // COLUMNS) * (size + LABEL_HEIGHT)
+        if thumbnail is not None:
+            try:
+                with Image.open(thumbnail) as image:
+                    # Centered in its tile, thumbnails keep the aspect ratio of the generation
+                    page.paste(image, (x + (size - image.width) // 2, y + (size - image.height) // 2))
+            except Exception as e:
+                logger.warning(f"Could not read thumbnail {thumbnail}: {str(e)}")
+                thumbnail = None
+        if thumbnail is None:
+            draw.rectangle((x + 4, y + 4, x + size - 5, y + size - 5), fill=PLACEHOLDER)
+            draw.text((x + size // 2 - 3 * len(placeholder), y + size // 2 - 6), placeholder, fill=(150, 150, 150))
+        draw.text((x + 6, y + size + 4), label, fill=(255, 255, 255))
+    output = io.BytesIO()
+    page.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+thumbnail_cache = ThumbnailCache(settings.HISTORY_THUMBNAIL_DIR)
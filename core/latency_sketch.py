@@ -0,0 +1,155 @@
+import math
+from typing import Dict, Iterable, List, Optional
+
+RELATIVE_ACCURACY = 0.01 # Quantiles are within 1% of the true value; changing it invalidates saved sketches
+MIN_VALUE = 0.001 # Seconds, smaller values are counted as 0
+METRICS = ("generation", "end_to_end")
+DIMENSIONS = ("model", "resolution", "mode")
+# Pixel counts up to which a resolution falls in a bucket, larger ones are "huge"
+RESOLUTION_BUCKETS = [(512 * 768, "small"), (1024 * 1024, "normal"), (1536 * 1536, "large")]
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+def resolution_bucket(width: int, height: int) -> str:
+    pixels = width * height
+    for limit, bucket in RESOLUTION_BUCKETS:
+        if pixels <= limit:
+            return bucket
+    return "huge"
+
+class LatencySketch:
+    """A DDSketch: counts of values in logarithmically sized bins, so any quantile is known within
+    RELATIVE_ACCURACY from a few hundred bins. Adding or removing a value is O(1) and sketches merge
+    by adding their counts."""
+    __slots__ = ("bins", "zero_count", "count")
+
+    def __init__(self):
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float, sign: int = 1):
+        """Add a value, or remove one added before with sign=-1."""
+        self.count += sign
+        if value <= MIN_VALUE:
+            self.zero_count += sign
+            return
+        index = math.ceil(math.log(value) / _LOG_GAMMA)
+        count = self.bins.get(index, 0) + sign
+        if count > 0:
+            self.bins[index] = count
+        else:
+            self.bins.pop(index, None)
+
+    def merge(self, other: 'LatencySketch'):
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0 to 1), None when the sketch is empty."""
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * _GAMMA ** index / (_GAMMA + 1) # Middle of the bin
+        return 2 * _GAMMA ** max(self.bins) / (_GAMMA + 1)
+
+    def to_dict(self) -> dict:
+        return {"zero": self.zero_count, "bins": {str(index): count for index, count in self.bins.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LatencySketch':
+        sketch = cls()
+        sketch.zero_count = data.get("zero", 0)
+        sketch.bins = {int(index): count for index, count in data.get("bins", {}).items()}
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        return sketch
+
+class LatencySketches:
+    """Latency sketches of successful generations per model, resolution bucket and streaming mode,
+    for the generation time (the NovelAI calls) and the end-to-end time (from entering the queue).
+    Queries merge the sketches of the combinations they cover."""
+
+    def __init__(self):
+        # Metric -> "model|resolution|mode" -> sketch
+        self.sketches: Dict[str, Dict[str, LatencySketch]] = {metric: {} for metric in METRICS}
+
+    def apply(self, history, sign: int = 1):
+        """Add a NAIGenerationHistory's times, or subtract them with sign=-1. Failed generations have no times."""
+        if not history.result.success:
+            return
+        parameters = history.parameters
+        key = "|".join((
+            str(parameters.model),
+            resolution_bucket(parameters.width, parameters.height),
+            "streaming" if parameters.streaming else "standard",
+        ))
+        self._add("generation", key, history.generation_time, sign)
+        if history.end_to_end_time is not None: # Not known for entries recorded before it was tracked
+            self._add("end_to_end", key, history.end_to_end_time, sign)
+
+    def _add(self, metric: str, key: str, value: float, sign: int):
+        sketches = self.sketches[metric]
+        sketch = sketches.get(key)
+        if sketch is None:
+            if sign < 0:
+                return
+            sketch = sketches[key] = LatencySketch()
+        sketch.add(value, sign)
+        if sketch.count <= 0:
+            del sketches[key]
+
+    def merged(self, metric: str, **filters: str) -> LatencySketch:
+        """One sketch of a metric, of the combinations matching the filters (model=, resolution=, mode=)."""
+        merged = LatencySketch()
+        for key, sketch in self.sketches[metric].items():
+            values = dict(zip(DIMENSIONS, key.split("|")))
+            if all(values[dimension] == value for dimension, value in filters.items()):
+                merged.merge(sketch)
+        return merged
+
+    def breakdown(self, metric: str, dimension: str) -> Dict[str, LatencySketch]:
+        """One merged sketch of a metric per model, resolution bucket or mode."""
+        position = DIMENSIONS.index(dimension)
+        breakdown: Dict[str, LatencySketch] = {}
+        for key, sketch in self.sketches[metric].items():
+            breakdown.setdefault(key.split("|")[position], LatencySketch()).merge(sketch)
+        return breakdown
+
+    def status_summary(self, top_models: int = 3) -> dict:
+        """p50 / p90 / p99 for /status, in total and per resolution bucket, mode and the
+        top_models models with the most generations, so the summary stays short."""
+        summary = {metric: format_quantiles(self.merged(metric)) for metric in METRICS}
+        for dimension in DIMENSIONS:
+            breakdown = self.breakdown("generation", dimension)
+            if dimension == "model" and len(breakdown) > top_models:
+                shown = sorted(breakdown, key=lambda model: breakdown[model].count, reverse=True)[:top_models]
+                summary["models_not_shown"] = len(breakdown) - top_models
+                breakdown = {model: breakdown[model] for model in shown}
+            summary[f"generation_by_{dimension}"] = {value: format_quantiles(sketch) for value, sketch in sorted(breakdown.items())}
+        return summary
+
+    def to_dict(self) -> dict:
+        return {metric: {key: sketch.to_dict() for key, sketch in sketches.items()} for metric, sketches in self.sketches.items()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LatencySketches':
+        latency = cls()
+        for metric in METRICS:
+            latency.sketches[metric] = {key: LatencySketch.from_dict(sketch) for key, sketch in data.get(metric, {}).items()}
+        return latency
+
+def format_quantiles(sketch: LatencySketch, quantiles: Iterable[float] = (0.5, 0.9, 0.99)) -> str:
+    """Quantiles of a sketch in seconds, as "p50 / p90 / p99". "N/A" when it is empty."""
+    values: List[Optional[float]] = [sketch.quantile(q) for q in quantiles]
+    if values[0] is None:
+        return "N/A"
+    return " / ".join(f"{value:.1f}s" for value in values)
@@ -0,0 +1,176 @@
+import json
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from settings import logger
+
+class RankIndex:
+    """User IDs ordered by total generations, most first, ties by user ID. Kept up to date by the
+    stats manager with every generation, so a rank, the top k or the ranks around a user cost
+    O(log n) instead of sorting every user."""
+
+    def __init__(self):
+        self.totals: Dict[int, int] = {}
+        self.ranked = SortedList() # (-total, user_id)
+
+    def __len__(self) -> int:
+        return len(self.ranked)
+
+    def rebuild(self, totals: Iterable[Tuple[int, int]]):
+        """Replace the index with (user_id, total) pairs."""
+        self.totals = {user_id: total for user_id, total in totals if total > 0}
+        self.ranked = SortedList((-total, user_id) for user_id, total in self.totals.items())
+
+    def update(self, user_id: int, total: int):
+        """Set a user's total, removing them from the index once it drops to 0."""
+        previous = self.totals.get(user_id)
+        if previous == total:
+            return
+        if previous is not None:
+            self.ranked.remove((-previous, user_id))
+            del self.totals[user_id]
+        if total > 0:
+            self.ranked.add((-total, user_id))
+            self.totals[user_id] = total
+
+    def remove(self, user_id: int):
+        self.update(user_id, 0)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based rank of a user, None when they have no generations."""
+        total = self.totals.get(user_id)
+        if total is None:
+            return None
+        return self.ranked.bisect_left((-total, user_id)) + 1
+
+    def at(self, rank: int) -> Tuple[int, int]:
+        """(user_id, total) of the user at a 1-based rank."""
+        negative_total, user_id = self.ranked[rank - 1]
+        return user_id, -negative_total
+
+    def top(self, k: int) -> List[Tuple[int, int]]:
+        """(user_id, total) of the k highest ranked users."""
+        return [(user_id, -negative_total) for negative_total, user_id in self.ranked.islice(0, k)]
+
+    def around(self, rank: int, before: int = 1, after: int = 1) -> List[Tuple[int, int, int]]:
+        """(rank, user_id, total) from `before` ranks above to `after` ranks below a 1-based rank."""
+        start = max(rank - before, 1)
+        return [
+            (start + i, user_id, -negative_total)
+            for i, (negative_total, user_id) in enumerate(self.ranked.islice(start - 1, rank + after))
+        ]
+
+WINDOWS = ("week", "month", "30d")
+
+def window_starts(today: date) -> Dict[str, str]:
+    """First day of each leaderboard window ending today, as day keys of the usage rollups."""
+    return {
+        "week": (today - timedelta(days=today.weekday())).isoformat(),
+        "month": today.replace(day=1).isoformat(),
+        "30d": (today - timedelta(days=29)).isoformat(),
+    }
+
+class WindowedLeaderboards:
+    """Rank indexes of the generations made this week, this month and in the last 30 days, in total
+    and per model. Built from the per-user daily counts of the usage rollups and updated with every
+    generation. When the date changes, the days leaving a window are subtracted from its indexes,
+    so rolling over never rescans the history."""
+
+    def __init__(self):
+        self.user_days: Dict[str, Dict[str, Dict[str, int]]] = {} # StatsRollups.user_days
+        self.today: Optional[str] = None
+        self.starts: Dict[str, str] = {}
+        self.indexes: Dict[Tuple[str, Optional[str]], RankIndex] = {} # (window, model or None for all models)
+
+    @staticmethod
+    def _windows_of(day: str, starts: Dict[str, str], today: str) -> set:
+        return {window for window, start in starts.items() if start <= day <= today}
+
+    def rebuild(self, user_days: Dict[str, Dict[str, Dict[str, int]]]):
+        """Rebuild the indexes from the per-user daily counts, which later changes go through."""
+        self.user_days = user_days
+        self.today = date.today().isoformat()
+        self.starts = window_starts(date.today())
+        totals: Dict[Tuple[str, Optional[str]], Dict[int, int]] = {}
+        for day, models in user_days.items():
+            for window in self._windows_of(day, self.starts, self.today):
+                for model, users in models.items():
+                    for key in ((window, None), (window, model)):
+                        counts = totals.setdefault(key, {})
+                        for user_id, count in users.items():
+                            counts[int(user_id)] = counts.get(int(user_id), 0) + count
+        self.indexes = {}
+        for key, counts in totals.items():
+            self.indexes[key] = RankIndex()
+            self.indexes[key].rebuild(counts.items())
+
+    def _add(self, window: str, model: str, user_id: int, delta: int):
+        for key in ((window, None), (window, model)):
+            index = self.indexes.get(key)
+            if index is None:
+                index = self.indexes[key] = RankIndex()
+            index.update(user_id, index.totals.get(user_id, 0) + delta)
+
+    def roll(self):
+        """Move the windows to today's date, adding and subtracting the days that enter or leave them."""
+        today = date.today().isoformat()
+        if today == self.today:
+            return
+        starts = window_starts(date.today())
+        if self.today is not None:
+            for day, models in self.user_days.items():
+                before = self._windows_of(day, self.starts, self.today)
+                after = self._windows_of(day, starts, today)
+                for window in before ^ after:
+                    sign = 1 if window in after else -1
+                    for model, users in models.items():
+                        for user_id, count in users.items():
+                            self._add(window, model, int(user_id), sign * count)
+        self.today, self.starts = today, starts
+
+    def apply(self, history, sign: int = 1):
+        """Add a NAIGenerationHistory to the windows it falls in, or subtract it with sign=-1."""
+        self.roll()
+        day = datetime.fromisoformat(history.timestamp).date().isoformat()
+        for window in self._windows_of(day, self.starts, self.today):
+            self._add(window, str(history.parameters.model), history.user_id, sign)
+
+    def get(self, window: str, model: Optional[str] = None) -> RankIndex:
+        """Rank index of a window, of one model's generations when `model` is given."""
+        self.roll()
+        index = self.indexes.get((window, model))
+        return index if index is not None else RankIndex()
+
+class LeaderboardOptIns:
+    """Who opted in to be named on the leaderboard, kept in memory and written through to a JSON file.
+    Users are opted out by default."""
+
+    def __init__(self, opt_file: Path):
+        self.opt_file = opt_file
+        self.status: Dict[str, bool] = {} # Keyed by user ID string, as in the file
+        self.load()
+
+    def load(self):
+        if not self.opt_file.exists():
+            return
+        try:
+            with open(self.opt_file, "r") as f:
+                self.status = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Error decoding JSON from {self.opt_file}. Proceeding with default (opt-out) for all.")
+
+    def is_opted_in(self, user_id: int) -> bool:
+        return self.status.get(str(user_id), False)
+
+    def set(self, user_id: int, opt_in: bool):
+        """Record a user's choice. The file is written first, the cache only changes once it is saved."""
+        status = {**self.status, str(user_id): opt_in}
+        self.opt_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.opt_file.with_suffix(".tmp")
+        with open(temp_file, "w") as f:
+            json.dump(status, f, indent=4)
+        temp_file.replace(self.opt_file)
+        self.status = status
@@ -5,8 +5,10 @@ import discord
 import requests
 import json
 import base64
+import asyncio
 import core.dict_annotation as da
 from core.checking_params import check_params
+from core.vibe_references import normalize_reference_base64
 
 class EditModal(Modal, title='Vibe Transfer Edit'):
     def __init__(self, title: str, page: int, update_message, current_info: float = None, current_strength: float = None, view=None):
@@ -128,6 +130,7 @@ class AddModal(Modal, title='Add Vibe Transfer Image'):
                     raise ValueError("Invalid image URL")
                 image_bytes = response.content
                 image_string = base64.b64encode(image_bytes).decode("utf-8")
+                image_string = await asyncio.to_thread(normalize_reference_base64, image_string)
             except requests.exceptions.RequestException as e:
                 await interaction.followup.send(f"Failed to download image from URL: `{str(e)}`", ephemeral=True)
                 return
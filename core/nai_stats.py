@@ -1,9 +1,18 @@
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple, Any
-from datetime import datetime
-import json
+from typing import Dict, Iterable, List, Optional, Tuple, Any
+from datetime import datetime, timedelta, timezone
+import asyncio
+import bisect
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+import settings
 from settings import logger
+from core.stats_log import HistoryLog, migrate_legacy_files
+from core.stats_sqlite import SQLiteHistoryStore
+from core.stats_rollups import StatsRollups
+from core.leaderboard import RankIndex, WindowedLeaderboards
+from core.latency_sketch import LatencySketches
 
 @dataclass
 class GenerationParameters:
@@ -26,6 +35,7 @@ class GenerationParameters:
     variety_plus: bool
     vibe_transfer_used: bool = False # Added field to track if vibe transfer was used
     undesired_content_preset: Optional[str] = None # Added field for detected preset
+    streaming: bool = False # False for entries recorded before streaming was tracked
 
 @dataclass
 class GenerationResult:
@@ -33,6 +43,7 @@ class GenerationResult:
     error_message: Optional[str]
     database_message_id: Optional[int]
     attempts_made: int # Renamed from retry_count
+    anlas_cost: Optional[int] = None # Estimated Anlas charged, None for entries recorded before costs were tracked
 
 @dataclass
 class NAIGenerationHistory:
@@ -42,6 +53,8 @@ class NAIGenerationHistory:
     generation_time: float
     parameters: GenerationParameters
     result: GenerationResult
+    guild_id: Optional[int] = None # None for DMs and for entries recorded before guilds were tracked
+    end_to_end_time: Optional[float] = None # Seconds from entering the queue, None for entries recorded before it was tracked
 
     def to_dict(self) -> dict:
         return {
@@ -54,8 +67,11 @@ class NAIGenerationHistory:
                 "success": self.result.success,
                 "error_message": self.result.error_message,
                 "database_message_id": self.result.database_message_id,
-                "attempts_made": self.result.attempts_made # Use new field name
-            }
+                "attempts_made": self.result.attempts_made, # Use new field name
+                "anlas_cost": self.result.anlas_cost
+            },
+            "guild_id": self.guild_id,
+            "end_to_end_time": self.end_to_end_time
         }
 
     @classmethod
@@ -68,12 +84,14 @@ class NAIGenerationHistory:
         # Handle old 'retry_count' field for backward compatibility
         attempts_made = result_data.pop('retry_count', 0)
         result_data.setdefault("attempts_made", attempts_made)
+        result_data.setdefault("anlas_cost", None)
         result_data.pop('image_url', None) # Remove image_url if it exists in old data
 
         # Handle potential missing undesired_content_preset and vibe_transfer_used in old data
         parameters_data = data.get("parameters", {})
         parameters_data.setdefault("undesired_content_preset", None)
         parameters_data.setdefault("vibe_transfer_used", False) # Ensure new field exists for old data
+        parameters_data.setdefault("streaming", False)
 
 
         return cls(
@@ -82,9 +100,137 @@ class NAIGenerationHistory:
             user_id=data["user_id"],
             generation_time=data["generation_time"],
             parameters=GenerationParameters(**parameters_data),
-            result=GenerationResult(**result_data)
+            result=GenerationResult(**result_data),
+            guild_id=data.get("guild_id"),
+            end_to_end_time=data.get("end_to_end_time")
         )
 
+_EPOCH = datetime(1970, 1, 1)
+
+def timestamp_key(timestamp: str) -> int:
+    """Microseconds since 1970 of an ISO timestamp's wall-clock time, so keys order like the strings do."""
+    return (datetime.fromisoformat(timestamp).replace(tzinfo=None) - _EPOCH) // timedelta(microseconds=1)
+
+def _share(pool: Dict[Any, Any], value):
+    """One shared object per distinct value, instead of a copy per entry."""
+    if value is None:
+        return None
+    return pool.setdefault((type(value), value), value) # Keyed by type too, 0 == 0.0 == False
+
+class CompactGeneration:
+    """NAIGenerationHistory as the stats manager keeps it in memory: one slotted object per entry, with
+    strings that repeat across entries shared through a pool, the timestamp as an integer and the
+    boolean parameters as bit flags. expand() returns the full NAIGenerationHistory."""
+    __slots__ = (
+        "generation_id", "time_key", "utc_offset", "raw_timestamp", "user_id", "guild_id", "generation_time", "end_to_end_time",
+        "positive_prompt", "negative_prompt", "undesired_content", "undesired_content_preset",
+        "width", "height", "steps", "cfg", "sampler", "noise_schedule", "smea", "seed", "model", "flags",
+        "error_message", "database_message_id", "attempts_made", "anlas_cost",
+    )
+    # Bits of `flags`
+    FLAGS = ("quality_toggle", "prompt_conversion", "upscale", "decrisper", "variety_plus", "vibe_transfer_used", "streaming")
+    SUCCESS = 1 << len(FLAGS)
+
+    @classmethod
+    def from_history(cls, history: NAIGenerationHistory, pool: Dict[Any, Any]) -> 'CompactGeneration':
+        entry = cls.__new__(cls)
+        parameters, result = history.parameters, history.result
+        entry.generation_id = history.generation_id
+        date = datetime.fromisoformat(history.timestamp)
+        offset = date.utcoffset()
+        entry.time_key = (date.replace(tzinfo=None) - _EPOCH) // timedelta(microseconds=1)
+        entry.utc_offset = _share(pool, offset // timedelta(minutes=1)) if offset is not None else None
+        entry.raw_timestamp = None
+        if entry.timestamp != history.timestamp:
+            entry.raw_timestamp = history.timestamp # Not in isoformat()'s own format, kept as it was
+        entry.user_id = _share(pool, history.user_id)
+        entry.guild_id = _share(pool, history.guild_id)
+        entry.generation_time = history.generation_time
+        entry.end_to_end_time = history.end_to_end_time
+        entry.positive_prompt = _share(pool, parameters.positive_prompt)
+        entry.negative_prompt = _share(pool, parameters.negative_prompt)
+        entry.undesired_content = _share(pool, parameters.undesired_content)
+        entry.undesired_content_preset = _share(pool, parameters.undesired_content_preset)
+        entry.width = _share(pool, parameters.width)
+        entry.height = _share(pool, parameters.height)
+        entry.steps = parameters.steps
+        entry.cfg = _share(pool, parameters.cfg)
+        entry.sampler = _share(pool, parameters.sampler)
+        entry.noise_schedule = _share(pool, parameters.noise_schedule)
+        entry.smea = _share(pool, parameters.smea)
+        entry.seed = parameters.seed
+        entry.model = _share(pool, parameters.model)
+        flags = cls.SUCCESS if result.success else 0
+        for bit, name in enumerate(cls.FLAGS):
+            if getattr(parameters, name):
+                flags |= 1 << bit
+        entry.flags = flags
+        entry.error_message = _share(pool, result.error_message)
+        entry.database_message_id = result.database_message_id
+        entry.attempts_made = result.attempts_made
+        entry.anlas_cost = result.anlas_cost
+        return entry
+
+    @property
+    def timestamp(self) -> str:
+        if self.raw_timestamp is not None:
+            return self.raw_timestamp
+        date = _EPOCH + timedelta(microseconds=self.time_key)
+        if self.utc_offset is not None:
+            date = date.replace(tzinfo=timezone(timedelta(minutes=self.utc_offset)))
+        return date.isoformat()
+
+    def expand(self) -> NAIGenerationHistory:
+        flags = self.flags
+        return NAIGenerationHistory(
+            generation_id=self.generation_id,
+            timestamp=self.timestamp,
+            user_id=self.user_id,
+            generation_time=self.generation_time,
+            parameters=GenerationParameters(
+                positive_prompt=self.positive_prompt,
+                negative_prompt=self.negative_prompt,
+                width=self.width,
+                height=self.height,
+                steps=self.steps,
+                cfg=self.cfg,
+                sampler=self.sampler,
+                noise_schedule=self.noise_schedule,
+                smea=self.smea,
+                seed=self.seed,
+                model=self.model,
+                undesired_content=self.undesired_content,
+                undesired_content_preset=self.undesired_content_preset,
+                **{name: bool(flags & (1 << bit)) for bit, name in enumerate(self.FLAGS)}
+            ),
+            result=GenerationResult(
+                success=bool(flags & self.SUCCESS),
+                error_message=self.error_message,
+                database_message_id=self.database_message_id,
+                attempts_made=self.attempts_made,
+                anlas_cost=self.anlas_cost
+            ),
+            guild_id=self.guild_id,
+            end_to_end_time=self.end_to_end_time
+        )
+
+# Features whose share of users is tracked: feature -> (GenerationParameters flag, NAIUserStats counter)
+FEATURE_USAGE = {
+    "upscale": ("upscale", "upscale_count"),
+    "vibe_transfer": ("vibe_transfer_used", "vibe_transfer_count"),
+    "quality_toggle": ("quality_toggle", "quality_toggle_count"),
+    "decrisper": ("decrisper", "decrisper_count"),
+    "variety_plus": ("variety_plus", "variety_plus_count"),
+}
+
+def _decrement(counter: Dict[str, int], key: str):
+    """Count one less of `key`, dropping it at zero as if it had never been counted."""
+    count = counter.get(key, 0) - 1
+    if count > 0:
+        counter[key] = count
+    else:
+        counter.pop(key, None)
+
 @dataclass
 class NAIUserStats:
     user_id: int
@@ -109,6 +255,8 @@ class NAIUserStats:
     first_generation: Optional[str] = None  # ISO format string
     monthly_usage: Dict[str, int] = field(default_factory=dict)
     daily_usage: Dict[str, int] = field(default_factory=dict)
+    total_steps: float = 0.0 # Sums behind average_steps and average_cfg, so generations can be subtracted again
+    total_cfg: float = 0.0
 
     def to_dict(self) -> dict:
         return {
@@ -133,7 +281,9 @@ class NAIUserStats:
             "last_generation": self.last_generation,
             "first_generation": self.first_generation,
             "monthly_usage": self.monthly_usage,
-            "daily_usage": self.daily_usage
+            "daily_usage": self.daily_usage,
+            "total_steps": self.total_steps,
+            "total_cfg": self.total_cfg
         }
 
     @classmethod
@@ -143,8 +293,15 @@ class NAIUserStats:
         data.setdefault("quality_toggle_count", 0) # Ensure new field exists for old data
         data.setdefault("decrisper_count", 0) # Ensure new field exists for old data
         data.setdefault("variety_plus_count", 0) # Ensure new field exists for old data
+        data.setdefault("total_steps", data.get("average_steps", 0.0) * data.get("total_generations", 0))
+        data.setdefault("total_cfg", data.get("average_cfg", 0.0) * data.get("total_generations", 0))
         return cls(**data)
 
+    def _update_averages(self):
+        n = self.total_generations
+        self.average_steps = self.total_steps / n if n > 0 else 0.0
+        self.average_cfg = self.total_cfg / n if n > 0 else 0.0
+
     def update_with_generation(self, history: NAIGenerationHistory):
         """Update stats with a new generation"""
         try:
@@ -167,11 +324,10 @@ class NAIUserStats:
             size_key = f"{history.parameters.width}x{history.parameters.height}"
             self.most_used_sizes[size_key] = self.most_used_sizes.get(size_key, 0) + 1
 
-            # Update averages
-            total_gens = self.successful_generations + self.failed_generations
-            if total_gens > 0:
-                self.average_steps = (self.average_steps * (total_gens - 1) + history.parameters.steps) / total_gens
-                self.average_cfg = (self.average_cfg * (total_gens - 1) + history.parameters.cfg) / total_gens
+            # Update averages, kept as sums so remove_generation can subtract them
+            self.total_steps += history.parameters.steps
+            self.total_cfg += history.parameters.cfg
+            self._update_averages()
 
             # Update special features usage
             if history.parameters.upscale:
@@ -189,11 +345,12 @@ class NAIUserStats:
                  self.preset_usage[history.parameters.undesired_content_preset] = self.preset_usage.get(history.parameters.undesired_content_preset, 0) + 1
 
 
-            # Update timestamps
+            # Update timestamps, the oldest and newest whatever order generations are added in (ISO strings order by time)
             current_time = history.timestamp
-            if not self.first_generation:
+            if not self.first_generation or current_time < self.first_generation:
                 self.first_generation = current_time
-            self.last_generation = current_time
+            if not self.last_generation or current_time >= self.last_generation:
+                self.last_generation = current_time
 
             # Update time-based usage
             date = datetime.fromisoformat(current_time)
@@ -205,6 +362,38 @@ class NAIUserStats:
         except Exception as e:
             logger.error(f"Error updating user stats: {str(e)}")
 
+    def remove_generation(self, history: NAIGenerationHistory):
+        """Subtract a generation added by update_with_generation. first_generation and last_generation
+        are left to the stats manager, which knows the user's remaining history."""
+        try:
+            self.total_generations -= 1
+            if history.result.success:
+                self.successful_generations -= 1
+            else:
+                self.failed_generations -= 1
+            self.total_generation_time -= history.generation_time
+
+            _decrement(self.models_used, history.parameters.model)
+            _decrement(self.samplers_used, history.parameters.sampler)
+            _decrement(self.most_used_sizes, f"{history.parameters.width}x{history.parameters.height}")
+
+            self.total_steps -= history.parameters.steps
+            self.total_cfg -= history.parameters.cfg
+            self._update_averages()
+
+            for parameter, counter in FEATURE_USAGE.values():
+                if getattr(history.parameters, parameter):
+                    setattr(self, counter, getattr(self, counter) - 1)
+            if history.parameters.undesired_content_preset:
+                _decrement(self.preset_usage, history.parameters.undesired_content_preset)
+
+            date = datetime.fromisoformat(history.timestamp)
+            _decrement(self.monthly_usage, date.strftime("%Y-%m"))
+            _decrement(self.daily_usage, date.strftime("%Y-%m-%d"))
+
+        except Exception as e:
+            logger.error(f"Error removing generation from user stats: {str(e)}")
+
 @dataclass
 class NAIGlobalStats:
     total_generations: int = 0
@@ -226,6 +415,17 @@ class NAIGlobalStats:
     decrisper_ratio: float = 0.0 # Added field
     variety_plus_ratio: float = 0.0 # Added field
     preset_distribution: Dict[str, int] = field(default_factory=dict) # Added for global preset distribution
+    latency: LatencySketches = field(default_factory=LatencySketches) # Generation and end-to-end time quantiles
+    parameter_sums: Dict[str, float] = field(default_factory=lambda: { # Sums behind average_parameters
+        "steps": 0.0,
+        "cfg": 0.0
+    })
+    # Kept up to date per generation and rebuilt from the user stats on load, not saved
+    feature_users: Dict[str, int] = field(default_factory=dict) # Users who used each feature at least once
+    active_day: Optional[str] = None
+    active_day_users: set = field(default_factory=set)
+    active_month: Optional[str] = None
+    active_month_users: set = field(default_factory=set)
 
 
     @property
@@ -253,7 +453,9 @@ class NAIGlobalStats:
             "variety_plus_ratio": self.variety_plus_ratio, # Include new field
             "total_generation_time": self.total_generation_time,
             "average_generation_speed": self.average_generation_speed, # Include calculated property
-            "preset_distribution": self.preset_distribution # Include preset distribution
+            "preset_distribution": self.preset_distribution, # Include preset distribution
+            "parameter_sums": self.parameter_sums,
+            "latency": self.latency.to_dict()
         }
 
     @classmethod
@@ -269,17 +471,58 @@ class NAIGlobalStats:
         data.setdefault("decrisper_ratio", 0.0) # Ensure new field exists for old data
         data.setdefault("variety_plus_ratio", 0.0) # Ensure new field exists for old data
         data.setdefault("preset_distribution", {}) # Ensure preset_distribution exists
+        data.setdefault("parameter_sums", {
+            param: average * data.get("total_generations", 0) for param, average in data["average_parameters"].items()
+        })
         # Note: average_generation_speed is a property, not stored directly
         # Remove average_generation_speed from data before passing to __init__
         data.pop('average_generation_speed', None)
+        # Snapshots written before latency was tracked have none, the stats manager rebuilds it from history
+        data["latency"] = LatencySketches.from_dict(data.get("latency", {}))
         return cls(**data)
 
 
-    def update_with_generation(self, history: NAIGenerationHistory, user_stats: list):
-        """Update global stats with a new generation"""
+    def _roll_active_users(self) -> Tuple[str, str]:
+        """Start new active user sets when the day or month has changed. Returns today's and this month's keys."""
+        now = datetime.now()
+        today, this_month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+        if self.active_day != today:
+            self.active_day, self.active_day_users = today, set()
+        if self.active_month != this_month:
+            self.active_month, self.active_month_users = this_month, set()
+        return today, this_month
+
+    def _update_averages(self):
+        n = self.total_generations
+        for param, total in self.parameter_sums.items():
+            self.average_parameters[param] = total / n if n > 0 else 0.0
+
+    def _update_ratios(self):
+        for feature in FEATURE_USAGE:
+            ratio = self.feature_users.get(feature, 0) / self.total_users if self.total_users > 0 else 0
+            setattr(self, f"{feature}_ratio", ratio)
+
+    def rebuild_user_aggregates(self, user_stats: Iterable[NAIUserStats]):
+        """Recount the per-user aggregates from all user stats, after loading saved stats."""
+        user_stats = list(user_stats)
+        today, this_month = self._roll_active_users()
+        self.total_users = len(user_stats)
+        self.feature_users = {
+            feature: sum(1 for u in user_stats if getattr(u, counter) > 0)
+            for feature, (_, counter) in FEATURE_USAGE.items()
+        }
+        self.active_day_users = {u.user_id for u in user_stats if today in u.daily_usage}
+        self.active_month_users = {u.user_id for u in user_stats if this_month in u.monthly_usage}
+        self.active_users_today = len(self.active_day_users)
+        self.active_users_month = len(self.active_month_users)
+        self._update_ratios()
+
+    def update_with_generation(self, history: NAIGenerationHistory, user: NAIUserStats):
+        """Update global stats with a new generation, `user` being the stats of its user after it"""
         try:
             self.total_generations += 1
             self.total_generation_time += history.generation_time
+            self.latency.apply(history)
 
             # Update model distribution
             self.model_distribution[history.parameters.model] = self.model_distribution.get(history.parameters.model, 0) + 1
@@ -287,14 +530,10 @@ class NAIGlobalStats:
             # Update sampler distribution
             self.sampler_distribution[history.parameters.sampler] = self.sampler_distribution.get(history.parameters.sampler, 0) + 1
 
-            # Update average parameters
-            n = self.total_generations
-            if n > 0:
-                for param, value in [
-                    ("steps", history.parameters.steps),
-                    ("cfg", history.parameters.cfg)
-                ]:
-                    self.average_parameters[param] = (self.average_parameters[param] * (n - 1) + value) / n
+            # Update average parameters, kept as sums so remove_generation can subtract them
+            self.parameter_sums["steps"] += history.parameters.steps
+            self.parameter_sums["cfg"] += history.parameters.cfg
+            self._update_averages()
 
             # Update time-based stats
             hour = datetime.fromisoformat(history.timestamp).strftime("%H")
@@ -304,70 +543,198 @@ class NAIGlobalStats:
             if not history.result.success and history.result.error_message:
                 self.error_distribution[history.result.error_message] = self.error_distribution.get(history.result.error_message, 0) + 1
 
-            # Update user metrics
-            self.total_users = len(set(u.user_id for u in user_stats))
+            # Update user metrics, counting each user and their use of a feature the first time they appear
+            if user.total_generations == 1:
+                self.total_users += 1
+            for feature, (parameter, counter) in FEATURE_USAGE.items():
+                if getattr(history.parameters, parameter) and getattr(user, counter) == 1:
+                    self.feature_users[feature] = self.feature_users.get(feature, 0) + 1
+            self._update_ratios()
+
+            # Update today's and this month's active users
+            today, this_month = self._roll_active_users()
+            date = datetime.fromisoformat(history.timestamp)
+            if date.strftime("%Y-%m-%d") == today:
+                self.active_day_users.add(user.user_id)
+            if date.strftime("%Y-%m") == this_month:
+                self.active_month_users.add(user.user_id)
+            self.active_users_today = len(self.active_day_users)
+            self.active_users_month = len(self.active_month_users)
 
-            # Get today's and this month's active users
-            today = datetime.now().strftime("%Y-%m-%d")
-            this_month = datetime.now().strftime("%Y-%m")
-            active_today = set()
-            active_month = set()
+            # Update global preset distribution
+            if history.parameters.undesired_content_preset:
+                 self.preset_distribution[history.parameters.undesired_content_preset] = self.preset_distribution.get(history.parameters.undesired_content_preset, 0) + 1
 
-            for user in user_stats:
-                if today in user.daily_usage:
-                    active_today.add(user.user_id)
-                if this_month in user.monthly_usage:
-                    active_month.add(user.user_id)
 
-            self.active_users_today = len(active_today)
-            self.active_users_month = len(active_month)
+        except Exception as e:
+            logger.error(f"Error updating global stats: {str(e)}")
 
-            # Update feature ratios (based on users who used the feature at least once)
-            total_users_with_gens = len([u for u in user_stats if u.total_generations > 0])
-            self.upscale_ratio = sum(1 for u in user_stats if u.upscale_count > 0) / total_users_with_gens if total_users_with_gens > 0 else 0
-            self.vibe_transfer_ratio = sum(1 for u in user_stats if u.vibe_transfer_count > 0) / total_users_with_gens if total_users_with_gens > 0 else 0
-            self.quality_toggle_ratio = sum(1 for u in user_stats if u.quality_toggle_count > 0) / total_users_with_gens if total_users_with_gens > 0 else 0 # Calculate ratio
-            self.decrisper_ratio = sum(1 for u in user_stats if u.decrisper_count > 0) / total_users_with_gens if total_users_with_gens > 0 else 0 # Calculate ratio
-            self.variety_plus_ratio = sum(1 for u in user_stats if u.variety_plus_count > 0) / total_users_with_gens if total_users_with_gens > 0 else 0 # Calculate ratio
+    def remove_generation(self, history: NAIGenerationHistory, user: NAIUserStats):
+        """Subtract a generation added by update_with_generation, `user` being the stats of its user after removing it"""
+        try:
+            self.total_generations -= 1
+            self.total_generation_time -= history.generation_time
+            self.latency.apply(history, -1)
 
+            _decrement(self.model_distribution, history.parameters.model)
+            _decrement(self.sampler_distribution, history.parameters.sampler)
 
-            # Update global preset distribution
-            if history.parameters.undesired_content_preset:
-                 self.preset_distribution[history.parameters.undesired_content_preset] = self.preset_distribution.get(history.parameters.undesired_content_preset, 0) + 1
+            self.parameter_sums["steps"] -= history.parameters.steps
+            self.parameter_sums["cfg"] -= history.parameters.cfg
+            self._update_averages()
 
+            date = datetime.fromisoformat(history.timestamp)
+            _decrement(self.peak_usage_times, date.strftime("%H"))
+            if not history.result.success and history.result.error_message:
+                _decrement(self.error_distribution, history.result.error_message)
+
+            # A user or their use of a feature stops counting with their last generation or use
+            if user.total_generations == 0:
+                self.total_users -= 1
+            for feature, (parameter, counter) in FEATURE_USAGE.items():
+                if getattr(history.parameters, parameter) and getattr(user, counter) == 0:
+                    self.feature_users[feature] = self.feature_users.get(feature, 0) - 1
+            self._update_ratios()
+
+            today, this_month = self._roll_active_users()
+            if today not in user.daily_usage:
+                self.active_day_users.discard(user.user_id)
+            if this_month not in user.monthly_usage:
+                self.active_month_users.discard(user.user_id)
+            self.active_users_today = len(self.active_day_users)
+            self.active_users_month = len(self.active_month_users)
+
+            if history.parameters.undesired_content_preset:
+                _decrement(self.preset_distribution, history.parameters.undesired_content_preset)
 
         except Exception as e:
-            logger.error(f"Error updating global stats: {str(e)}")
+            logger.error(f"Error removing generation from global stats: {str(e)}")
 
 class NAIStatsManager:
     def __init__(self, database_dir: Path):
         try:
             # Use the predefined directories from settings
             self.database_dir = settings.STATS_DIR
+            # JSON files of older versions, migrated to the history log on first load
             self.history_file = settings.STATS_DIR / "nai_history.json"
             self.user_stats_file = settings.USER_STATS_DIR / "nai_user_stats.json"
             self.global_stats_file = settings.GLOBAL_STATS_DIR / "nai_global_stats.json"
 
-            self.history: List[NAIGenerationHistory] = []
+            self.history: List[CompactGeneration] = []
+            self.string_pool: Dict[Any, Any] = {} # Values shared by the compact history entries
+            # Indexes of positions in self.history, kept up to date by _store_entry
+            self.history_by_message_id: Dict[int, int] = {}
+            self.history_by_generation_id: Dict[str, int] = {}
+            self.user_history_index: Dict[int, List[Tuple[int, int]]] = {} # (time_key, position) per user, oldest first
+            self.time_index: List[Tuple[int, int]] = [] # (time_key, position) of all entries, oldest first, sharing the tuples above
             self.user_stats: Dict[int, NAIUserStats] = {}
             self.global_stats = NAIGlobalStats()
-
-            self.load_data()
-
-            # Verify data integrity after loading
-            issues = self.verify_stats_integrity()
-            if any(issues.values()):
-                logger.warning("Found issues during stats verification after load")
-                for category, category_issues in issues.items():
-                    if category_issues:
-                        logger.warning(f"{category}: {len(category_issues)} issues found")
+            self.rollups = StatsRollups() # Usage per hour, day and month, snapshotted with the stats
+            self.rank_index = RankIndex() # Leaderboard order, rebuilt from the user stats on load
+            self.window_leaderboards = WindowedLeaderboards() # Weekly, monthly and 30 day ones, rebuilt from the rollups
+
+            # History is persisted as an append-only log, the stats as periodic snapshots of it
+            self.history_log = HistoryLog(settings.STATS_LOG_DIR, settings.STATS_SNAPSHOT_FILE)
+            self.pending_records: List[dict] = [] # Log records not written yet
+            self.log_record_count = 0 # Records in the log, overwritten entries included
+            self.records_since_snapshot = 0
+
+            # Changes are written behind by a single writer thread, see start_flusher
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stats-writer")
+            self.unflushed_changes = 0
+            self.flush_event: Optional[asyncio.Event] = None
+            self.flush_task: Optional[asyncio.Task] = None
+
+            # Nothing is read here, the bot loads the stats in the background once it is connected, see start_loading
+            self.aggregates_loaded = asyncio.Event() # User and global stats are usable
+            self.history_loaded = asyncio.Event() # Everything is, including the history
+            self.load_task: Optional[asyncio.Task] = None
+            self.integrity_task: Optional[asyncio.Task] = None
+            self.deferred_generations: List[Tuple[NAIGenerationHistory, bool]] = [] # add_generation calls made while loading
+            self.startup_timings: Dict[str, float] = {} # Milliseconds per loading phase
+            self.latency_snapshotted = True # False when the snapshot predates the latency sketches
+            self.load_failed = False # Set when loading failed, the stats are then never snapshotted
 
         except Exception as e:
             logger.error(f"Error initializing NAIStatsManager: {str(e)}")
             raise
 
+    def start_loading(self):
+        """Load the stats in the background: the snapshotted aggregates first, then the history,
+        then an integrity check. Generations added in the meantime are applied once the history is loaded."""
+        if self.load_task is None:
+            self.load_task = asyncio.create_task(self._load_in_background())
+
+    async def _load_in_background(self):
+        try:
+            started = time.perf_counter()
+            snapshot = await asyncio.to_thread(self._timed, "aggregates", self.load_aggregates)
+            if snapshot is not None:
+                self.aggregates_loaded.set()
+            tail = await asyncio.to_thread(self._timed, "history", self.load_history, snapshot)
+            self._timed("replay", self._finish_loading, tail)
+            self.startup_timings["total"] = (time.perf_counter() - started) * 1000
+            logger.info(
+                f"Stats loaded in {self.startup_timings['total']:.0f}ms: aggregates {self.startup_timings['aggregates']:.0f}ms, "
+                f"history {self.startup_timings['history']:.0f}ms ({self.history_count()} entries), "
+                f"replay {self.startup_timings['replay']:.0f}ms ({len(tail)} records)"
+            )
+        except Exception as e:
+            logger.error(f"Error loading stats data, continuing with empty stats: {str(e)}")
+            self._start_empty()
+            return
+        self.integrity_task = asyncio.create_task(self._verify_in_background())
+
+    def _start_empty(self):
+        """Continue with empty stats after loading failed, so commands waiting for them do not hang.
+        New generations are still written, but no snapshot is, the next start loads the stats again."""
+        self.load_failed = True
+        self.user_stats = {}
+        self.global_stats = NAIGlobalStats()
+        self.rollups = StatsRollups()
+        self.history = []
+        self.string_pool = {}
+        self._rebuild_indexes()
+        self._rebuild_rank_index()
+        self.window_leaderboards.rebuild(self.rollups.user_days)
+        self._finish_loading([])
+
+    async def _verify_in_background(self):
+        """Run verify_stats_integrity off the event loop, it goes over the whole history."""
+        try:
+            issues = await asyncio.to_thread(self._timed, "integrity", self.verify_stats_integrity)
+        except RuntimeError as e:
+            # The stats changed size while being checked, /nai-stats-debug can run the check again
+            logger.warning(f"Stats integrity check interrupted by concurrent changes: {str(e)}")
+            return
+        except Exception as e:
+            logger.error(f"Error verifying stats integrity: {str(e)}")
+            return
+        found = sum(len(category_issues) for category_issues in issues.values())
+        logger.info(f"Stats integrity check finished in {self.startup_timings['integrity']:.0f}ms, {found} issues found")
+
+    def _timed(self, phase: str, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.startup_timings[phase] = (time.perf_counter() - started) * 1000
+
+    async def wait_for_aggregates(self):
+        await self.aggregates_loaded.wait()
+
+    async def wait_until_loaded(self):
+        await self.history_loaded.wait()
+
     def load_data(self):
-        """Load all data from files"""
+        """Load all data from files, blocking. The bot uses start_loading instead."""
+        snapshot = self.load_aggregates()
+        tail = self.load_history(snapshot)
+        self._finish_loading(tail)
+
+    def load_aggregates(self) -> Optional[dict]:
+        """Load the snapshotted user and global stats, migrating the JSON files of older versions first.
+        Returns the snapshot, None when there is none and the stats have to be recalculated from history."""
         # Create all required directories and verify permissions
         for directory in [self.database_dir, settings.USER_STATS_DIR, settings.GLOBAL_STATS_DIR]:
             try:
@@ -380,148 +747,236 @@ class NAIStatsManager:
                 logger.error(f"Error with directory {directory}: {str(e)}")
                 raise
 
-        # Load history
-        try:
-            if self.history_file.exists():
-                with open(self.history_file, 'r') as f:
-                    file_content = f.read()
-                    try:
-                        data = json.loads(file_content)
-                        # Explicitly remove 'image_url' from history data for backward compatibility
-                        cleaned_history_data = []
-                        for entry_data in data:
-                            if 'result' in entry_data and 'image_url' in entry_data['result']:
-                                del entry_data['result']['image_url']
-                            cleaned_history_data.append(entry_data)
-                        self.history = [NAIGenerationHistory.from_dict(h) for h in cleaned_history_data]
-                    except json.JSONDecodeError as je:
-                        logger.error(f"JSON decode error: {str(je)}")
-                        logger.error(f"Invalid JSON at position {je.pos}")
-                        raise
-            else:
-                logger.warning(f"History file {self.history_file} does not exist, starting fresh")
-                self.history = []
-        except Exception as e:
-            logger.error(f"Error loading history data: {str(e)}")
-            self.history = []
-
-        # Load user stats
-        try:
-            if self.user_stats_file.exists():
-                with open(self.user_stats_file, 'r') as f:
-                    file_content = f.read()
-                    try:
-                        data = json.loads(file_content)
-                        self.user_stats = {int(k): NAIUserStats.from_dict(v) for k, v in data.items()}
-                    except json.JSONDecodeError as je:
-                        logger.error(f"JSON decode error in user stats: {str(je)}")
-                        logger.error(f"Invalid JSON at position {je.pos}")
-                        raise
-            else:
-                logger.warning(f"User stats file {self.user_stats_file} does not exist, starting fresh")
-                self.user_stats = {}
-        except Exception as e:
-            logger.error(f"Error loading user stats data: {str(e)}")
-            self.user_stats = {}
-
-        # Load global stats
-        try:
-            if self.global_stats_file.exists():
-                with open(self.global_stats_file, 'r') as f:
-                    file_content = f.read()
-                    try:
-                        data = json.loads(file_content)
-                        self.global_stats = NAIGlobalStats.from_dict(data)
-                    except json.JSONDecodeError as je:
-                        logger.error(f"JSON decode error in global stats: {str(je)}")
-                        logger.error(f"Invalid JSON at position {je.pos}")
-                        raise
-            else:
-                logger.warning(f"Global stats file {self.global_stats_file} does not exist, starting fresh")
-                self.global_stats = NAIGlobalStats()
-        except Exception as e:
-            logger.error(f"Error loading global stats data: {str(e)}")
-            self.global_stats = NAIGlobalStats()
-
-    def save_data(self):
-        """Save all data to files"""
-        try:
-            # Ensure all directories exist
-            self.database_dir.mkdir(parents=True, exist_ok=True)
-            settings.USER_STATS_DIR.mkdir(parents=True, exist_ok=True)
-            settings.GLOBAL_STATS_DIR.mkdir(parents=True, exist_ok=True)
-
-            # Save history
+        if not self.history_log.exists() and self.history_file.exists():
             try:
-                temp_history_file = self.history_file.with_suffix('.tmp')
-                history_data = [h.to_dict() for h in self.history]
-                with open(temp_history_file, 'w') as f:
-                    json.dump(history_data, f, indent=2)
-                temp_history_file.replace(self.history_file)
+                migrate_legacy_files(self.history_log, self.history_file, self.user_stats_file, self.global_stats_file)
             except Exception as e:
-                logger.error(f"Error saving history: {str(e)}")
+                logger.error(f"Error migrating JSON stats files to the history log: {str(e)}")
                 raise
 
-            # Save user stats
+        snapshot = self.history_log.load_snapshot()
+        if snapshot:
             try:
-                temp_user_stats_file = self.user_stats_file.with_suffix('.tmp')
-                user_stats_data = {str(k): v.to_dict() for k, v in self.user_stats.items()}
-                with open(temp_user_stats_file, 'w') as f:
-                    json.dump(user_stats_data, f, indent=2)
-                temp_user_stats_file.replace(self.user_stats_file)
+                self.user_stats = {int(k): NAIUserStats.from_dict(v) for k, v in snapshot["user_stats"].items()}
+                self.latency_snapshotted = "latency" in snapshot["global_stats"]
+                self.global_stats = NAIGlobalStats.from_dict(snapshot["global_stats"])
+                self.global_stats.rebuild_user_aggregates(self.user_stats.values())
+                self._rebuild_rank_index()
+                if StatsRollups.is_complete(snapshot.get("rollups")):
+                    self.rollups = StatsRollups.from_dict(snapshot["rollups"])
+                    self.window_leaderboards.rebuild(self.rollups.user_days)
             except Exception as e:
-                logger.error(f"Error saving user stats: {str(e)}")
-                raise
-
-            # Save global stats
+                logger.error(f"Error loading stats snapshot, recalculating stats from history: {str(e)}")
+                snapshot = None
+        return snapshot
+
+    def load_history(self, snapshot: Optional[dict]) -> List[Tuple[Optional[NAIGenerationHistory], NAIGenerationHistory]]:
+        """Read the history log, streaming it a record at a time, and index it. Recalculates the stats
+        when there is no snapshot. Returns the (replaced entry, entry) records the snapshot does not include."""
+        entries: List[CompactGeneration] = [] # Live entries in log order
+        positions: Dict[int, int] = {} # Database message ID -> position in entries, for overwrites
+        tail: List[Tuple[Optional[NAIGenerationHistory], NAIGenerationHistory]] = [] # (replaced entry, entry) after the snapshot
+        try:
+            for covered, record in self.history_log.read(snapshot):
+                self.log_record_count += 1
+                entry = NAIGenerationHistory.from_dict(record["entry"])
+                compact = CompactGeneration.from_history(entry, self.string_pool)
+                message_id = entry.result.database_message_id
+                replaced = None
+                if record["op"] == "overwrite" and message_id in positions:
+                    # An overwritten entry keeps its place, as in add_generation
+                    position = positions[message_id]
+                    replaced = entries[position]
+                    entries[position] = compact
+                else:
+                    # Every added entry is kept, failed attempts of a request share a generation ID and have no message
+                    if message_id is not None:
+                        positions[message_id] = len(entries)
+                    entries.append(compact)
+                if not covered:
+                    tail.append((replaced.expand() if replaced is not None else None, entry))
+        except Exception as e:
+            # Continue with the entries read so far, but never snapshot or compact them over the full log
+            logger.error(f"Error loading history log, stats will not be saved until it loads: {str(e)}")
+            self.load_failed = True
+        self.history = entries
+        self._rebuild_indexes()
+
+        if snapshot is None:
+            if self.history:
+                logger.warning("No usable stats snapshot, recalculating stats from history")
+            self._recalculate_stats()
+            return []
+        if not StatsRollups.is_complete(snapshot.get("rollups")):
+            self._rebuild_rollups(tail)
+        if not self.latency_snapshotted:
+            self._rebuild_latency(tail)
+        return tail
+
+    def _rebuild_rollups(self, tail: List[Tuple[Optional[NAIGenerationHistory], NAIGenerationHistory]]):
+        """Build the rollups as of the snapshot, for snapshots written before they were kept (or before
+        the per-user daily counts were): from the whole history, minus what replaying the tail will add again."""
+        logger.info("Stats snapshot has no usage rollups, building them from history")
+        self.rollups = StatsRollups()
+        for entry in self.iter_history(ordered=True):
+            self.rollups.apply(entry)
+        for replaced, entry in reversed(tail):
+            self.rollups.apply(entry, -1)
+            if replaced is not None:
+                self.rollups.apply(replaced)
+        self.window_leaderboards.rebuild(self.rollups.user_days)
+
+    def _rebuild_latency(self, tail: List[Tuple[Optional[NAIGenerationHistory], NAIGenerationHistory]]):
+        """Build the latency sketches as of the snapshot, for snapshots written before they were kept,
+        like _rebuild_rollups. Entries of that time have generation times but no end-to-end times."""
+        logger.info("Stats snapshot has no latency sketches, building them from history")
+        latency = LatencySketches()
+        for entry in self.iter_history():
+            latency.apply(entry)
+        for replaced, entry in reversed(tail):
+            latency.apply(entry, -1)
+            if replaced is not None:
+                latency.apply(replaced)
+        self.global_stats.latency = latency
+
+    def _finish_loading(self, tail: List[Tuple[Optional[NAIGenerationHistory], NAIGenerationHistory]]):
+        """Replay the records after the snapshot and the generations deferred while loading.
+        Runs on the event loop, so nothing reads the stats halfway through a replay."""
+        for replaced, entry in tail:
+            if replaced is not None:
+                self._replace_generation(replaced, entry)
+            else:
+                self._apply_generation(entry)
+        self.records_since_snapshot += len(tail)
+        self.aggregates_loaded.set()
+        self.history_loaded.set()
+
+        deferred, self.deferred_generations = self.deferred_generations, []
+        for history, overwrite in deferred:
+            self.add_generation(history, overwrite)
+        logger.info(f"Loaded {self.history_count()} history entries, replayed {len(tail)} records after the stats snapshot and {len(deferred)} added while loading")
+
+    def mark_dirty(self):
+        """Record a change for the background flusher, waking it once STATS_FLUSH_MAX_CHANGES have piled up."""
+        self.unflushed_changes += 1
+        if self.unflushed_changes >= settings.STATS_FLUSH_MAX_CHANGES and self.flush_event is not None:
+            self.flush_event.set()
+
+    def start_flusher(self):
+        """Start writing changes behind, every STATS_FLUSH_INTERVAL seconds or STATS_FLUSH_MAX_CHANGES changes."""
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_event = asyncio.Event()
+            self.flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop_flusher(self):
+        """Stop the flusher and flush the remaining changes with a snapshot of the stats."""
+        if self.load_task is not None and not self.load_task.done():
+            # Generations added while loading are only applied, and flushed, once it finishes
+            await self.load_task
+        if not self.history_loaded.is_set():
+            return
+        if self.flush_task is not None:
+            self.flush_task.cancel()
             try:
-                temp_global_stats_file = self.global_stats_file.with_suffix('.tmp')
-                global_stats_data = self.global_stats.to_dict()
-                with open(temp_global_stats_file, 'w') as f:
-                    json.dump(global_stats_data, f, indent=2)
-                temp_global_stats_file.replace(self.global_stats_file)
-            except Exception as e:
-                logger.error(f"Error saving global stats: {str(e)}")
-                raise
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush(snapshot=True)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                async with asyncio.timeout(settings.STATS_FLUSH_INTERVAL):
+                    await self.flush_event.wait()
+            except TimeoutError:
+                pass
+            self.flush_event.clear()
+            if self.unflushed_changes:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Error flushing stats data: {str(e)}")
+
+    async def flush(self, snapshot: bool = False):
+        """Write the changes since the last flush without blocking the event loop."""
+        await asyncio.wrap_future(self._submit_flush(snapshot))
 
+    def save_data(self, snapshot: bool = False):
+        """Write the changes since the last flush and wait for them to be written."""
+        try:
+            self._submit_flush(snapshot).result()
         except Exception as e:
             logger.error(f"Critical error saving stats data: {str(e)}")
             raise
 
+    def _submit_flush(self, snapshot: bool) -> Future:
+        """Take the changes since the last flush and queue them on the writer thread. Flushes are
+        written in the order they were taken, so a snapshot always matches the log position it records."""
+        if not self.history_loaded.is_set():
+            # Nothing to write, and a snapshot would overwrite the one not loaded yet
+            return self._nothing_to_flush()
+        records, self.pending_records = self.pending_records, []
+        self.unflushed_changes = 0
+        self.log_record_count += len(records)
+        self.records_since_snapshot += len(records)
+
+        stats_data = None
+        compacted_entries = None
+        if (snapshot or self.records_since_snapshot >= settings.STATS_SNAPSHOT_EVERY) and not self.load_failed:
+            # Copied here on the event loop, the writer thread serializes the copy while the stats keep changing
+            stats_data = self._copy_stats()
+            if self.log_record_count > 2 * len(self.history):
+                # Compact the log when most of it is overwritten entries. Stored entries are never
+                # changed, a copy of the list is enough for the writer thread to expand them
+                compacted_entries = list(self.history)
+                self.log_record_count = len(self.history)
+            self.records_since_snapshot = 0
+        return self.writer.submit(self._write_flush, records, stats_data, compacted_entries)
+
+    @staticmethod
+    def _nothing_to_flush() -> Future:
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def _copy_stats(self) -> Tuple[dict, dict, dict]:
+        """The user stats, global stats and rollups as dicts that share nothing mutable with them."""
+        def copy_dict(data: dict) -> dict:
+            return {k: dict(v) if isinstance(v, dict) else v for k, v in data.items()}
+        user_stats_data = {str(k): copy_dict(v.to_dict()) for k, v in self.user_stats.items()}
+        return user_stats_data, copy_dict(self.global_stats.to_dict()), self.rollups.to_dict()
+
+    def _write_flush(self, records: List[dict], stats_data: Optional[Tuple[dict, dict, dict]], compacted_entries: Optional[List[CompactGeneration]]):
+        """Runs on the writer thread."""
+        self.history_log.append(records, fsync=settings.STATS_FSYNC == "always")
+        if compacted_entries is not None:
+            self.history_log.compact([entry.expand().to_dict() for entry in compacted_entries], *stats_data)
+        elif stats_data is not None:
+            self.history_log.write_snapshot(*stats_data, fsync=settings.STATS_FSYNC != "never")
+
     def add_generation(self, history: NAIGenerationHistory, overwrite: bool = False) -> bool:
         """Add a new generation to the stats.
            If overwrite is True and an entry with the same message ID exists, it will be replaced.
-           Returns True if added/updated, False if skipped (only if overwrite is False and duplicate exists)."""
+           Returns True if added/updated, False if skipped (only if overwrite is False and duplicate exists).
+           While the stats are loading the generation is deferred until they are, and True is returned."""
+        if not self.history_loaded.is_set():
+            self.deferred_generations.append((history, overwrite))
+            return True
         try:
             # Check if a history entry with the same database_message_id already exists
-            existing_entry_index = -1
             existing_history = None
             if history.result.database_message_id is not None:
-                for i, entry in enumerate(self.history):
-                    if entry.result.database_message_id == history.result.database_message_id:
-                        existing_entry_index = i
-                        existing_history = entry
-                        break
+                existing_history = self._find_entry(history.result.database_message_id)
 
-            if existing_entry_index != -1:
+            if existing_history is not None:
                 # Duplicate found
                 if overwrite:
                     logger.info(f"Overwriting existing generation entry for message ID: {history.result.database_message_id}")
 
-                    # --- Calculate and apply delta for overwrite ---
-                    # This is a simplified delta calculation. A more robust one would
-                    # need to handle all stat fields, including distributions and averages.
-                    # For now, we'll focus on the most impactful ones and still rely
-                    # on recalculation for full correctness on overwrite.
-                    # TODO: Implement full delta calculation for overwrite
-
-                    # For now, remove the old entry and add the new one, then recalculate.
-                    # This is the current behavior but logged as a TODO for future improvement.
-                    del self.history[existing_entry_index]
-                    self.history.append(history)
-                    self._recalculate_stats() # Still recalculate on overwrite
-                    logger.warning("Overwrite performed, but full delta calculation is not yet implemented. Recalculating stats.")
-                    # --- End of simplified delta calculation ---
+                    # Subtract the old entry from the stats and add the new one, instead of replaying the history
+                    self._store_entry(history, replaces=existing_history)
+                    self._replace_generation(existing_history, history)
 
                     return True
                 else:
@@ -530,19 +985,8 @@ class NAIStatsManager:
                     return False
             else:
                 # No duplicate found - NEW entry
-                self.history.append(history)
-
-                # Apply incremental updates to user stats
-                if history.user_id not in self.user_stats:
-                    self.user_stats[history.user_id] = NAIUserStats(user_id=history.user_id)
-                user_stats = self.user_stats[history.user_id]
-                user_stats.update_with_generation(history)
-
-                # Apply incremental updates to global stats
-                # Note: Global stats update needs the list of user stats for active user calculation.
-                # Passing list(self.user_stats.values()) might be inefficient for many users,
-                # but it's still better than recalculating from the entire history.
-                self.global_stats.update_with_generation(history, list(self.user_stats.values()))
+                self._store_entry(history)
+                self._apply_generation(history)
 
                 # DO NOT call self._recalculate_stats() here for new entries.
 
@@ -552,15 +996,125 @@ class NAIStatsManager:
             logger.error(f"Error adding/updating generation: {str(e)}")
             return False # Indicate failure
 
+    def _index_entry(self, position: int, entry: CompactGeneration):
+        if entry.database_message_id is not None:
+            self.history_by_message_id[entry.database_message_id] = position
+        self.history_by_generation_id[entry.generation_id] = position
+        key = (entry.time_key, position)
+        bisect.insort(self.user_history_index.setdefault(entry.user_id, []), key)
+        bisect.insort(self.time_index, key)
+
+    def _unindex_entry(self, position: int, entry: CompactGeneration):
+        if self.history_by_message_id.get(entry.database_message_id) == position:
+            del self.history_by_message_id[entry.database_message_id]
+        if self.history_by_generation_id.get(entry.generation_id) == position:
+            del self.history_by_generation_id[entry.generation_id]
+        user_index = self.user_history_index[entry.user_id]
+        i = bisect.bisect_left(user_index, (entry.time_key, position))
+        if i < len(user_index) and user_index[i] == (entry.time_key, position):
+            del user_index[i]
+        if not user_index:
+            del self.user_history_index[entry.user_id]
+        i = bisect.bisect_left(self.time_index, (entry.time_key, position))
+        if i < len(self.time_index) and self.time_index[i] == (entry.time_key, position):
+            del self.time_index[i]
+
+    def _rebuild_indexes(self):
+        self.history_by_message_id = {}
+        self.history_by_generation_id = {}
+        self.user_history_index = {}
+        self.time_index = []
+        for position, entry in enumerate(self.history):
+            if entry.database_message_id is not None:
+                self.history_by_message_id[entry.database_message_id] = position
+            self.history_by_generation_id[entry.generation_id] = position
+            key = (entry.time_key, position)
+            self.user_history_index.setdefault(entry.user_id, []).append(key)
+            self.time_index.append(key)
+        for user_index in self.user_history_index.values():
+            user_index.sort()
+        self.time_index.sort()
+
+    def _find_entry(self, database_message_id: int) -> Optional[NAIGenerationHistory]:
+        """Return the history entry of a database message, if there is one."""
+        position = self.history_by_message_id.get(database_message_id)
+        return self.history[position].expand() if position is not None else None
+
+    def _store_entry(self, history: NAIGenerationHistory, replaces: Optional[NAIGenerationHistory] = None):
+        """Add an entry to the history, in place of `replaces` when overwriting one."""
+        entry = CompactGeneration.from_history(history, self.string_pool)
+        if replaces is not None:
+            position = self.history_by_message_id[replaces.result.database_message_id]
+            self._unindex_entry(position, self.history[position])
+            self.history[position] = entry
+        else:
+            position = len(self.history)
+            self.history.append(entry)
+        self._index_entry(position, entry)
+        self.pending_records.append({"op": "overwrite" if replaces is not None else "add", "entry": history.to_dict()})
+        self.mark_dirty()
+
+    def iter_history(self, ordered: bool = False) -> Iterable[NAIGenerationHistory]:
+        """All history entries, oldest first when `ordered` is True."""
+        entries = sorted(self.history, key=lambda x: x.time_key) if ordered else self.history
+        return (entry.expand() for entry in entries)
+
+    def history_count(self) -> int:
+        return len(self.history)
+
+    def _apply_generation(self, history: NAIGenerationHistory):
+        """Apply incremental updates for a new entry to the user and global stats."""
+        if history.user_id not in self.user_stats:
+            self.user_stats[history.user_id] = NAIUserStats(user_id=history.user_id)
+        self.user_stats[history.user_id].update_with_generation(history)
+
+        self.global_stats.update_with_generation(history, self.user_stats[history.user_id])
+        # Before the rollups, which may drop the expired days the leaderboards still have to roll out
+        self.window_leaderboards.apply(history)
+        self.rollups.apply(history)
+        self.rank_index.update(history.user_id, self.user_stats[history.user_id].total_generations)
+
+    def _unapply_generation(self, history: NAIGenerationHistory):
+        """Subtract an entry from the user and global stats, the reverse of _apply_generation."""
+        self.window_leaderboards.apply(history, -1)
+        self.rollups.apply(history, -1)
+        user_stats = self.user_stats.get(history.user_id)
+        if user_stats is None:
+            return
+        user_stats.remove_generation(history)
+        self.global_stats.remove_generation(history, user_stats)
+        self.rank_index.update(history.user_id, user_stats.total_generations)
+        if user_stats.total_generations <= 0:
+            del self.user_stats[history.user_id]
+
+    def _replace_generation(self, old: NAIGenerationHistory, new: NAIGenerationHistory):
+        """Update the stats for an overwritten entry, once the history holds the new one."""
+        self._unapply_generation(old)
+        self._apply_generation(new)
+        # Subtracting cannot restore a first or last generation time, they come from the remaining history
+        for user_id in {old.user_id, new.user_id}:
+            user_stats = self.user_stats.get(user_id)
+            bounds = self._user_time_bounds(user_id)
+            if user_stats is not None and bounds is not None:
+                user_stats.first_generation, user_stats.last_generation = bounds
+
+    def _user_time_bounds(self, user_id: int) -> Optional[Tuple[str, str]]:
+        """Timestamps of a user's oldest and newest history entries."""
+        user_index = self.user_history_index.get(user_id)
+        if not user_index:
+            return None
+        return self.history[user_index[0][1]].timestamp, self.history[user_index[-1][1]].timestamp
+
     def _recalculate_stats(self):
         """Recalculate user and global stats from the current history."""
         #logger.info("Recalculating user and global stats from history...")
         # Reset stats
         self.user_stats = {}
         self.global_stats = NAIGlobalStats()
+        self.rollups = StatsRollups()
 
         # Sort history by timestamp to ensure correct chronological updates
-        sorted_history = sorted(self.history, key=lambda x: datetime.fromisoformat(x.timestamp))
+        sorted_history = self.iter_history(ordered=True)
 
         # Replay history to rebuild stats
         for history_entry in sorted_history:
@@ -569,11 +1123,17 @@ class NAIStatsManager:
                 self.user_stats[history_entry.user_id] = NAIUserStats(user_id=history_entry.user_id)
             self.user_stats[history_entry.user_id].update_with_generation(history_entry)
 
-            # Update global stats (pass current user_stats list for active user calculation)
-            self.global_stats.update_with_generation(history_entry, list(self.user_stats.values()))
+            # Update global stats (pass the entry's user stats for the user metrics)
+            self.global_stats.update_with_generation(history_entry, self.user_stats[history_entry.user_id])
+            self.rollups.apply(history_entry)
 
+        self._rebuild_rank_index()
+        self.window_leaderboards.rebuild(self.rollups.user_days)
         #logger.info("Stats recalculation complete.")
 
+    def _rebuild_rank_index(self):
+        self.rank_index.rebuild((user_id, stats.total_generations) for user_id, stats in self.user_stats.items())
+
 
     def get_user_stats(self, user_id: int) -> Optional[NAIUserStats]:
         """Get stats for a specific user"""
@@ -586,9 +1146,29 @@ class NAIStatsManager:
 
     def get_user_history(self, user_id: int, limit: int = 10) -> List[NAIGenerationHistory]:
         """Get generation history for a specific user"""
-        user_history = [h for h in self.history if h.user_id == user_id]
-        sorted_history = sorted(user_history, key=lambda x: x.timestamp, reverse=True)[:limit]
-        return sorted_history
+        user_index = self.user_history_index.get(user_id, [])
+        return [self.history[position].expand() for _, position in reversed(user_index[-limit:])] if limit > 0 else []
+
+    def get_user_history_page(self, user_id: int, before: Optional[tuple] = None, limit: int = 9) -> Tuple[List[NAIGenerationHistory], Optional[tuple]]:
+        """Get a page of a user's history, newest first, and the cursor of the next page (None on the last one).
+        `before` is the cursor returned with the previous page, None starts from the newest entry."""
+        user_index = self.user_history_index.get(user_id, [])
+        end = len(user_index) if before is None else bisect.bisect_left(user_index, before)
+        start = max(end - limit, 0)
+        page = user_index[start:end]
+        return [self.history[position].expand() for _, position in reversed(page)], (page[0] if start > 0 else None)
+
+    def get_generation(self, generation_id: str) -> Optional[NAIGenerationHistory]:
+        """Get a history entry by its generation ID"""
+        position = self.history_by_generation_id.get(generation_id)
+        return self.history[position].expand() if position is not None else None
+
+    def get_history_between(self, start: str, end: str) -> List[NAIGenerationHistory]:
+        """Get the history entries with start <= timestamp < end (ISO format), oldest first"""
+        # (time_key,) sorts before every (time_key, position)
+        low = bisect.bisect_left(self.time_index, (timestamp_key(start),))
+        high = bisect.bisect_left(self.time_index, (timestamp_key(end),))
+        return [self.history[position].expand() for _, position in self.time_index[low:high]]
 
     def verify_stats_integrity(self) -> Dict[str, List[str]]:
         """Verify the integrity of stats data and find any inconsistencies"""
@@ -600,7 +1180,7 @@ class NAIStatsManager:
         }
 
         # Check history entries
-        for i, entry in enumerate(self.history):
+        for i, entry in enumerate(self.iter_history()):
             try:
                 # Verify timestamp format
                 datetime.fromisoformat(entry.timestamp)
@@ -611,6 +1191,12 @@ class NAIStatsManager:
             if entry.user_id not in self.user_stats:
                 issues["cross_reference"].append(f"History entry {i} references non-existent user {entry.user_id}")
 
+        indexed = sum(len(user_index) for user_index in self.user_history_index.values())
+        if indexed != len(self.history):
+            issues["history"].append(f"User history index holds {indexed} entries, history holds {len(self.history)}")
+        if len(self.time_index) != len(self.history):
+            issues["history"].append(f"Time index holds {len(self.time_index)} entries, history holds {len(self.history)}")
+
         # Check user stats
         for user_id, stats in self.user_stats.items():
             # Check for impossible values
@@ -627,6 +1213,12 @@ class NAIStatsManager:
                         datetime.fromisoformat(stats.last_generation)
                 except ValueError as e:
                     issues["user_stats"].append(f"User {user_id} has invalid timestamp format: {str(e)}")
+                bounds = self._user_time_bounds(user_id)
+                if bounds is not None and (stats.first_generation, stats.last_generation) != bounds:
+                    issues["cross_reference"].append(
+                        f"User {user_id} first/last generation ({stats.first_generation}, {stats.last_generation}) "
+                        f"doesn't match their history ({bounds[0]}, {bounds[1]})"
+                    )
 
         # Check global stats
         if self.global_stats.total_generations < 0:
@@ -639,6 +1231,20 @@ class NAIStatsManager:
                 f"doesn't match sum of user generations ({total_user_generations})"
             )
 
+        history_count = self.history_count()
+        if total_user_generations != history_count:
+            issues["cross_reference"].append(
+                f"Sum of user generations ({total_user_generations}) "
+                f"doesn't match history entries ({history_count})"
+            )
+
+        ranked_users = sum(1 for user in self.user_stats.values() if user.total_generations > 0)
+        if len(self.rank_index) != ranked_users:
+            issues["cross_reference"].append(
+                f"Leaderboard rank index holds {len(self.rank_index)} users, "
+                f"{ranked_users} users have generations"
+            )
+
         if self.global_stats.total_users != len(self.user_stats):
             issues["cross_reference"].append(
                 f"Global user count ({self.global_stats.total_users}) "
@@ -654,6 +1260,128 @@ class NAIStatsManager:
 
         return issues
 
+class SQLiteStatsManager(NAIStatsManager):
+    """NAIStatsManager keeping the history in SQLite instead of in memory, used with STATS_BACKEND=sqlite.
+    Per-user history and time range queries use the database's indexes. Duplicate checks and the
+    history count are kept in memory, so adding a generation never waits for the database thread."""
+    def __init__(self, database_dir: Path):
+        self.store = SQLiteHistoryStore(settings.STATS_DB_FILE)
+        self.snapshot_due = False # Set by overwrites, the replaced row is gone so its stats could not be replayed
+        self.message_ids: set[int] = set() # Database message IDs of the stored entries, read on load
+        self.row_count = 0 # Rows in the history table, read on load
+        super().__init__(database_dir)
+
+    def load_aggregates(self) -> Optional[Tuple[int, dict, dict, Optional[dict]]]:
+        snapshot = self.store.load_snapshot()
+        if snapshot:
+            try:
+                _, user_stats_data, global_stats_data, rollups_data = snapshot
+                self.user_stats = {int(k): NAIUserStats.from_dict(v) for k, v in user_stats_data.items()}
+                self.latency_snapshotted = "latency" in global_stats_data
+                self.global_stats = NAIGlobalStats.from_dict(global_stats_data)
+                self.global_stats.rebuild_user_aggregates(self.user_stats.values())
+                self._rebuild_rank_index()
+                if StatsRollups.is_complete(rollups_data):
+                    self.rollups = StatsRollups.from_dict(rollups_data)
+                    self.window_leaderboards.rebuild(self.rollups.user_days)
+            except Exception as e:
+                logger.error(f"Error loading stats snapshot, recalculating stats from history: {str(e)}")
+                snapshot = None
+        return snapshot
+
+    def load_history(self, snapshot: Optional[Tuple[int, dict, dict, Optional[dict]]]) -> List[Tuple[Optional[NAIGenerationHistory], NAIGenerationHistory]]:
+        """Return the rows added after the snapshot. An empty database is filled from the
+        history log (or the JSON files before it) on first start."""
+        tail = self._load_rows(snapshot)
+        self.message_ids = self.store.message_ids()
+        self.row_count = self.store.count()
+        return tail
+
+    def _load_rows(self, snapshot: Optional[Tuple[int, dict, dict, Optional[dict]]]) -> List[Tuple[Optional[NAIGenerationHistory], NAIGenerationHistory]]:
+        if snapshot is None and self.store.count() == 0 and (self.history_log.exists() or self.history_file.exists()):
+            NAIStatsManager.load_history(self, NAIStatsManager.load_aggregates(self))
+            if self.load_failed:
+                raise RuntimeError("the history log could not be read completely, it is not imported")
+            logger.info(f"Importing {len(self.history)} history entries into {settings.STATS_DB_FILE}")
+            for entry in self.history:
+                self.store.insert(entry.expand().to_dict())
+            self.history = []
+            self.string_pool = {}
+            self._rebuild_indexes()
+            # Recalculated from the imported rows, iter_history reads them from the database
+            self._recalculate_stats()
+            self.store.submit_commit(self._copy_stats()).result()
+            return []
+
+        if snapshot is None:
+            self._recalculate_stats()
+            return []
+        tail = [(None, NAIGenerationHistory.from_dict(entry)) for entry in self.store.iterate(after_seq=snapshot[0])]
+        if not StatsRollups.is_complete(snapshot[3]):
+            self._rebuild_rollups(tail)
+        if not self.latency_snapshotted:
+            self._rebuild_latency(tail)
+        return tail
+
+    def _submit_flush(self, snapshot: bool) -> Future:
+        """Queue a commit of the new history rows on the database thread, with a snapshot of the stats
+        every STATS_SNAPSHOT_EVERY rows, after an overwrite or when `snapshot` is True. Queued from the
+        event loop, the commit covers exactly the rows inserted before it, like the copied stats."""
+        if not self.history_loaded.is_set():
+            # Nothing to write, and a snapshot would overwrite the one not loaded yet
+            return self._nothing_to_flush()
+        self.unflushed_changes = 0
+        stats_data = None
+        if (snapshot or self.snapshot_due or self.records_since_snapshot >= settings.STATS_SNAPSHOT_EVERY) and not self.load_failed:
+            stats_data = self._copy_stats()
+            self.records_since_snapshot = 0
+            self.snapshot_due = False
+        return self.store.submit_commit(stats_data)
+
+    def _find_entry(self, database_message_id: int) -> Optional[NAIGenerationHistory]:
+        if database_message_id not in self.message_ids:
+            return None # New messages, nearly every generation, are not looked up
+        entry = self.store.find_by_message_id(database_message_id)
+        return NAIGenerationHistory.from_dict(entry) if entry else None
+
+    def _store_entry(self, history: NAIGenerationHistory, replaces: Optional[NAIGenerationHistory] = None):
+        if replaces is not None:
+            self.store.delete_message(replaces.result.database_message_id)
+            self.message_ids.discard(replaces.result.database_message_id)
+            self.snapshot_due = True
+        else:
+            self.row_count += 1
+        self.store.insert(history.to_dict())
+        if history.result.database_message_id is not None:
+            self.message_ids.add(history.result.database_message_id)
+        self.records_since_snapshot += 1
+        self.mark_dirty()
+
+    def iter_history(self, ordered: bool = False) -> Iterable[NAIGenerationHistory]:
+        return (NAIGenerationHistory.from_dict(entry) for entry in self.store.iterate(ordered=ordered))
+
+    def history_count(self) -> int:
+        return self.row_count
+
+    def _user_time_bounds(self, user_id: int) -> Optional[Tuple[str, str]]:
+        return self.store.user_time_bounds(user_id)
+
+    def get_user_history(self, user_id: int, limit: int = 10) -> List[NAIGenerationHistory]:
+        return [NAIGenerationHistory.from_dict(entry) for entry in self.store.user_history(user_id, limit)]
+
+    def get_user_history_page(self, user_id: int, before: Optional[tuple] = None, limit: int = 9) -> Tuple[List[NAIGenerationHistory], Optional[tuple]]:
+        rows = self.store.user_history_page(user_id, before, limit + 1) # One more tells whether there is a next page
+        page = rows[:limit]
+        cursor = (page[-1][1], page[-1][2]) if len(rows) > limit else None
+        return [NAIGenerationHistory.from_dict(entry) for entry, _, _ in page], cursor
+
+    def get_history_between(self, start: str, end: str) -> List[NAIGenerationHistory]:
+        return [NAIGenerationHistory.from_dict(entry) for entry in self.store.between(start, end)]
+
+    def get_generation(self, generation_id: str) -> Optional[NAIGenerationHistory]:
+        entry = self.store.find_by_generation_id(generation_id)
+        return NAIGenerationHistory.from_dict(entry) if entry else None
+
 try:
     import settings
     logger.debug("Settings imported successfully for stats manager")
@@ -663,7 +1391,10 @@ except Exception as e:
 
 # Create stats manager instance
 try:
-    stats_manager = NAIStatsManager(settings.STATS_DIR)
+    if settings.STATS_BACKEND == "sqlite":
+        stats_manager = SQLiteStatsManager(settings.STATS_DIR)
+    else:
+        stats_manager = NAIStatsManager(settings.STATS_DIR)
     logger.debug("Stats manager initialized successfully")
 except Exception as e:
     logger.error(f"Error creating stats manager: {str(e)}")
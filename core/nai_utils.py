@@ -118,4 +118,34 @@ def calculate_skip_cfg_above_sigma(initial_value, width, height) -> float:
     l = math.pow(je([4] + list(c)) / ze, 0.5)
     
     # Update and return the new skip_cfg_above_sigma value
-    return initial_value * l
\ No newline at end of file
+    return initial_value * l
+
+
+def nai_command_string(params) -> str:
+    """The /nai command that repeats a generation, from its GenerationParameters.
+    Optional parameters are only included when they differ from their defaults."""
+    command_str = f"/nai positive: \"{params.positive_prompt}\""
+    if params.negative_prompt:
+        command_str += f" negative: \"{params.negative_prompt}\""
+    command_str += f" width: {params.width} height: {params.height} steps: {params.steps} cfg: {params.cfg}"
+    command_str += f" sampler: {params.sampler} noise_schedule: {params.noise_schedule}"
+    # Only include smea if it's a specific mode (not None)
+    if params.smea in ["SMEA", "SMEA+DYN"]:
+        command_str += f" smea: {params.smea}"
+    command_str += f" seed: {params.seed}"
+    command_str += f" model: {params.model}"
+    if getattr(params, 'quality_toggle', True) is not True:
+        command_str += f" quality_toggle: {getattr(params, 'quality_toggle', True)}"
+    if getattr(params, 'undesired_content_preset', 'heavy') != 'heavy':
+        command_str += f" undesired_content_presets: {getattr(params, 'undesired_content_preset', 'heavy')}"
+    if getattr(params, 'prompt_conversion', False) is not False:
+        command_str += f" prompt_conversion_toggle: {getattr(params, 'prompt_conversion', False)}"
+    if getattr(params, 'upscale', False) is not False:
+        command_str += f" upscale: {getattr(params, 'upscale', False)}"
+    if getattr(params, 'decrisper', False) is not False:
+        command_str += f" decrisper: {getattr(params, 'decrisper', False)}"
+    if getattr(params, 'variety_plus', False) is not False:
+        command_str += f" variety_plus: {getattr(params, 'variety_plus', False)}"
+    if getattr(params, 'vibe_transfer_preset', None): # Include preset name if used
+        command_str += f" vibe_transfer_preset: \"{getattr(params, 'vibe_transfer_preset', None)}\""
+    return command_str
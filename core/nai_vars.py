@@ -142,7 +142,7 @@ class Nai_vars:
                 self.add_way = "append"
 
     class director_tools():
-        req_type = ["lineart", "sketch", "colorize", "emotion", "declutter"]
+        req_type = ["lineart", "sketch", "colorize", "emotion", "declutter", "bg-removal"]
         req_type_choice = [app_commands.Choice(name=name, value=name) for name in req_type]
         emotions = ["neutral", "happy", "sad", "angry", "surprise", "tired", "excited",
                     "nervous", "thinking", "confused", "shy", "disgusted", "smug",
@@ -3,17 +3,20 @@ import aiohttp
 import io
 import zipfile
 from discord.ext import commands
-from discord import Interaction, File, Message, Activity, ActivityType, AllowedMentions, CustomActivity
+from discord import Interaction, File, Message, InteractionMessage, WebhookMessage, Activity, ActivityType, AllowedMentions, CustomActivity
+import discord
 from settings import logger, NAI_API_TOKEN
-from collections import namedtuple
+from collections import namedtuple, deque
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import base64
 import json
 import settings
 from asyncio import CancelledError
 from core.dict_annotation import BundleData
-from core.generation import process_txt2img, process_director_tools
+from core.viewhandler import CancelRequestView
+from core.cost_model import estimate_job_cost, anlas_budget
+from core.generation import process_txt2img, process_director_tools, record_txt2img_generation, drop_checkpoint_payloads, TXT2IMG_STAGE_POLICIES
 
 from core.nai_utils import image_to_base64
 
@@ -45,8 +48,25 @@ class NAIQueue:
         self.output_dir = Path("nai_output")
         self.output_dir.mkdir(exist_ok=True)
         self.bot = bot
-        self.queue_list = []
+        # Waiting jobs keyed by request_id, in queue order, so a cancel can drop one in O(1).
+        # self.queue only holds one token per waiting job; the worker picks the job from these lanes.
+        self.queue_list: dict[str, BundleData] = {}
+        self.low_priority_list: dict[str, BundleData] = {} # Run when the normal lane is empty
+        # Moving averages of job run time by kind, used to predict the queue wait
+        self.job_durations: dict[str, float] = dict(settings.JOB_DURATION_DEFAULTS)
+        # Recent request latencies (queue wait + run time), for the p95 used by admission control
+        self.recent_latencies: deque[float] = deque(maxlen=200)
         self.user_request_count = {}
+        self.cancel_views: dict[str, CancelRequestView] = {}
+        # Attachments fetched and encoded while their job waits: request_id -> (task, reserved bytes, params)
+        self.prefetches: dict[str, tuple[asyncio.Task, int, dict]] = {}
+        self.prefetched_bytes = 0
+        # Job currently held by the worker, watched by the watchdog task
+        self.current_job: BundleData | None = None
+        self.current_job_task: asyncio.Task | None = None
+        self.current_job_started_at = 0.0
+        self.current_job_timeout_reason: str | None = None
+        self.current_job_cancelled_by_user = False
 
     async def add_to_queue(self, bundle_data: BundleData):
         user_id = bundle_data["interaction"].user.id
@@ -58,24 +78,181 @@ class NAIQueue:
                 await message.edit(content="You have reached the maximum limit of 2 requests in the queue. Please wait for your current requests to complete before adding more.")
                 return False
 
-        position = len(self.queue_list) + 1
-        bundle_data["position"] = position
-        self.queue_list.append(bundle_data)
-        await self.queue.put(bundle_data)
+        # A re-queued copy (reSeed/reMix) must not inherit the previous job's state
+        bundle_data["checkpoints"] = None
+        bundle_data["low_priority"] = False
+        bundle_data["streaming_disabled"] = False
 
-        # Increment the user's request count
+        accepted, admission_note = self._admit(bundle_data)
+        if not accepted:
+            logger.info(f"Request {bundle_data['request_id']} shed by admission control: {admission_note}")
+            await message.edit(content=f"🚦 {admission_note}")
+            return False
+        bundle_data["admission_note"] = admission_note
+
+        bundle_data["cost"] = estimate_job_cost(bundle_data)
+        guild_id = bundle_data["interaction"].guild_id
+        refusal = anlas_budget.reserve(bundle_data["request_id"], user_id, guild_id, bundle_data["cost"].anlas)
+        if refusal:
+            logger.info(f"Request {bundle_data['request_id']} refused by the Anlas budget: {refusal}")
+            await message.edit(content=f"💸 {refusal}")
+            return False
+        bundle_data["queued_at"] = asyncio.get_running_loop().time()
+
+        # Positions are set by update_queue_positions, in the order the worker takes the jobs
+        if bundle_data["low_priority"]:
+            self.low_priority_list[bundle_data["request_id"]] = bundle_data
+        else:
+            self.queue_list[bundle_data["request_id"]] = bundle_data
+        # Increment the user's request count, before an idle worker can take the job and decrement it
         self.user_request_count[user_id] = self.user_request_count.get(user_id, 0) + 1
+        await self.queue.put(None)
+        self._start_prefetch(bundle_data)
+
+        # The worker may already have taken the job, its message then no longer gets the Cancel button
+        if self._is_waiting(bundle_data["request_id"]):
+            view = CancelRequestView(bundle_data)
+            self.cancel_views[bundle_data["request_id"]] = view
+            try:
+                await message.edit(view=view)
+            except Exception as e:
+                # Still waiting, the request is dropped and its Anlas reservation released
+                if self._withdraw(bundle_data["request_id"]) is not None:
+                    logger.error(f"Dropped request {bundle_data['request_id']}, its message could not be edited: {str(e)}")
+                    await self.update_queue_positions()
+                    return False
+                logger.error(f"Failed to attach the Cancel button to request {bundle_data['request_id']}: {str(e)}")
+
         await self.update_queue_positions()
         return True
 
+    def _is_waiting(self, request_id: str) -> bool:
+        return request_id in self.queue_list or request_id in self.low_priority_list
+
+    def _withdraw(self, request_id: str) -> BundleData | None:
+        """Remove a waiting job from the queue and release what it holds. Returns it, None if it is not waiting.
+        Its token stays in self.queue and is skipped by the worker."""
+        bundle_data = self.queue_list.pop(request_id, None) or self.low_priority_list.pop(request_id, None)
+        if bundle_data is not None:
+            user_id = bundle_data["interaction"].user.id
+            self.user_request_count[user_id] = max(0, self.user_request_count.get(user_id, 0) - 1)
+            self._release_job_resources(request_id)
+        return bundle_data
+
+    @staticmethod
+    def _job_kind(bundle_data: BundleData) -> str:
+        if bundle_data["type"] == "txt2img" and bundle_data["params"].get("upscale"):
+            return "txt2img_upscale"
+        return bundle_data["type"]
+
+    def predicted_wait(self) -> float:
+        """Seconds a new normal-lane request is expected to wait before it starts."""
+        wait = sum(self.job_durations.get(self._job_kind(bundle_data), 0.0) for bundle_data in self.queue_list.values())
+        if self.current_job is not None:
+            elapsed = asyncio.get_running_loop().time() - self.current_job_started_at
+            wait += max(0.0, self.job_durations.get(self._job_kind(self.current_job), 0.0) - elapsed)
+        return wait
+
+    def latency_p95(self) -> float | None:
+        if not self.recent_latencies:
+            return None
+        ordered = sorted(self.recent_latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _admit(self, bundle_data: BundleData) -> tuple[bool, str | None]:
+        """Decide whether a new request is accepted, degrading it under load. Returns (accepted, reason)."""
+        depth = len(self.queue_list) + len(self.low_priority_list)
+        wait = self.predicted_wait()
+        if depth >= settings.ADMISSION_MAX_QUEUE_DEPTH or wait > settings.ADMISSION_TARGET_WAIT:
+            return False, f"The queue is overloaded (`{depth}` requests, about `{wait:.0f}s` wait). Please try again in a few minutes."
+
+        # Degrade when the predicted wait is high or recent requests already miss the latency target
+        p95 = self.latency_p95()
+        if wait <= settings.ADMISSION_DEGRADE_WAIT and (p95 is None or p95 <= settings.ADMISSION_TARGET_WAIT):
+            return True, None
+        changes = []
+        if bundle_data.get("streaming"):
+            # For this run only, the user's choice is kept for reSeed and remix copies
+            bundle_data["streaming_disabled"] = True
+            changes.append("streaming preview and timelapse disabled")
+        if self._job_kind(bundle_data) == "txt2img_upscale":
+            bundle_data["low_priority"] = True
+            changes.append("upscale moved to the low-priority lane")
+        if not changes:
+            return True, None
+        return True, f"High load (about `{wait:.0f}s` wait): {', '.join(changes)}."
+
+    def _next_job(self) -> BundleData | None:
+        """Take the next job, preferring the normal lane unless a deferred job has waited too long."""
+        request_id = self._pick_next(self.queue_list, self.low_priority_list, asyncio.get_running_loop().time())
+        if request_id is None:
+            return None
+        return self.queue_list.pop(request_id, None) or self.low_priority_list.pop(request_id)
+
+    def _pick_next(self, queue_list: dict[str, BundleData], low_priority_list: dict[str, BundleData], now: float) -> str | None:
+        """The request_id the worker takes next from these lanes at event loop time `now`, None when both are empty."""
+        if low_priority_list:
+            oldest = next(iter(low_priority_list.values()))
+            if not queue_list or now - oldest["queued_at"] > settings.LOW_PRIORITY_MAX_WAIT:
+                return oldest["request_id"]
+        if queue_list:
+            return self._cheapest_waiting_job(queue_list, now)
+        return None
+
+    def dispatch_order(self) -> list[BundleData]:
+        """The waiting jobs in the order the worker would take them if none were added."""
+        queue_list, low_priority_list = dict(self.queue_list), dict(self.low_priority_list)
+        now = asyncio.get_running_loop().time()
+        order = []
+        while (request_id := self._pick_next(queue_list, low_priority_list, now)) is not None:
+            order.append(queue_list.pop(request_id, None) or low_priority_list.pop(request_id))
+        return order
+
+    @staticmethod
+    def _cheapest_waiting_job(queue_list: dict[str, BundleData], now: float) -> str:
+        """Pick the request_id to run next from the normal lane. Among the first few waiting jobs the
+        cheapest runs first, which completes more jobs per Anlas and per minute, but a job that has
+        waited longer than SCHEDULER_MAX_DEFER is never passed over again."""
+        candidates = []
+        for bundle_data in queue_list.values():
+            if now - bundle_data["queued_at"] > settings.SCHEDULER_MAX_DEFER:
+                return bundle_data["request_id"]
+            candidates.append(bundle_data)
+            if len(candidates) >= settings.SCHEDULER_LOOKAHEAD:
+                break
+        cheapest = min(candidates, key=lambda bundle_data: (bundle_data["cost"].anlas, bundle_data["cost"].work))
+        return cheapest["request_id"]
+
+    def status_summary(self) -> dict:
+        """Queue load figures for /status."""
+        p95 = self.latency_p95()
+        return {
+            "queued": len(self.queue_list),
+            "queued_low_priority": len(self.low_priority_list),
+            "predicted_wait": f"{self.predicted_wait():.0f} s",
+            "latency_p95": f"{p95:.0f} s" if p95 is not None else None,
+            "job_durations": {kind: round(duration, 1) for kind, duration in self.job_durations.items()},
+        }
+
     async def update_queue_positions(self):
-        for i, bundle_data in enumerate(self.queue_list, start=1):
+        waiting = self.dispatch_order()
+        for i, bundle_data in enumerate(waiting, start=1):
             bundle_data: BundleData
-            await bundle_data['message'].edit(content=f"<a:neurowait:1269356713451065466> Your request is in queue. Current position: `{i}` <a:neurowait:1269356713451065466>")
+            bundle_data["position"] = i
+            content = f"<a:neurowait:1269356713451065466> Your request is in queue. Current position: `{i}` <a:neurowait:1269356713451065466>"
+            if bundle_data.get("admission_note"):
+                content += f"\n-# {bundle_data['admission_note']}"
+            time_left = self._token_time_left(bundle_data)
+            if time_left is not None and time_left <= 0:
+                continue # The response can no longer be edited
+            try:
+                await bundle_data['message'].edit(content=content)
+            except Exception as e:
+                logger.error(f"Failed to update queue position for request {bundle_data['request_id']}: {str(e)}")
         
         # If queue is not empty, shows it in pressence
-        if self.queue_list:
-            await self.bot.change_presence(activity=CustomActivity(name=f"Queue: {len(self.queue_list)}"))
+        if waiting:
+            await self.bot.change_presence(activity=CustomActivity(name=f"Queue: {len(waiting)}"))
         else:
             await self.bot.change_presence(activity=Activity(type=ActivityType.watching, name="you"))
     async def process_queue(self):
@@ -84,19 +261,20 @@ class NAIQueue:
             while True:
                 try:
                     # Wait for an item to be available in the queue
-                    bundle_data: BundleData = await self.queue.get()
-                    
-                    if self.queue_list:
-                        self.queue_list.pop(0)
-                    else:
-                        logger.warning("Queue list is empty but an item was received from the queue.")
+                    await self.queue.get()
+
+                    # Tokens of cancelled jobs have no job left to pick
+                    bundle_data = self._next_job()
+                    if bundle_data is None:
+                        self.queue.task_done()
+                        continue
 
                     # Decrement the user's request count
                     user_id = bundle_data["interaction"].user.id
                     self.user_request_count[user_id] = max(0, self.user_request_count.get(user_id, 0) - 1)
 
                     await self.update_queue_positions()
-                    await self._process_item(bundle_data)
+                    await self._run_job(bundle_data)
                     self.queue.task_done()
                 except CancelledError:
                     logger.info("Queue processing was cancelled.")
@@ -118,20 +296,258 @@ class NAIQueue:
                 await self.session.close()
 
 
-    async def _process_item(self, bundle_data: BundleData):
+    async def _run_job(self, bundle_data: BundleData):
+        """Run a job in its own task, so the watchdog can cancel it without stopping the queue."""
+        if not await self._ensure_deliverable(bundle_data):
+            self._release_job_resources(bundle_data["request_id"])
+            return
+
+        self.current_job = bundle_data
+        self.current_job_started_at = asyncio.get_running_loop().time()
+        self.current_job_timeout_reason = None
+        self.current_job_cancelled_by_user = False
+        self.current_job_task = asyncio.create_task(self._process_item(bundle_data))
+        try:
+            success = await self.current_job_task
+            self._record_job_time(bundle_data)
+            if success:
+                anlas_budget.commit(bundle_data["request_id"])
+        except CancelledError:
+            if self.current_job_cancelled_by_user:
+                await self._report_unfinished_job(bundle_data, "Cancelled by user", "🚫 Your request was cancelled.")
+            elif self.current_job_timeout_reason is not None:
+                reason = self.current_job_timeout_reason
+                logger.warning(f"Request {bundle_data['request_id']} timed out: {reason}")
+                await self._report_unfinished_job(bundle_data, f"Timed out: {reason}", f"⏱️ Your request was cancelled because {reason}. Please try again later.")
+            else:
+                raise # The queue itself is being stopped
+        finally:
+            self.current_job = None
+            self.current_job_task = None
+            if bundle_data.get("checkpoints"):
+                drop_checkpoint_payloads(bundle_data["checkpoints"])
+            self._release_job_resources(bundle_data["request_id"])
+
+    def _release_job_resources(self, request_id: str):
+        """Stop the job's Cancel button, free its prefetched attachment and drop any uncharged Anlas reservation."""
+        anlas_budget.release(request_id)
+        view = self.cancel_views.pop(request_id, None)
+        if view:
+            view.stop()
+        prefetch = self.prefetches.pop(request_id, None)
+        if prefetch:
+            task, reserved, params = prefetch
+            task.cancel()
+            self.prefetched_bytes -= reserved
+            params.pop("image_bytes", None)
+            params.pop("image_base64", None)
+            # Budget was freed, prefetch for jobs that were over it when they were queued
+            for waiting in [*self.queue_list.values(), *self.low_priority_list.values()]:
+                if waiting["request_id"] not in self.prefetches:
+                    self._start_prefetch(waiting)
+
+    def _start_prefetch(self, bundle_data: BundleData):
+        """Download and encode a director tools upload now, so the worker can call NovelAI as soon as it picks the job."""
+        if bundle_data["type"] != "director_tools":
+            return
+        params = bundle_data["director_tools_params"]
+        reserved = params["image"].size * 7 // 3 # Raw bytes plus their base64 encoding
+        if self.prefetched_bytes + reserved > settings.PREFETCH_BYTE_BUDGET:
+            return # Over budget, the worker fetches it instead
+        self.prefetched_bytes += reserved
+        task = asyncio.create_task(self._prefetch_attachment(params))
+        self.prefetches[bundle_data["request_id"]] = (task, reserved, params)
+
+    @staticmethod
+    async def _prefetch_attachment(params: dict):
+        image_bytes = await params["image"].read()
+        params["image_base64"] = await asyncio.to_thread(lambda: base64.b64encode(image_bytes).decode("utf-8"))
+        params["image_bytes"] = image_bytes
+
+    async def _wait_for_prefetch(self, request_id: str):
+        prefetch = self.prefetches.get(request_id)
+        if prefetch is None:
+            return
+        try:
+            await asyncio.wait_for(prefetch[0], settings.DISCORD_CALL_TIMEOUT)
+        except (Exception, CancelledError) as e:
+            if isinstance(e, CancelledError) and asyncio.current_task().cancelling():
+                raise # The job itself is being cancelled
+            logger.warning(f"Prefetch failed for request {request_id}, the worker fetches it instead: {str(e)}")
+
+    @staticmethod
+    def _token_time_left(bundle_data: BundleData) -> float | None:
+        """Seconds until the interaction token behind the job's message expires, or None if the message does not use one."""
+        if not isinstance(bundle_data["message"], (InteractionMessage, WebhookMessage)):
+            return None
+        expires_at = bundle_data["interaction"].created_at + timedelta(seconds=settings.INTERACTION_TOKEN_LIFETIME)
+        return (expires_at - discord.utils.utcnow()).total_seconds()
+
+    async def _move_to_channel(self, bundle_data: BundleData) -> bool:
+        """Continue a job in a plain channel message, which does not expire. Returns False if the bot cannot post there."""
+        interaction: Interaction = bundle_data["interaction"]
+        channel = self.bot.get_channel(interaction.channel_id)
+        if channel is None:
+            return False # User-installed app outside the bot's guilds
+        view = self.cancel_views.get(bundle_data["request_id"])
+        try:
+            new_message = await asyncio.wait_for(
+                channel.send(
+                    content=f"{interaction.user.mention} Your request continues here, the original response is about to expire.",
+                    allowed_mentions=AllowedMentions(users=[interaction.user]),
+                    view=view
+                ),
+                settings.DISCORD_CALL_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"Could not move request {bundle_data['request_id']} to a channel message: {str(e)}")
+            return False
+
+        old_message = bundle_data["message"]
+        bundle_data["message"] = new_message
+        try:
+            await asyncio.wait_for(old_message.edit(content=f"↪️ Moved to {new_message.jump_url}", view=None), settings.DISCORD_CALL_TIMEOUT)
+        except Exception:
+            pass # The old response may already be read-only
+        logger.info(f"Request {bundle_data['request_id']} moved to a channel message before its interaction token expired")
+        return True
+
+    async def _ensure_deliverable(self, bundle_data: BundleData) -> bool:
+        """Make sure the job's result can still be delivered before spending a NovelAI call on it."""
+        time_left = self._token_time_left(bundle_data)
+        if time_left is None or time_left > self.job_durations.get(self._job_kind(bundle_data), 0.0) + settings.INTERACTION_TOKEN_MARGIN:
+            return True
+        if await self._move_to_channel(bundle_data):
+            return True
+        if time_left > settings.INTERACTION_TOKEN_MARGIN:
+            return True # Tight, but the response can still be edited
+
+        logger.warning(f"Dropping request {bundle_data['request_id']}: its response expires in {time_left:.0f}s and there is no channel to deliver to")
+        if time_left > 0:
+            try:
+                await asyncio.wait_for(
+                    bundle_data["message"].edit(content="⌛ Your request waited too long in the queue to be delivered. Please try again.", view=None),
+                    settings.DISCORD_CALL_TIMEOUT
+                )
+            except Exception as e:
+                logger.error(f"Failed to report dropped request {bundle_data['request_id']}: {str(e)}")
+        return False
+
+    def _record_job_time(self, bundle_data: BundleData):
+        now = asyncio.get_running_loop().time()
+        kind = self._job_kind(bundle_data)
+        duration = now - self.current_job_started_at
+        self.job_durations[kind] = 0.8 * self.job_durations.get(kind, duration) + 0.2 * duration
+        self.recent_latencies.append(now - bundle_data["queued_at"])
+
+    async def cancel_request(self, request_id: str) -> str | None:
+        """Cancel a queued or running request. Returns "queued", "running", or None if it is not found."""
+        bundle_data = self._withdraw(request_id)
+        if bundle_data is not None:
+            logger.info(f"Request {request_id} cancelled while queued")
+            try:
+                await bundle_data["message"].edit(content="🚫 Your request was cancelled.", view=None)
+            except Exception as e:
+                logger.error(f"Failed to report cancelled request {request_id}: {str(e)}")
+            await self.update_queue_positions()
+            return "queued"
+
+        if self.current_job and self.current_job["request_id"] == request_id and self.current_job_task and not self.current_job_task.done():
+            # Cancelling the task closes the NovelAI request or stream it is awaiting
+            logger.info(f"Request {request_id} cancelled while running")
+            self.current_job_cancelled_by_user = True
+            self.current_job_task.cancel()
+            return "running"
+        return None
+
+    def user_requests(self, user_id: int) -> list[str]:
+        """Return the request_ids a user has running or waiting, running first, then in the order they were queued."""
+        waiting = sorted([*self.queue_list.values(), *self.low_priority_list.values()], key=lambda bundle_data: bundle_data["queued_at"])
+        request_ids = [bundle_data["request_id"] for bundle_data in waiting if bundle_data["interaction"].user.id == user_id]
+        if self.current_job and self.current_job["interaction"].user.id == user_id:
+            request_ids.insert(0, self.current_job["request_id"])
+        return request_ids
+
+    def _stuck_reason(self) -> str | None:
+        """Return why the current job is past its budget, or None if it is within it."""
+        if self.current_job is None:
+            return None
+        now = asyncio.get_running_loop().time()
+        if now - self.current_job_started_at > settings.JOB_TOTAL_DEADLINE:
+            return f"it ran for more than `{settings.JOB_TOTAL_DEADLINE:g}s`"
+        checkpoints = self.current_job.get("checkpoints") or {}
+        stage = checkpoints.get("stage")
+        policy = TXT2IMG_STAGE_POLICIES.get(stage) if self.current_job["type"] == "txt2img" else None
+        if policy and now - checkpoints.get("stage_started_at", now) > policy.deadline:
+            return f"stage `{stage}` ran for more than `{policy.deadline:g}s`"
+        return None
+
+    async def watchdog(self):
+        """Cancel the running job when it is stuck past its stage or total deadline,
+        and move waiting jobs off interaction tokens that are about to expire."""
+        while True:
+            await asyncio.sleep(settings.JOB_WATCHDOG_INTERVAL)
+            try:
+                reason = self._stuck_reason()
+                if reason and self.current_job_task and not self.current_job_task.done() and not self.current_job_cancelled_by_user:
+                    self.current_job_timeout_reason = reason
+                    self.current_job_task.cancel()
+
+                # A running job picks up the new message on its next stage retry
+                active = [self.current_job] if self.current_job else []
+                for bundle_data in [*active, *self.queue_list.values(), *self.low_priority_list.values()]:
+                    time_left = self._token_time_left(bundle_data)
+                    if time_left is not None and 0 < time_left < settings.INTERACTION_TOKEN_MARGIN:
+                        await self._move_to_channel(bundle_data)
+            except Exception as e:
+                logger.error(f"Error in queue watchdog: {str(e)}")
+
+    async def _report_unfinished_job(self, bundle_data: BundleData, error_message: str, content: str):
+        """Record a job stopped by the watchdog or the user and tell the user about it."""
+        checkpoints = bundle_data.get("checkpoints")
+        if bundle_data["type"] == "txt2img" and checkpoints and not checkpoints.get("stats_recorded"):
+            try:
+                record_txt2img_generation(bundle_data, success=False, error_message=error_message)
+            except Exception as e:
+                logger.error(f"Failed to record unfinished request {bundle_data['request_id']}: {str(e)}")
+        if checkpoints and checkpoints.get("delivered"):
+            # Stopped after the image was delivered, editing the message would remove it
+            logger.info(f"Request {bundle_data['request_id']} stopped after delivery: {error_message}")
+            return
+        try:
+            await asyncio.wait_for(
+                bundle_data["message"].edit(content=content, attachments=[], view=None),
+                settings.DISCORD_CALL_TIMEOUT
+            )
+        except Exception as e:
+            logger.error(f"Failed to report unfinished request {bundle_data['request_id']}: {str(e)}")
+
+    async def _process_item(self, bundle_data: BundleData) -> bool:
         type = bundle_data["type"]
+        success = False
         if type == "txt2img":
             success = await process_txt2img(self.bot, bundle_data)
         elif type == "director_tools":
+            await self._wait_for_prefetch(bundle_data["request_id"])
             success = await process_director_tools(self.bot, bundle_data)
+        return success
 
 
 
     async def start(self):
         self.queue_task = asyncio.create_task(self.process_queue())
+        self.watchdog_task = asyncio.create_task(self.watchdog())
 
     async def stop(self):
         
+        # Stop the watchdog first so it cannot cancel a job while the queue shuts down
+        if hasattr(self, 'watchdog_task'):
+            self.watchdog_task.cancel()
+            try:
+                await self.watchdog_task
+            except asyncio.CancelledError:
+                pass
+
         # Cancel the queue processing task
         if hasattr(self, 'queue_task'):
             self.queue_task.cancel()
@@ -4,6 +4,7 @@ import asyncio
 from settings import logger
 import core.queuehandler as queuehandler
 from core.viewhandler import RemixView
+from core.nai_stats import stats_manager
 import aiohttp # Import aiohttp for exception handling
 
 async def edit_message_safe(message, view):
@@ -20,6 +21,12 @@ async def shutdown_tasks():
 
     # Stop the queue first
     await queuehandler.stop_queue()
+
+    # Write the remaining stats changes, with a snapshot so the next start has no history log to replay
+    try:
+        await stats_manager.stop_flusher()
+    except Exception as e:
+        logger.error(f"Error saving stats during shutdown: {str(e)}")
     
     # Get bot instance from settings (where it's stored during startup)
     bot = settings.Globals.bot
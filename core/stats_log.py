@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import re
+from pathlib import Path
+
+import settings
+from settings import logger
+from core import fast_json
+
+SNAPSHOT_VERSION = 1
+_SEGMENT_PATTERN = re.compile(r"segment-(\d+)\.jsonl(\.tmp)?$")
+
+def _segment_name(number: int) -> str:
+    return f"segment-{number:06d}.jsonl"
+
+class HistoryLog:
+    """Generation history as an append-only log of JSONL segments.
+    Each line is a record {"op": "add" | "overwrite", "entry": history dict}. The user and global
+    stats and the usage rollups are checkpointed in a snapshot that records the log position it covers,
+    so loading only has to replay the records written after it."""
+
+    def __init__(self, log_dir: Path, snapshot_file: Path):
+        self.log_dir = log_dir
+        self.snapshot_file = snapshot_file
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.base_segment = 1 # First segment still in use, older ones were compacted away
+        self.segment = 1 # Segment new records are appended to
+        self.offset = 0 # Size of that segment
+
+    def _segment_path(self, number: int) -> Path:
+        return self.log_dir / _segment_name(number)
+
+    def _segment_numbers(self) -> list[int]:
+        numbers = []
+        for path in self.log_dir.iterdir():
+            match = _SEGMENT_PATTERN.match(path.name)
+            if match and not match.group(2):
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def exists(self) -> bool:
+        return bool(self._segment_numbers()) or self.snapshot_file.exists()
+
+    def load_snapshot(self) -> dict | None:
+        """Read the snapshot and finish or discard an interrupted compaction."""
+        snapshot = None
+        if self.snapshot_file.exists():
+            try:
+                snapshot = fast_json.loads(self.snapshot_file.read_bytes())
+                if snapshot.get("version") != SNAPSHOT_VERSION:
+                    logger.warning(f"Ignoring stats snapshot with unknown version {snapshot.get('version')}")
+                    snapshot = None
+            except Exception as e:
+                logger.error(f"Error loading stats snapshot, replaying the whole history log: {str(e)}")
+                snapshot = None
+        if snapshot:
+            self.base_segment = snapshot["base_segment"]
+
+        for path in self.log_dir.glob("segment-*.jsonl.tmp"):
+            number = int(_SEGMENT_PATTERN.match(path.name).group(1))
+            if snapshot and number == self.base_segment and not self._segment_path(number).exists():
+                # The snapshot of a compaction was written but the compacted segment was not moved in place yet
+                path.replace(self._segment_path(number))
+            else:
+                path.unlink()
+        return snapshot
+
+    def read(self, snapshot: dict | None):
+        """Yield (covered, record) for every record in the log, oldest first.
+        `covered` is True for records the snapshot's stats already include."""
+        covered_until = (snapshot["segment"], snapshot["offset"]) if snapshot else (0, 0)
+        numbers = [n for n in self._segment_numbers() if n >= self.base_segment]
+        for number in numbers:
+            path = self._segment_path(number)
+            offset = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    start = offset
+                    offset += len(line)
+                    if not line.endswith(b"\n"):
+                        # A write cut short by a crash, drop it so the next append starts on a fresh line
+                        logger.warning(f"Truncating incomplete record at the end of {path.name}")
+                        f.close()
+                        os.truncate(path, start)
+                        offset = start
+                        break
+                    try:
+                        record = fast_json.loads(line)
+                    except Exception as e:
+                        logger.error(f"Skipping unreadable record in {path.name} at byte {start}: {str(e)}")
+                        continue
+                    yield (number, offset) <= covered_until, record
+            self.segment, self.offset = number, offset
+        if not numbers:
+            self.segment, self.offset = self.base_segment, 0
+
+    def append(self, records: list[dict], fsync: bool = False):
+        """Append records to the current segment, starting a new one when it is full."""
+        if not records:
+            return
+        if self.offset >= settings.STATS_SEGMENT_MAX_BYTES:
+            self.segment += 1
+            self.offset = 0
+        data = b"".join(fast_json.dumps(record) + b"\n" for record in records)
+        with open(self._segment_path(self.segment), "ab") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self.offset += len(data)
+
+    def write_snapshot(self, user_stats: dict, global_stats: dict, rollups: dict | None = None, fsync: bool = True):
+        """Checkpoint the stats as of the current end of the log. Without rollups they are rebuilt from history on load."""
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "base_segment": self.base_segment,
+            "segment": self.segment,
+            "offset": self.offset,
+            "user_stats": user_stats,
+            "global_stats": global_stats,
+        }
+        if rollups is not None:
+            snapshot["rollups"] = rollups
+        temp_file = self.snapshot_file.with_suffix(".tmp")
+        with open(temp_file, "wb") as f:
+            f.write(fast_json.dumps(snapshot))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        temp_file.replace(self.snapshot_file)
+
+    def compact(self, entries: list[dict], user_stats: dict, global_stats: dict, rollups: dict | None = None):
+        """Rewrite the log as one "add" record per live entry, dropping overwritten ones,
+        and snapshot the stats at its end."""
+        new_segment = self.segment + 1
+        temp_path = self.log_dir / (_segment_name(new_segment) + ".tmp")
+        with open(temp_path, "wb") as f:
+            for entry in entries:
+                f.write(fast_json.dumps({"op": "add", "entry": entry}) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+        old_numbers = self._segment_numbers()
+        self.base_segment, self.segment, self.offset = new_segment, new_segment, size
+        # The snapshot is what switches over to the compacted segment, see load_snapshot
+        self.write_snapshot(user_stats, global_stats, rollups)
+        temp_path.replace(self._segment_path(new_segment))
+        for number in old_numbers:
+            self._segment_path(number).unlink(missing_ok=True)
+
+def migrate_legacy_files(log: HistoryLog, history_file: Path, user_stats_file: Path, global_stats_file: Path) -> int:
+    """Convert nai_history.json, nai_user_stats.json and nai_global_stats.json into the history log
+    and a snapshot. The old files are left in place. Returns the number of migrated entries."""
+    with open(history_file, "r") as f:
+        history = json.load(f)
+    for start in range(0, len(history), 1000):
+        log.append([{"op": "add", "entry": entry} for entry in history[start:start + 1000]])
+
+    if user_stats_file.exists() and global_stats_file.exists():
+        with open(user_stats_file, "r") as f:
+            user_stats = json.load(f)
+        with open(global_stats_file, "r") as f:
+            global_stats = json.load(f)
+        log.write_snapshot(user_stats, global_stats)
+    # Without a snapshot the stats are recalculated from the log on load
+    logger.info(f"Migrated {len(history)} history entries from {history_file} to {log.log_dir}")
+    return len(history)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the JSON stats files into the append-only history log.")
+    parser.add_argument("--force", action="store_true", help="Replace an existing history log and snapshot")
+    args = parser.parse_args()
+
+    history_log = HistoryLog(settings.STATS_LOG_DIR, settings.STATS_SNAPSHOT_FILE)
+    legacy_history = settings.STATS_DIR / "nai_history.json"
+    if not legacy_history.exists():
+        raise SystemExit(f"{legacy_history} does not exist, nothing to migrate")
+    if history_log.exists():
+        if not args.force:
+            raise SystemExit(f"{settings.STATS_LOG_DIR} already holds a history log, pass --force to replace it")
+        for path in settings.STATS_LOG_DIR.glob("segment-*"):
+            path.unlink()
+        settings.STATS_SNAPSHOT_FILE.unlink(missing_ok=True)
+    count = migrate_legacy_files(
+        history_log,
+        legacy_history,
+        settings.USER_STATS_DIR / "nai_user_stats.json",
+        settings.GLOBAL_STATS_DIR / "nai_global_stats.json",
+    )
+    print(f"Migrated {count} history entries")
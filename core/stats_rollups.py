@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta
+
+import settings
+
+# Bucket key formats, keys of one granularity sort chronologically
+GRANULARITIES = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d", "month": "%Y-%m"}
+DIMENSIONS = ("model", "sampler", "guild")
+NO_GUILD = "none" # Guild value of DMs and of entries recorded before guilds were tracked
+
+def _new_counters() -> list:
+    return [0, 0, 0.0] # Generations, errors, generation time sum
+
+class StatsRollups:
+    """Generation counts, error counts and generation time sums per hour, day and month, in total
+    and per model, sampler and guild. Updated with every generation, so reading a time series
+    costs O(buckets) instead of a history scan.
+    Each bucket is {"total": counters, "model": {model: counters}, "sampler": {...}, "guild": {...}}.
+    Generations per user and model are also kept for the last days, for the windowed leaderboards."""
+
+    def __init__(self):
+        self.buckets: dict[str, dict[str, dict]] = {granularity: {} for granularity in GRANULARITIES}
+        # How far back buckets are kept per granularity, None keeps all of them
+        self.retention = {
+            "hour": timedelta(hours=settings.STATS_ROLLUP_HOURS),
+            "day": timedelta(days=settings.STATS_ROLLUP_DAYS),
+            "month": None,
+        }
+        self.user_days: dict[str, dict[str, dict[str, int]]] = {} # Day -> model -> user ID -> generations
+        self.user_retention = timedelta(days=settings.STATS_USER_ROLLUP_DAYS)
+
+    def apply(self, history, sign: int = 1):
+        """Add a NAIGenerationHistory to its buckets, or subtract it with sign=-1."""
+        date = datetime.fromisoformat(history.timestamp)
+        values = {
+            "model": str(history.parameters.model),
+            "sampler": str(history.parameters.sampler),
+            "guild": str(history.guild_id) if history.guild_id is not None else NO_GUILD,
+        }
+        error = 0 if history.result.success else 1
+        for granularity, key_format in GRANULARITIES.items():
+            key = date.strftime(key_format)
+            bucket = self._bucket(granularity, key, create=sign > 0)
+            if bucket is None:
+                continue
+            self._add(bucket["total"], sign, error, history.generation_time)
+            for dimension, value in values.items():
+                counters = bucket[dimension].get(value)
+                if counters is None:
+                    if sign < 0:
+                        continue
+                    counters = bucket[dimension][value] = _new_counters()
+                self._add(counters, sign, error, history.generation_time)
+                if counters[0] <= 0:
+                    del bucket[dimension][value]
+            if bucket["total"][0] <= 0:
+                del self.buckets[granularity][key]
+        self._apply_user(date.strftime(GRANULARITIES["day"]), values["model"], str(history.user_id), sign)
+
+    def _apply_user(self, day: str, model: str, user_id: str, sign: int):
+        models = self.user_days.get(day)
+        if models is None:
+            if sign < 0:
+                return
+            cutoff = (datetime.now() - self.user_retention).strftime(GRANULARITIES["day"])
+            if day < cutoff:
+                return
+            for expired in [d for d in self.user_days if d < cutoff]:
+                del self.user_days[expired]
+            models = self.user_days[day] = {}
+        users = models.get(model)
+        if users is None:
+            if sign < 0:
+                return
+            users = models[model] = {}
+        count = users.get(user_id, 0) + sign
+        if count > 0:
+            users[user_id] = count
+        else:
+            users.pop(user_id, None)
+            if not users:
+                del models[model]
+                if not models:
+                    del self.user_days[day]
+
+    def _bucket(self, granularity: str, key: str, create: bool) -> dict | None:
+        buckets = self.buckets[granularity]
+        bucket = buckets.get(key)
+        if bucket is None and create:
+            if self.retention[granularity] is not None:
+                cutoff = (datetime.now() - self.retention[granularity]).strftime(GRANULARITIES[granularity])
+                if key < cutoff:
+                    return None # Past the retention
+                # Buckets are only created about once an hour, dropping the expired ones here is cheap
+                for expired in [k for k in buckets if k < cutoff]:
+                    del buckets[expired]
+            bucket = buckets[key] = {"total": _new_counters(), **{dimension: {} for dimension in DIMENSIONS}}
+        return bucket
+
+    @staticmethod
+    def _add(counters: list, sign: int, error: int, generation_time: float):
+        counters[0] += sign
+        counters[1] += sign * error
+        counters[2] += sign * generation_time
+
+    def _keys(self, granularity: str, start: str | None, end: str | None) -> list[str]:
+        return [
+            key for key in sorted(self.buckets[granularity])
+            if (start is None or key >= start) and (end is None or key < end)
+        ]
+
+    def series(self, granularity: str, dimension: str | None = None, value: str | None = None,
+               start: str | None = None, end: str | None = None) -> list[tuple[str, list]]:
+        """(bucket key, [generations, errors, generation time]) for start <= key < end, oldest first.
+        The totals, or those of one model, sampler or guild when `dimension` and `value` are given."""
+        series = []
+        for key in self._keys(granularity, start, end):
+            bucket = self.buckets[granularity][key]
+            counters = bucket["total"] if dimension is None else bucket[dimension].get(value)
+            if counters is not None:
+                series.append((key, list(counters)))
+        return series
+
+    def total(self, granularity: str, start: str | None = None, end: str | None = None) -> list:
+        """[generations, errors, generation time] summed over the buckets with start <= key < end."""
+        total = _new_counters()
+        for key in self._keys(granularity, start, end):
+            for i, count in enumerate(self.buckets[granularity][key]["total"]):
+                total[i] += count
+        return total
+
+    def breakdown(self, granularity: str, dimension: str, start: str | None = None, end: str | None = None) -> dict[str, list]:
+        """[generations, errors, generation time] per model, sampler or guild, summed over the buckets with start <= key < end."""
+        breakdown: dict[str, list] = {}
+        for key in self._keys(granularity, start, end):
+            for value, counters in self.buckets[granularity][key][dimension].items():
+                summed = breakdown.setdefault(value, _new_counters())
+                for i, count in enumerate(counters):
+                    summed[i] += count
+        return breakdown
+
+    def to_dict(self) -> dict:
+        """A copy that shares nothing mutable with the rollups."""
+        return {
+            granularity: {
+                key: {
+                    "total": list(bucket["total"]),
+                    **{dimension: {value: list(counters) for value, counters in bucket[dimension].items()} for dimension in DIMENSIONS},
+                }
+                for key, bucket in buckets.items()
+            }
+            for granularity, buckets in self.buckets.items()
+        } | {
+            "user_day": {day: {model: dict(users) for model, users in models.items()} for day, models in self.user_days.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'StatsRollups':
+        rollups = cls()
+        for granularity in GRANULARITIES:
+            rollups.buckets[granularity] = data.get(granularity, {})
+        rollups.user_days = data.get("user_day", {})
+        return rollups
+
+    @staticmethod
+    def is_complete(data: dict | None) -> bool:
+        """Whether snapshotted rollups hold everything kept now, older snapshots are rebuilt from history."""
+        return data is not None and "user_day" in data
@@ -0,0 +1,184 @@
+import sqlite3
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import settings
+from settings import logger
+from core import fast_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY, -- Insertion order, overwritten entries are inserted again
+    generation_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    database_message_id INTEGER,
+    data BLOB NOT NULL -- The entry's to_dict() as JSON
+);
+CREATE INDEX IF NOT EXISTS history_user_time ON history (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS history_time ON history (timestamp);
+CREATE INDEX IF NOT EXISTS history_generation ON history (generation_id);
+CREATE UNIQUE INDEX IF NOT EXISTS history_message ON history (database_message_id) WHERE database_message_id IS NOT NULL;
+CREATE TABLE IF NOT EXISTS snapshot (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    last_seq INTEGER NOT NULL, -- Last history row the stats include
+    user_stats BLOB NOT NULL,
+    global_stats BLOB NOT NULL,
+    rollups BLOB -- NULL in snapshots written before usage rollups were kept
+);
+"""
+PAGE_SIZE = 5000
+
+class SQLiteHistoryStore:
+    """Generation history in a SQLite database (WAL mode). The connection is owned by one dedicated
+    thread, every query runs there in submission order, so reads see earlier writes.
+    Writes do not wait for the thread and are committed together with the stats by submit_commit()."""
+
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stats-sqlite")
+        self.connection: sqlite3.Connection | None = None
+        self._call(self._connect)
+
+    def _connect(self):
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # A WAL database stays consistent after a crash at any level, they differ in how many recent commits it can lose
+        synchronous = {"always": "FULL", "snapshot": "NORMAL", "never": "OFF"}.get(settings.STATS_FSYNC, "NORMAL")
+        self.connection.execute(f"PRAGMA synchronous={synchronous}")
+        self.connection.executescript(SCHEMA)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(snapshot)")}
+        if "rollups" not in columns:
+            self.connection.execute("ALTER TABLE snapshot ADD COLUMN rollups BLOB")
+        self.connection.commit()
+
+    def _call(self, func, *args):
+        """Run `func` on the database thread and wait for its result."""
+        return self.executor.submit(func, *args).result()
+
+    def _submit(self, func, *args):
+        """Run `func` on the database thread without waiting, logging a failure."""
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future: Future):
+        if future.exception() is not None:
+            logger.error(f"Error writing stats history to SQLite: {str(future.exception())}")
+
+    @staticmethod
+    def _rows_to_dicts(rows) -> list[dict]:
+        return [fast_json.loads(row[0]) for row in rows]
+
+    def insert(self, entry: dict):
+        row = (
+            entry["generation_id"], entry["timestamp"], entry["user_id"],
+            entry["result"]["database_message_id"], fast_json.dumps(entry),
+        )
+        self._submit(lambda: self.connection.execute(
+            "INSERT INTO history (generation_id, timestamp, user_id, database_message_id, data) VALUES (?, ?, ?, ?, ?)", row
+        ))
+
+    def delete_message(self, database_message_id: int):
+        self._submit(lambda: self.connection.execute(
+            "DELETE FROM history WHERE database_message_id = ?", (database_message_id,)
+        ))
+
+    def find_by_message_id(self, database_message_id: int) -> dict | None:
+        rows = self._call(lambda: self.connection.execute(
+            "SELECT data FROM history WHERE database_message_id = ?", (database_message_id,)
+        ).fetchall())
+        return fast_json.loads(rows[0][0]) if rows else None
+
+    def find_by_generation_id(self, generation_id: str) -> dict | None:
+        rows = self._call(lambda: self.connection.execute(
+            "SELECT data FROM history WHERE generation_id = ? ORDER BY seq DESC LIMIT 1", (generation_id,)
+        ).fetchall())
+        return fast_json.loads(rows[0][0]) if rows else None
+
+    def user_history(self, user_id: int, limit: int) -> list[dict]:
+        """The user's latest entries, newest first."""
+        return self._rows_to_dicts(self._call(lambda: self.connection.execute(
+            "SELECT data FROM history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?", (user_id, limit)
+        ).fetchall()))
+
+    def user_history_page(self, user_id: int, before: tuple[str, int] | None, limit: int) -> list[tuple[dict, str, int]]:
+        """(entry, timestamp, seq) of the user's entries before a (timestamp, seq) cursor, newest first."""
+        if before is None:
+            before = ("\uffff", 0) # After every timestamp
+        return [(fast_json.loads(row[0]), row[1], row[2]) for row in self._call(lambda: self.connection.execute(
+            "SELECT data, timestamp, seq FROM history WHERE user_id = ? AND (timestamp, seq) < (?, ?) ORDER BY timestamp DESC, seq DESC LIMIT ?",
+            (user_id, before[0], before[1], limit)
+        ).fetchall())]
+
+    def user_time_bounds(self, user_id: int) -> tuple[str, str] | None:
+        """Timestamps of the user's oldest and newest entries."""
+        row = self._call(lambda: self.connection.execute(
+            "SELECT MIN(timestamp), MAX(timestamp) FROM history WHERE user_id = ?", (user_id,)
+        ).fetchone())
+        return (row[0], row[1]) if row[0] is not None else None
+
+    def between(self, start: str, end: str) -> list[dict]:
+        return self._rows_to_dicts(self._call(lambda: self.connection.execute(
+            "SELECT data FROM history WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp", (start, end)
+        ).fetchall()))
+
+    def message_ids(self) -> set[int]:
+        """Database message IDs of all entries, for the stats manager's duplicate checks."""
+        return {row[0] for row in self._call(lambda: self.connection.execute(
+            "SELECT database_message_id FROM history WHERE database_message_id IS NOT NULL"
+        ).fetchall())}
+
+    def count(self) -> int:
+        return self._call(lambda: self.connection.execute("SELECT COUNT(*) FROM history").fetchone()[0])
+
+    def iterate(self, ordered: bool = False, after_seq: int = 0):
+        """Yield all entries after `after_seq`, by timestamp or insertion order, a page at a time."""
+        if ordered:
+            last = ("", 0)
+            while True:
+                rows = self._call(lambda: self.connection.execute(
+                    "SELECT data, timestamp, seq FROM history WHERE (timestamp, seq) > (?, ?) AND seq > ? ORDER BY timestamp, seq LIMIT ?",
+                    (*last, after_seq, PAGE_SIZE)
+                ).fetchall())
+                if not rows:
+                    return
+                last = (rows[-1][1], rows[-1][2])
+                yield from self._rows_to_dicts(rows)
+        else:
+            last_seq = after_seq
+            while True:
+                rows = self._call(lambda: self.connection.execute(
+                    "SELECT data, seq FROM history WHERE seq > ? ORDER BY seq LIMIT ?", (last_seq, PAGE_SIZE)
+                ).fetchall())
+                if not rows:
+                    return
+                last_seq = rows[-1][1]
+                yield from self._rows_to_dicts(rows)
+
+    def load_snapshot(self) -> tuple[int, dict, dict, dict | None] | None:
+        """(last history row included, user stats, global stats, rollups) of the saved stats."""
+        row = self._call(lambda: self.connection.execute(
+            "SELECT last_seq, user_stats, global_stats, rollups FROM snapshot WHERE id = 1"
+        ).fetchone())
+        if row is None:
+            return None
+        return row[0], fast_json.loads(row[1]), fast_json.loads(row[2]), fast_json.loads(row[3]) if row[3] is not None else None
+
+    def submit_commit(self, stats_data: tuple[dict, dict, dict] | None = None) -> Future:
+        """Queue a commit of the pending writes, together with a snapshot of the (user stats, global stats,
+        rollups) when they are given. They are serialized on the database thread."""
+        def write():
+            if stats_data is not None:
+                last_seq = self.connection.execute("SELECT COALESCE(MAX(seq), 0) FROM history").fetchone()[0]
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO snapshot (id, last_seq, user_stats, global_stats, rollups) VALUES (1, ?, ?, ?, ?)",
+                    (last_seq, *(fast_json.dumps(data) for data in stats_data))
+                )
+            self.connection.commit()
+        return self.executor.submit(write)
+
+    def close(self):
+        self._call(self.connection.close)
+        self.executor.shutdown()
@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import io
+import re
+from collections import OrderedDict
+from threading import Lock
+from PIL import Image
+
+import settings
+from settings import logger
+from core import fast_json
+
+
+class NormalizedReference:
+    """A vibe transfer reference image as it is sent to NovelAI.
+    Not a dataclass, orjson and msgspec would serialize those themselves instead of calling `default`."""
+    __slots__ = ("image_base64", "json_fragment")
+
+    def __init__(self, image_base64: str, json_fragment: bytes):
+        self.image_base64 = image_base64
+        self.json_fragment = json_fragment # The serialized image_base64, spliced into request bodies as-is
+
+# Normalized references by hash of the stored base64 image, least recently used first
+_cache: "OrderedDict[str, NormalizedReference]" = OrderedDict()
+_cache_lock = Lock() # Filled from worker threads
+
+def normalize_reference_bytes(image_bytes: bytes) -> bytes:
+    """Downscale a reference image to the size the vibe encoder works at and re-encode it as JPEG.
+    Returns the original bytes when that would not make them smaller."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.load()
+        if image.mode != "RGB":
+            # Flatten transparency onto white, JPEG has no alpha channel
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        image.thumbnail((settings.VIBE_REFERENCE_MAX_SIDE, settings.VIBE_REFERENCE_MAX_SIDE), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=settings.VIBE_REFERENCE_JPEG_QUALITY)
+    normalized = output.getvalue()
+    return normalized if len(normalized) < len(image_bytes) else image_bytes
+
+def normalize_reference_base64(image_base64: str) -> str:
+    try:
+        normalized = normalize_reference_bytes(base64.b64decode(image_base64))
+    except Exception as e:
+        logger.warning(f"Could not normalize vibe transfer reference, sending it unchanged: {str(e)}")
+        return image_base64
+    return base64.b64encode(normalized).decode("utf-8")
+
+def get_reference(image_base64: str) -> NormalizedReference:
+    """Return the normalized form of a stored reference image, normalizing it on first use."""
+    key = hashlib.sha256(image_base64.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        reference = _cache.get(key)
+        if reference is not None:
+            _cache.move_to_end(key)
+            return reference
+
+    normalized = normalize_reference_base64(image_base64)
+    reference = NormalizedReference(image_base64=normalized, json_fragment=fast_json.dumps(normalized))
+    with _cache_lock:
+        _cache[key] = reference
+        while len(_cache) > settings.VIBE_REFERENCE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return reference
+
+_PLACEHOLDER = "\x00ref{}\x00"
+_PLACEHOLDER_PATTERN = re.compile(rb'"\\u0000ref(\d+)\\u0000"')
+
+def dumps_with_fragments(data) -> bytes:
+    """Serialize `data`, with NormalizedReference values written from their cached JSON fragment
+    instead of escaping megabytes of base64 again."""
+    fragments = []
+
+    def placeholder(obj):
+        if isinstance(obj, NormalizedReference):
+            fragments.append(obj.json_fragment)
+            return _PLACEHOLDER.format(len(fragments) - 1)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    text = fast_json.dumps(data, default=placeholder)
+    if not fragments:
+        return text
+    # split() alternates between the JSON around the placeholders and their indexes
+    parts = _PLACEHOLDER_PATTERN.split(text)
+    for i in range(1, len(parts), 2):
+        parts[i] = fragments[int(parts[i])]
+    return b"".join(parts)
@@ -2,12 +2,16 @@ import discord
 from discord.ui import View, Button, Select
 import settings
 from settings import USER_VIBE_TRANSFER_DIR, logger, DATABASE_DIR, uuid, Globals
+import asyncio
+import io
 import base64
 import json
 import os
 import random
 from core.modalhandler import EditModal, AddModal, RemixModal, RenamePresetModal, DeletePresetModal # Import new modals
-from core.nai_utils import base64_to_image
+from core.nai_utils import base64_to_image, nai_command_string
+from core.nai_stats import stats_manager
+from core.history_thumbnails import thumbnail_cache, compose_page
 import core.dict_annotation as da
 from core.checking_params import check_params
 from core.nai_vars import Nai_vars
@@ -378,6 +382,30 @@ class VibeTransferPresetMenuView(View):
             await interaction.followup.send(f"Preset `{preset_name}` not found or data format is incorrect.", ephemeral=True)
 
 
+class CancelRequestView(View):
+    def __init__(self, bundle_data: da.BundleData):
+        super().__init__(timeout=None) # Stopped by the queue once the request is finished
+        self.bundle_data = bundle_data
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        """Only allow the requester to cancel the request."""
+        if interaction.user.id != self.bundle_data["interaction"].user.id:
+            await interaction.response.send_message("Only the requester can cancel this request.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(emoji="✖️",
+                        style=discord.ButtonStyle.danger,
+                        label="Cancel")
+    async def cancel(self, interaction: discord.Interaction, button: Button):
+        logger.info(f"Cancel button pressed by {interaction.user.name} ({interaction.user.id})")
+        await interaction.response.defer()
+        from core.queuehandler import nai_queue
+        from core.queuehandler import NAIQueue
+        nai_queue: NAIQueue
+        if await nai_queue.cancel_request(self.bundle_data["request_id"]) is None:
+            await interaction.followup.send("This request has already finished.", ephemeral=True)
+
 class RemixView(View):
     def __init__(self, bundle_data: da.BundleData, forward_channel: discord.TextChannel):
         super().__init__(timeout=600)
@@ -855,3 +883,102 @@ class SelectMenuView(View):
         except discord.HTTPException as e:
             logger.error(f"Failed to edit message on timeout: {e}")
             pass
+
+
+class HistoryView(View):
+    """Pages of a user's generation history, newest first. Each page is an embed listing its generations
+    and one composite image of their thumbnails. Pages are read with a keyset cursor, so going to the
+    next one costs the same however far back it is. Without show_images, the composite only has placeholders."""
+    def __init__(self, bot: discord.Client, requester_id: int, target_user: discord.User, show_images: bool = True):
+        super().__init__(timeout=600)
+        self.bot = bot
+        self.requester_id = requester_id
+        self.target_user = target_user
+        self.show_images = show_images
+        self.cursors = [None] # Cursor of each page up to the current one, None is the newest page
+        self.next_cursor = None
+        self.entries = []
+        self.message: discord.Message | None = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        """Only allow the user who opened the history to browse it."""
+        if interaction.user.id != self.requester_id:
+            await interaction.response.send_message("Use /nai-history to browse your own history.", ephemeral=True)
+            return False
+        return True
+
+    async def load_page(self) -> tuple[discord.Embed, discord.File] | None:
+        """Embed and composite image of the page at self.cursors[-1], None when there is nothing to show."""
+        self.entries, self.next_cursor = stats_manager.get_user_history_page(self.target_user.id, self.cursors[-1], settings.HISTORY_PAGE_SIZE)
+        if not self.entries:
+            return None
+        first_number = (len(self.cursors) - 1) * settings.HISTORY_PAGE_SIZE + 1
+
+        embed = discord.Embed(title=f"🎨 Generation History for {self.target_user.name}", color=discord.Color.blue())
+        for number, gen in enumerate(self.entries, first_number):
+            params = gen.parameters
+            status = "✅" if gen.result.success else "❌"
+            prompt = params.positive_prompt if len(params.positive_prompt) <= 150 else params.positive_prompt[:150] + "..."
+            value = f"`{params.model}` `{params.width}x{params.height}` Seed: `{params.seed}`\n{prompt}"
+            if gen.result.error_message:
+                value += f"\nError: `{gen.result.error_message[:100]}`"
+            embed.add_field(name=f"#{number} {status} {gen.timestamp[:16].replace('T', ' ')}", value=value[:1024], inline=False)
+        embed.set_footer(text=f"Page {len(self.cursors)} | Generations {first_number}-{first_number + len(self.entries) - 1}")
+
+        if self.show_images:
+            thumbnails = await asyncio.gather(*(thumbnail_cache.get(self.bot, gen.result.database_message_id) for gen in self.entries))
+            placeholder = "No image"
+        else:
+            thumbnails = [None] * len(self.entries)
+            placeholder = "Hidden"
+        labels = [f"#{number}" for number in range(first_number, first_number + len(self.entries))]
+        page_image = await asyncio.to_thread(compose_page, thumbnails, labels, placeholder)
+        embed.set_image(url="attachment://history.jpg")
+
+        self.newer.disabled = len(self.cursors) == 1
+        self.older.disabled = self.next_cursor is None
+        return embed, discord.File(io.BytesIO(page_image), filename="history.jpg")
+
+    async def show_page(self, interaction: discord.Interaction):
+        await interaction.response.defer()
+        page = await self.load_page()
+        if page is None:
+            await interaction.followup.send("No more generations to show.", ephemeral=True)
+            return
+        embed, file = page
+        await interaction.edit_original_response(embed=embed, attachments=[file], view=self)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary, label="Newer")
+    async def newer(self, interaction: discord.Interaction, button: Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self.show_page(interaction)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary, label="Older")
+    async def older(self, interaction: discord.Interaction, button: Button):
+        if self.next_cursor is not None:
+            self.cursors.append(self.next_cursor)
+        await self.show_page(interaction)
+
+    @discord.ui.button(emoji="📋", style=discord.ButtonStyle.primary, label="Commands")
+    async def show_commands(self, interaction: discord.Interaction, button: Button):
+        """Send the /nai commands that repeat the generations of the current page."""
+        await interaction.response.defer(ephemeral=True)
+        first_number = (len(self.cursors) - 1) * settings.HISTORY_PAGE_SIZE + 1
+        for number, gen in enumerate(self.entries, first_number):
+            await interaction.followup.send(f"Command for Generation #{number}:\n```{nai_command_string(gen.parameters)[:1900]}```", ephemeral=True)
+
+    async def on_timeout(self):
+        self.stop()
+        if self.message is None:
+            return
+        try:
+            for child in self.children:
+                child: Button
+                child.disabled = True
+            await self.message.edit(view=self)
+        except discord.NotFound:
+            # Message has already been deleted
+            pass
+        except discord.HTTPException as e:
+            logger.error(f"Failed to edit message on timeout: {e}")
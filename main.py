@@ -4,6 +4,7 @@ import asyncio
 from discord.ext import commands
 from settings import logger
 import core.queuehandler as queuehandler
+from core.nai_stats import stats_manager
 import json
 import os
 from contextmenu import image_contextmenu
@@ -35,6 +36,10 @@ async def on_ready():
     # Start queuehandler
     await queuehandler.start_queue(bot)
 
+    # Load the stats in the background, then start writing them behind
+    stats_manager.start_loading()
+    stats_manager.start_flusher()
+
     # load cogs from cog 
     for cog_file in settings.COGS_DIR.glob("*cog.py"):
         if cog_file.name != "__init__.py":
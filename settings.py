@@ -69,6 +69,67 @@ SERVER_WHITELIST = [SERVER_ID_TEST, ANIMEAI_SERVER, 1125398871904891072, 1295481
 
 DEVELOPER_SERVERS_LIST= [409959440616390668, 1157816835975151706]
 
+# Deadline budgets (in seconds) for NovelAI and Discord calls made by queued jobs
+NAI_CONNECT_TIMEOUT = float(os.getenv("NAI_CONNECT_TIMEOUT", 15))
+NAI_FIRST_BYTE_TIMEOUT = float(os.getenv("NAI_FIRST_BYTE_TIMEOUT", 120))
+NAI_STREAM_IDLE_TIMEOUT = float(os.getenv("NAI_STREAM_IDLE_TIMEOUT", 30))
+NAI_TOTAL_TIMEOUT = float(os.getenv("NAI_TOTAL_TIMEOUT", 180))
+DISCORD_CALL_TIMEOUT = float(os.getenv("DISCORD_CALL_TIMEOUT", 30))
+JOB_TOTAL_DEADLINE = float(os.getenv("JOB_TOTAL_DEADLINE", 900)) # Whole job, retries included
+JOB_WATCHDOG_INTERVAL = 5
+INTERACTION_TOKEN_LIFETIME = 15 * 60 # Discord interaction tokens (and the responses edited through them) expire after this
+INTERACTION_TOKEN_MARGIN = 60 # Responses are moved to a channel message this long before the token expires
+
+# Admission control: queue load at which new requests are degraded or shed
+ADMISSION_TARGET_WAIT = float(os.getenv("ADMISSION_TARGET_WAIT", 300)) # p95 latency target, requests predicted past it are shed
+ADMISSION_DEGRADE_WAIT = float(os.getenv("ADMISSION_DEGRADE_WAIT", 120)) # Past this, streaming is disabled and upscales are deferred
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", 30))
+LOW_PRIORITY_MAX_WAIT = float(os.getenv("LOW_PRIORITY_MAX_WAIT", 600)) # Deferred jobs run after this long even under load
+JOB_DURATION_DEFAULTS = {"txt2img": 20.0, "txt2img_upscale": 35.0, "director_tools": 15.0} # Seeds for the run time averages
+
+DIRECTOR_TOOLS_CONCURRENCY = int(os.getenv("DIRECTOR_TOOLS_CONCURRENCY", 3)) # Augmentations of one batch sent to NovelAI at once
+PREFETCH_BYTE_BUDGET = int(os.getenv("PREFETCH_BYTE_BUDGET", 64 * 1024 * 1024)) # Memory for attachments fetched while their job waits
+
+# Vibe transfer references are downscaled before they are sent, the vibe encoder works at a much lower resolution
+VIBE_REFERENCE_MAX_SIDE = int(os.getenv("VIBE_REFERENCE_MAX_SIDE", 768))
+VIBE_REFERENCE_JPEG_QUALITY = 90
+VIBE_REFERENCE_CACHE_SIZE = 64 # Normalized references kept in memory
+JSON_OFFLOOP_THRESHOLD = 2 * 1024 * 1024 # Request bodies at least this large are serialized in a worker thread
+
+# /nai-history pages
+HISTORY_PAGE_SIZE = 9 # Generations per page, shown as a 3x3 grid
+HISTORY_THUMBNAIL_DIR = DATABASE_DIR / "history_thumbnails" # Thumbnails of database channel images, by message ID
+HISTORY_THUMBNAIL_SIZE = 256 # Longest side of a thumbnail
+HISTORY_THUMBNAIL_CACHE_FILES = int(os.getenv("HISTORY_THUMBNAIL_CACHE_FILES", 20000)) # Oldest thumbnails are deleted past this
+HISTORY_THUMBNAIL_FETCHES = 5 # Database messages fetched at once
+
+# Anlas cost model and budgets (0 disables a budget)
+NAI_OPUS_SUBSCRIPTION = os.getenv("NAI_OPUS_SUBSCRIPTION", "true").lower() == "true" # Opus generates up to 1024x1024 at 28 steps for free
+ANLAS_USER_HOURLY_BUDGET = int(os.getenv("ANLAS_USER_HOURLY_BUDGET", 50))
+ANLAS_USER_DAILY_BUDGET = int(os.getenv("ANLAS_USER_DAILY_BUDGET", 200))
+ANLAS_GUILD_HOURLY_BUDGET = int(os.getenv("ANLAS_GUILD_HOURLY_BUDGET", 200))
+ANLAS_GUILD_DAILY_BUDGET = int(os.getenv("ANLAS_GUILD_DAILY_BUDGET", 1000))
+ANLAS_USAGE_FILE = DATABASE_DIR / "anlas_usage.json"
+SCHEDULER_LOOKAHEAD = 4 # Waiting jobs the scheduler compares to pick the cheapest
+SCHEDULER_MAX_DEFER = float(os.getenv("SCHEDULER_MAX_DEFER", 120)) # Jobs waiting longer than this run in arrival order
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", 2)) # Threads drawing the /nai-stats charts
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", 256)) # Rendered chart PNGs kept in memory
+
+# Stats history log
+STATS_LOG_DIR = STATS_DIR / "history_log" # Append-only JSONL segments of generation history
+STATS_SNAPSHOT_FILE = STATS_DIR / "nai_stats_snapshot.json" # User and global stats as of a position in the log
+STATS_SEGMENT_MAX_BYTES = int(os.getenv("STATS_SEGMENT_MAX_BYTES", 16 * 1024 * 1024)) # A new segment is started past this size
+STATS_SNAPSHOT_EVERY = int(os.getenv("STATS_SNAPSHOT_EVERY", 500)) # Log records appended between snapshots
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", 10)) # Seconds a change may wait before it is written
+STATS_FLUSH_MAX_CHANGES = int(os.getenv("STATS_FLUSH_MAX_CHANGES", 50)) # Changes that are written without waiting for the interval
+STATS_FSYNC = os.getenv("STATS_FSYNC", "snapshot").lower() # "always" (every flush), "snapshot" (snapshots only) or "never"
+STATS_BACKEND = os.getenv("STATS_BACKEND", "log").lower() # "log" keeps history in memory, "sqlite" in STATS_DB_FILE
+STATS_DB_FILE = STATS_DIR / "nai_stats.sqlite3"
+STATS_ROLLUP_HOURS = int(os.getenv("STATS_ROLLUP_HOURS", 24 * 14)) # Hours of hourly usage rollups kept, daily and monthly ones cover older usage
+STATS_ROLLUP_DAYS = int(os.getenv("STATS_ROLLUP_DAYS", 400)) # Days of daily usage rollups kept
+STATS_USER_ROLLUP_DAYS = int(os.getenv("STATS_USER_ROLLUP_DAYS", 62)) # Days of per-user daily counts kept for the windowed leaderboards, at least 31
+STATUS_LATENCY_MODELS = 3 # Models with the most generations whose latency /status shows
+
 # Define custom formatter for colored console output
 class ColoredFormatter(logging.Formatter):
     COLORS = {